@@ -0,0 +1,115 @@
+# A minimal ASGI application serving the bancho POST endpoint directly,
+# skipping the routing and response machinery of the web framework. Anything
+# else is passed on to the full application.
+from typing import (
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional,
+    Union,
+)
+from .main_handler import handle_post
+from logger import error
+import traceback
+
+Scope = dict
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+_ERROR_BODY = b"Internal Server Error"
+
+class BanchoASGIApp:
+    """Serves osu! client POST requests to the bancho hosts, falling back
+    to the `fallback` application for all other requests and ASGI events
+    (such as lifespan).
+
+    Note:
+        The response body is sent as the queued `bytearray`, without being
+            copied into `bytes`.
+    """
+
+    __slots__ = (
+        "_hosts",
+        "_fallback",
+    )
+
+    def __init__(self, hosts: Iterable[str], fallback: ASGIApp) -> None:
+        self._hosts = frozenset(host.encode() for host in hosts)
+        self._fallback = fallback
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] != "/"
+        ):
+            return await self._fallback(scope, receive, send)
+
+        # Header names are always lowercase in ASGI.
+        headers = dict(scope["headers"])
+        host = headers.get(b"host", b"").partition(b":")[0]
+        # Browsers are shown the bancho page by the fallback.
+        if host not in self._hosts or headers.get(b"user-agent") != b"osu!":
+            return await self._fallback(scope, receive, send)
+
+        if (body := await _read_body(receive)) is None:
+            # The client disconnected.
+            return
+
+        try:
+            data, token = await handle_post(
+                {
+                    name.decode("latin-1"): value.decode("latin-1")
+                    for name, value in headers.items()
+                },
+                body,
+            )
+        except Exception:
+            error("Unhandled exception serving a bancho request!\n%s",
+                  traceback.format_exc())
+            return await _send_response(send, 500, _ERROR_BODY, b"no")
+
+        await _send_response(
+            send,
+            200,
+            data,
+            token.encode() if token else b"no",
+        )
+
+async def _read_body(receive: Receive) -> Optional[bytes]:
+    """Reads the full request body, returning `None` if the client
+    disconnected first."""
+
+    message = await receive()
+    if message["type"] == "http.disconnect":
+        return None
+
+    body = message.get("body", b"")
+    if not message.get("more_body", False):
+        return body
+
+    chunks = [body]
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+async def _send_response(send: Send, status: int, body: Union[bytes, bytearray],
+                         token: bytes) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-length", str(len(body)).encode()),
+            (b"cho-token", token),
+        ],
+    })
+    await send({
+        "type": "http.response.body",
+        "body": body,
+    })
@@ -0,0 +1,59 @@
+# Packet events related to the presences and stats of other users.
+from handlers.bancho.packets import packet_router
+from packets.constants import PacketID
+from packets.types import (
+    i32,
+    u8,
+    u32,
+)
+from scores.constants.mode import Mode
+from user.client.components.action import Action
+from user.client.components.constants.actions import Actions
+from user.user import User
+from state import repos
+
+@packet_router.register(PacketID.OSU_USER_STATS_REQUEST)
+async def user_stats_request(user: User, user_ids: list[i32]) -> bytearray:
+    """Sends the stats of the requested online users."""
+
+    return await repos.online.stats_of(user_ids)
+
+@packet_router.register(PacketID.OSU_USER_PRESENCE_REQUEST)
+async def user_presence_request(user: User, user_ids: list[i32]) -> bytearray:
+    """Sends the presences of the requested online users."""
+
+    return await repos.online.presences_of(user_ids)
+
+@packet_router.register(PacketID.OSU_USER_PRESENCE_REQUEST_ALL)
+async def user_presence_request_all(user: User, ingame_time: i32) -> bytearray:
+    """Sends the presences of all online users."""
+
+    return await repos.online.presences_of()
+
+@packet_router.register(PacketID.OSU_CHANGE_ACTION)
+async def change_action(user: User, action: u8, text: str, bmap_md5: str,
+                        mods: u32, mode: u8, bmap_id: i32) -> bytearray:
+    """Updates the current action of the user, sharing their new stats with
+    everyone online."""
+
+    try:
+        new_action = Action(
+            id= Actions(action),
+            _text= text,
+            bmap= None, # TODO: Look up `bmap_md5` once beatmaps are implemented.
+            mode= Mode(mode),
+            c_mode= user.client.action.c_mode,
+            mods= mods,
+        )
+    except ValueError:
+        return bytearray()
+
+    user.client.action = new_action
+    await repos.online.update_user(user)
+    return bytearray()
+
+@packet_router.register(PacketID.OSU_REQUEST_STATUS_UPDATE)
+async def request_status_update(user: User) -> bytearray:
+    """Sends the user their own current stats."""
+
+    return await repos.online.stats_of([user.id])
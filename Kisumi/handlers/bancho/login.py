@@ -2,22 +2,76 @@ from packets.constants import LoginReply
 from user.client.components.hwid import StableHWID
 from user.client.client import StableClient
 from packets import builders as packet
-from state import repos
-from fastapi.requests import Request
+from state import repos, config
+from localisation.constants.language import LocalisedMessage
 from typing import Optional
-from utils.request import geolocate_request
-from utils.hash import hash_md5
+from utils import metrics
 from models.request.login import LoginRequestModel
 
+_LOGIN_STAGE_SECONDS = metrics.histogram(
+    "kisumi_login_stage_seconds",
+    "Time spent in each stage of the login process.",
+    labels= ("stage",),
+)
+_LOGINS = metrics.counter(
+    "kisumi_logins_total",
+    "Login attempts, by their result.",
+    labels= ("result",),
+)
+
+async def _online_elsewhere(user_id: int) -> bool:
+    """Checks if the user is online on another node of the cluster.
+
+    Note:
+        Only a quick check before the login is processed, the user is
+            claimed atomically once authenticated.
+    """
+
+    if repos.cluster is None:
+        return False
+
+    node_id = await repos.cluster.owner(user_id)
+    return node_id is not None and node_id != repos.cluster.node_id
+
+async def _authenticate_and_attach(
+    client: StableClient,
+    password_md5: str,
+) -> Optional[str]:
+    """Authenticates `client`, attaching it to its user if successful. Ran by
+    the user's actor, so concurrent logins of the same user can not both
+    attach.
+
+    Returns:
+        The name of the failed result, if it failed.
+        Else `None`.
+    """
+
+    # Another login may have finished while this one was being prepared.
+    if await client.user.clients.stable_client():
+        return "already_online"
+
+    with _LOGIN_STAGE_SECONDS.labels("auth").time():
+        authenticated = await client.auth.authenticate(password_md5)
+    if not authenticated:
+        return "bad_password"
+
+    # Another node may have claimed the user since the early check.
+    if repos.cluster is not None and not await repos.cluster.claim(client.user.id):
+        return "already_online"
+
+    with _LOGIN_STAGE_SECONDS.labels("attach").time():
+        await client.user.clients.attach(client)
+
 async def login_handle(
-    request: Request,
+    body: bytes,
+    ip: Optional[str],
 ) -> tuple[bytearray, Optional[str]]:
-    """Handles the authentication process."""
+    """Handles the authentication process for the login request `body`
+    sent from `ip`."""
 
     # Parse data.
-    login_data = LoginRequestModel.from_req_body(
-        (await request.body()).decode(),
-    )
+    with _LOGIN_STAGE_SECONDS.labels("parse").time():
+        login_data = LoginRequestModel.from_req_body(body.decode())
     hwid = StableHWID( # TODO: from_login()
         client_md5= login_data.osu_path_md5,
         adapter= login_data.adapters,
@@ -25,22 +79,29 @@ async def login_handle(
         uninstaller_md5= login_data.uninstall_md5,
         serial_md5= login_data.serial_md5,
     )
-    user_id = 1000
 
     # Fetch user object.
-    user = await repos.user_manager.get_user(user_id)
+    with _LOGIN_STAGE_SECONDS.labels("user").time():
+        user = await repos.user_manager.get_user_by_name(login_data.username)
 
-    if await user.clients.stable_client():
+    if user is None:
+        _LOGINS.labels("unknown_user").inc()
+        return packet.login_reply(LoginReply.FAILED), None
+
+    if await user.clients.stable_client() or await _online_elsewhere(user.id):
+        _LOGINS.labels("already_online").inc()
         return (
-              packet.notification("You already seem to have been logged in...")
+              repos.locale.notification(
+                user.settings.language,
+                LocalisedMessage.ALREADY_ONLINE,
+            )
             + packet.login_reply(LoginReply.FAILED)
         ), None
 
-    if user is None:
-        return packet.login_reply(LoginReply.FAILED), None
-
-    # Create client from data
-    location = await geolocate_request(request)
+    # Create client from data. Unknown addresses get the default location
+    # rather than failing the login.
+    with _LOGIN_STAGE_SECONDS.labels("geolocation").time():
+        location = await repos.geoloc.from_ip(ip)
     location.set_time_zone(login_data.utc_timezone)
     client = await StableClient.from_login(
         user= user,
@@ -50,22 +111,33 @@ async def login_handle(
     )
 
     # Auth
-    if not await client.auth.authenticate(hash_md5("bruhh")):
+    failure = await user.actor.run(
+        _authenticate_and_attach,
+        client,
+        login_data.password_md5,
+    )
+    if failure is not None:
+        _LOGINS.labels(failure).inc()
         return packet.login_reply(LoginReply.FAILED), None
 
-    await user.clients.attach(client)
-
     # Send the user info about the server.
-    await client.queue.append(
-          packet.heartbeat()
-        + packet.login_reply(user.id)
-        + packet.notification("Hello, world!")
-        + packet.channel_info_end()
-        + packet.stats_client(client)
-        + packet.protocol_ver(19)
-    )
+    with _LOGIN_STAGE_SECONDS.labels("response").time():
+        await client.queue.append(
+              packet.heartbeat()
+            + packet.login_reply(user.id)
+            + repos.locale.notification(
+                user.settings.language,
+                LocalisedMessage.WELCOME_TEXT_1,
+                config.SERVER_NAME,
+                len(repos.online),
+            )
+            + packet.channel_info_end()
+            + packet.stats_client(client)
+            + packet.protocol_ver(19)
+        )
 
-    # Grant authentication token
-    token = client.auth.generate_jwt()
+        # Grant authentication token
+        token = client.auth.generate_jwt()
 
+    _LOGINS.labels("success").inc()
     return await client.queue.clear(), token
@@ -1,54 +1,137 @@
-from .router import router
 from fastapi.requests import Request
 from fastapi.responses import (
     PlainTextResponse,
     Response,
 )
-from user.token import decode_jwt_str
-from state import config
-from packets.builders import login_reply
-from packets.constants import LoginReply
+from user.sessions import client_from_token
+from state import config, repos
+from packets.builders import login_reply, restart
+from packets.constants import LoginReply, PacketID
+from packets.writer import BinaryWriter
 from .login import login_handle
-from logger import error
+from .packets import process_packets
+# Registers the packet handlers.
+from .events import presence as _presence_events
+from logger import error, info, LogSampler
+from utils import capture, metrics
+from typing import Mapping, Optional
 import traceback
+import time
+
+# Decides which requests are logged, as logging them all is too noisy.
+_request_sampler = LogSampler(config.LOG_REQUEST_SAMPLE_RATE)
+
+_IDLE_POLLS = metrics.counter(
+    "kisumi_idle_polls_total",
+    "Polls without any packets to handle, by whether anything was queued.",
+    labels= ("queued",),
+)
+
+_IDLE_POLLS_EMPTY = _IDLE_POLLS.labels("no")
+_IDLE_POLLS_QUEUED = _IDLE_POLLS.labels("yes")
+
+# Clients with nothing to send either poll with an empty body or a heartbeat.
+_IDLE_BODIES = frozenset((
+    b"",
+    bytes(BinaryWriter().finish(PacketID.OSU_HEARTBEAT)),
+))
+_IDLE_BODY_MAX = max(map(len, _IDLE_BODIES))
 
 # The page people get if they access this from their web browser.
-@router.route("/", methods= ["GET"])
 async def main_get(req: Request) -> PlainTextResponse:
     return PlainTextResponse(
         f"{config.SERVER_NAME} - Powered by Kisumi!"
     )
 
-@router.route("/", methods= ["POST"])
-async def main_post(req: Request) -> Response:
-    """The main handler for post requests to the bancho server."""
+async def handle_post(headers: Mapping[str, str],
+                      body: bytes) -> tuple[bytearray, Optional[str]]:
+    """Handles a POST request from an osu! client, independent of the web
+    framework.
 
-    # Only allow osu! clients past this point.
-    if req.headers.get("User-Agent") != "osu!":
-        return await main_get(req)
+    Args:
+        headers (Mapping): The request headers, by their lowercase names.
+        body (bytes): The request body.
+
+    Returns:
+        Tuple of the response body and the `cho-token` to respond with
+            (`None` if the client has no session).
+    """
+
+    # Only timed while capturing, to keep the overhead off the hot path.
+    if (traffic := capture.current()) is not None:
+        started = time.time()
+        started_perf = time.perf_counter()
 
     # Select whether this is a login request or a packet request.
-    jwt_str = req.headers.get("osu-token")
-    jwt_dec = decode_jwt_str(jwt_str) if jwt_str else None
+    jwt_str = headers.get("osu-token")
 
     # Packet request.
     if jwt_str:
-        data = b""
-        token = jwt_str
-        ...
+        client = await client_from_token(jwt_str)
+
+        # The session is unknown (eg expired), make the client log in again.
+        if client is None:
+            data = restart(0)
+            token = None
+        else:
+            # Only read by the session reaper.
+            if config.SESSION_TIMEOUT:
+                repos.activity.touch(client.id)
+            token = jwt_str
+
+            # Idle polls skip the packet handling, and with nothing queued,
+            # the queue swap.
+            if len(body) <= _IDLE_BODY_MAX and body in _IDLE_BODIES:
+                if client.queue.empty:
+                    _IDLE_POLLS_EMPTY.inc()
+                    data = bytearray()
+                else:
+                    _IDLE_POLLS_QUEUED.inc()
+                    data = await client.queue.clear()
+            else:
+                await process_packets(client, body)
+                data = await client.queue.clear()
     # Login attempt
     else:
         try:
-            data, token = await login_handle(req)
+            data, token = await login_handle(body, headers.get("x-real-ip"))
         except Exception:
-            error("An error occured during login!"
-                  + traceback.format_exc())
+            error("An error occured during login!\n%s", traceback.format_exc())
             data = login_reply(LoginReply.BANCHO_ERROR)
             token = None
 
-    print(data)
-    print(f"{token!r}")
-        
+    # Sessions are sampled by their token so they are recorded in full.
+    session_key = jwt_str or token
+    if traffic is not None and traffic.sampled(
+        session_key.encode() if session_key else body
+    ):
+        traffic.record(
+            started,
+            time.perf_counter() - started_perf,
+            list(headers.items()),
+            body,
+            token,
+            bytes(data),
+        )
+
+    if _request_sampler.sample():
+        info(
+            "POST / (%s) -> %d bytes",
+            "packets" if jwt_str else "login",
+            len(data),
+        )
+
+    return data, token
+
+async def main_post(req: Request) -> Response:
+    """The main handler for post requests to the bancho server, used when
+    they are not served by `BanchoASGIApp`."""
+
+    # Only allow osu! clients past this point.
+    if req.headers.get("User-Agent") != "osu!":
+        return await main_get(req)
+
+    data, token = await handle_post(req.headers, await req.body())
     return Response(
         content= bytes(data),
         headers= {
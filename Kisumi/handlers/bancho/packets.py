@@ -0,0 +1,61 @@
+# Processing of the packets sent by authenticated stable clients.
+from packets.router import PacketRouter
+from packets.reader import BinaryReader
+from packets.constants import PacketID
+from logger import debug
+from utils import metrics
+from typing import TYPE_CHECKING
+import struct
+
+if TYPE_CHECKING:
+    from user.client.client import StableClient
+
+# The router all stable packet handlers are registered to.
+packet_router = PacketRouter()
+
+_PACKETS_RECEIVED = metrics.counter(
+    "kisumi_packets_received_total",
+    "Packets received from stable clients, by packet.",
+    labels= ("packet",),
+)
+_MALFORMED_BODIES = metrics.counter(
+    "kisumi_malformed_packet_bodies_total",
+    "Request bodies that could not be read as packets.",
+)
+
+def _packet_label(p_id: int) -> str:
+    """Names the packet ID without allowing for unbounded label values."""
+
+    try:
+        return PacketID(p_id).name
+    except ValueError:
+        return "UNKNOWN"
+
+async def process_packets(client: "StableClient", body: bytes) -> None:
+    """Reads all packets from the request `body`, calling the handlers
+    registered for them. Responses returned by handlers are queued for the
+    client. Packets without a handler are skipped."""
+
+    reader = BinaryReader(body)
+
+    while not reader.empty:
+        try:
+            p_id, length = reader.read_osu_header()
+        except (AssertionError, IndexError, struct.error):
+            debug("Received a malformed packet body from %s.", client.user.name)
+            _MALFORMED_BODIES.inc()
+            return
+
+        # Each handler gets a reader of just its own packet, so a misread
+        # cannot affect the following packets.
+        data = reader.read_bytes(length)
+        _PACKETS_RECEIVED.labels(_packet_label(p_id)).inc()
+
+        if (handler := packet_router.fetch_handler(p_id)) is None:
+            continue
+
+        if not handler.meets_privileges(client.user):
+            continue
+
+        if resp := await handler.call(client.user, BinaryReader(data)):
+            await client.queue.append(resp)
@@ -1,3 +1,14 @@
 from fastapi.routing import APIRouter
+from .main_handler import (
+    main_get,
+    main_post,
+)
 
-router = APIRouter()
+def create_router() -> APIRouter:
+    """Creates the router for the bancho domains, registering all of its
+    routes."""
+
+    router = APIRouter()
+    router.add_route("/", main_get, methods= ["GET"])
+    router.add_route("/", main_post, methods= ["POST"])
+    return router
@@ -0,0 +1,154 @@
+from fastapi.requests import Request
+from fastapi.responses import PlainTextResponse, JSONResponse
+from utils.profiler import profile, ProfileInProgress
+from utils.memory import (
+    AllocationTracker,
+    cache_usage,
+    gc_usage,
+    type_usage,
+)
+from user.user import User
+from user.stats import Stats, ModeStats
+from user.client.client import StableClient
+from user.client.components.queue import ByteBuffer
+from utils import capture
+from state import repos, config
+from logger import info
+import asyncio
+
+# The types reported by the memory endpoint. `None` means shallow sizing.
+_TRACKED_TYPES = {
+    User: None,
+    Stats: None,
+    ModeStats: None,
+    StableClient: None,
+    # Includes the queued contents.
+    ByteBuffer: ByteBuffer.__sizeof__,
+}
+
+_allocations = AllocationTracker()
+# The most frames stored per traced allocation, as each costs memory.
+_MAX_FRAMES = 64
+
+async def profile_get(req: Request) -> PlainTextResponse:
+    """Profiles the server for `?seconds=` (default 10), returning the result
+    as folded stacks, to be rendered by any flamegraph tool."""
+
+    try:
+        seconds = float(req.query_params.get("seconds", 10))
+        interval_ms = float(req.query_params.get("interval_ms", 5))
+    except ValueError:
+        return PlainTextResponse("Invalid profile parameters.", status_code= 400)
+
+    info("Starting a %.0fs CPU profile.", seconds)
+    try:
+        folded, samples, timer = await profile(seconds, interval_ms / 1e+3)
+    except ProfileInProgress:
+        return PlainTextResponse("A profile is already running.", status_code= 409)
+
+    info("Completed a CPU profile of %d samples in %s.", samples, timer.time_dif_str)
+    return PlainTextResponse(
+        folded,
+        headers= {
+            "X-Profile-Samples": str(samples),
+            "X-Profile-Duration": timer.time_dif_str,
+        },
+    )
+
+async def memory_get(req: Request) -> JSONResponse:
+    """Reports the memory usage of each subsystem."""
+
+    # Walking every object takes a while on large heaps.
+    loop = asyncio.get_running_loop()
+    types = await loop.run_in_executor(None, type_usage, _TRACKED_TYPES)
+
+    return JSONResponse({
+        "types": [usage.__dict__ for usage in types],
+        "caches": cache_usage(),
+        "repos": {
+            "online": len(repos.online),
+            "user_manager": len(repos.user_manager),
+            "resources": len(repos.resources),
+        },
+        "gc": gc_usage(),
+        "tracing": _allocations.tracing,
+    })
+
+async def memory_snapshot_post(req: Request) -> JSONResponse:
+    """Takes a new baseline allocation snapshot, starting tracing if needed.
+    Takes the number of frames stored per allocation (1-64) as `?frames=`."""
+
+    try:
+        frames = int(req.query_params.get("frames", 1))
+    except ValueError:
+        return JSONResponse({"error": "Invalid frame count."}, status_code= 400)
+
+    loop = asyncio.get_running_loop()
+    traces = await loop.run_in_executor(
+        None,
+        _allocations.snapshot,
+        min(max(frames, 1), _MAX_FRAMES),
+    )
+    return JSONResponse({"traces": traces})
+
+async def memory_diff_get(req: Request) -> PlainTextResponse:
+    """Compares the current allocations against the baseline snapshot,
+    taking `?limit=` and `?group_by=` (lineno, filename or traceback)."""
+
+    group_by = req.query_params.get("group_by", "lineno")
+    if group_by not in ("lineno", "filename", "traceback"):
+        return PlainTextResponse("Invalid grouping.", status_code= 400)
+
+    try:
+        limit = int(req.query_params.get("limit", 25))
+    except ValueError:
+        return PlainTextResponse("Invalid limit.", status_code= 400)
+
+    loop = asyncio.get_running_loop()
+    try:
+        lines = await loop.run_in_executor(None, _allocations.diff, limit, group_by)
+    except RuntimeError:
+        return PlainTextResponse("Take a snapshot first.", status_code= 409)
+
+    return PlainTextResponse("\n".join(lines))
+
+async def memory_stop_post(req: Request) -> PlainTextResponse:
+    """Stops tracing allocations, removing its overhead."""
+
+    _allocations.stop()
+    return PlainTextResponse("Stopped tracing allocations.")
+
+async def capture_start_post(req: Request) -> JSONResponse:
+    """Starts capturing bancho traffic into the configured capture path,
+    sampling the `?rate=` fraction of sessions."""
+
+    try:
+        rate = float(req.query_params.get("rate", config.CAPTURE_SAMPLE_RATE))
+    except ValueError:
+        return JSONResponse({"error": "Invalid sample rate."}, status_code= 400)
+
+    try:
+        traffic = capture.start(config.CAPTURE_PATH, rate)
+    except RuntimeError:
+        return JSONResponse({"error": "Already capturing."}, status_code= 409)
+    except OSError as e:
+        return JSONResponse({"error": f"Failed opening the capture: {e}"}, status_code= 500)
+
+    return JSONResponse({
+        "path": str(traffic.path),
+        "sample_rate": traffic.sample_rate,
+    })
+
+async def capture_stop_post(req: Request) -> JSONResponse:
+    """Stops capturing bancho traffic, once all of its records are written."""
+
+    # Waits for the capture thread to write the remaining records.
+    loop = asyncio.get_running_loop()
+    if (traffic := await loop.run_in_executor(None, capture.stop)) is None:
+        return JSONResponse({"error": "Not capturing."}, status_code= 409)
+
+    return JSONResponse({
+        "path": str(traffic.path),
+        "records": traffic.records,
+        "dropped": traffic.dropped,
+    })
@@ -0,0 +1,24 @@
+from fastapi.routing import APIRouter
+from .main_handler import (
+    profile_get,
+    memory_get,
+    memory_snapshot_post,
+    memory_diff_get,
+    memory_stop_post,
+    capture_start_post,
+    capture_stop_post,
+)
+
+def create_router() -> APIRouter:
+    """Creates the router for the debug server, registering all of its
+    routes."""
+
+    router = APIRouter()
+    router.add_route("/debug/profile", profile_get, methods= ["GET"])
+    router.add_route("/debug/memory", memory_get, methods= ["GET"])
+    router.add_route("/debug/memory/snapshot", memory_snapshot_post, methods= ["POST"])
+    router.add_route("/debug/memory/diff", memory_diff_get, methods= ["GET"])
+    router.add_route("/debug/memory/stop", memory_stop_post, methods= ["POST"])
+    router.add_route("/debug/capture/start", capture_start_post, methods= ["POST"])
+    router.add_route("/debug/capture/stop", capture_stop_post, methods= ["POST"])
+    return router
@@ -0,0 +1,14 @@
+from fastapi.requests import Request
+from fastapi.responses import PlainTextResponse
+from utils.metrics import REGISTRY
+
+# The content type of the Prometheus text exposition format.
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+async def metrics_get(req: Request) -> PlainTextResponse:
+    """Exposes all of the registered metrics to be scraped."""
+
+    return PlainTextResponse(
+        await REGISTRY.render(),
+        media_type= _CONTENT_TYPE,
+    )
@@ -10,4 +10,5 @@ class LocalisedMessage(StrEnum):
     """String enumerations for the localised string identifier."""
 
     WELCOME_TEXT_1 = auto()
+    ALREADY_ONLINE = auto()
     ...
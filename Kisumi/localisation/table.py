@@ -0,0 +1,177 @@
+# Compiled localisation tables with pre-rendered packets.
+from .constants.language import LocalisedMessage, Language
+from .parsing import LanguageDataModel, parse_into_model
+from resources.constants import DataType
+from packets import builders
+from logger import info, warning
+from state import config
+from typing import Iterable, Optional
+from string import Formatter
+
+# The language used for messages missing from other language packs.
+DEFAULT_LANGUAGE = Language.ENGLISH_UK
+
+# Dense indexes of the enums, used for the flat table layout.
+_LANGUAGE_IDX = {lang: idx for idx, lang in enumerate(Language)}
+_MESSAGE_IDX = {msg: idx for idx, msg in enumerate(LocalisedMessage)}
+_MESSAGE_COUNT = len(_MESSAGE_IDX)
+_FORMATTER = Formatter()
+
+class LocalisationTable:
+    """A compiled table of all localised messages, indexed by language and
+    message. Messages without any format fields are additionally pre-encoded
+    into ready notification and chat message packets for every language."""
+
+    __slots__ = (
+        "_text",
+        "_notifications",
+        "_messages",
+        "_sender_name",
+        "_sender_id",
+        "_channel",
+    )
+
+    def __init__(self) -> None:
+        """Creates an empty table where every message resolves to its
+        identifier. Use `compile` or `kisumi_load` to populate it."""
+
+        self._sender_name = config.BOT_USER_NAME
+        self._sender_id = config.BOT_USER_ID
+        self._channel = "#osu"
+        self.compile(())
+
+    # Private methods.
+    def __idx(self, lang: Optional[Language], msg: LocalisedMessage) -> int:
+        """Calculates the position of a message within the flat tables."""
+
+        return _LANGUAGE_IDX[lang or DEFAULT_LANGUAGE] * _MESSAGE_COUNT \
+            + _MESSAGE_IDX[msg]
+
+    # Public methods.
+    def compile(self, packs: Iterable[LanguageDataModel],
+                sender_name: Optional[str] = None, sender_id: Optional[int] = None,
+                channel: Optional[str] = None) -> None:
+        """Builds the table from the parsed language packs `packs`, replacing
+        the current contents.
+
+        Args:
+            sender_name (str, optional): The name pre-rendered chat messages
+                are sent as.
+            sender_id (int, optional): The user ID pre-rendered chat messages
+                are sent as.
+            channel (str, optional): The channel pre-rendered chat messages are
+                sent to.
+        """
+
+        self._sender_name = sender_name or self._sender_name
+        self._sender_id = sender_id or self._sender_id
+        self._channel = channel or self._channel
+
+        lang_text: dict[Language, dict[str, str]] = {}
+        for pack in packs:
+            lang_text.setdefault(pack.locale_id, {}).update(pack.text)
+
+        default_text = lang_text.get(DEFAULT_LANGUAGE, {})
+        text = []
+        notifications = []
+        messages = []
+        # Languages falling back to the same text share the encoded packets.
+        encoded: dict[str, tuple[bytes, bytes]] = {}
+        templates: dict[str, bool] = {}
+
+        for lang in Language:
+            for msg in LocalisedMessage:
+                msg_text = lang_text.get(lang, {}).get(msg.value) \
+                    or default_text.get(msg.value, msg.value)
+                text.append(msg_text)
+
+                if (template := templates.get(msg_text)) is None:
+                    template = templates[msg_text] = _is_template(msg, msg_text)
+
+                if template:
+                    notifications.append(None)
+                    messages.append(None)
+                else:
+                    if msg_text not in encoded:
+                        encoded[msg_text] = (
+                            bytes(builders.notification(msg_text)),
+                            bytes(builders.send_message(
+                                self._sender_name,
+                                msg_text,
+                                self._channel,
+                                self._sender_id,
+                            )),
+                        )
+                    notification, message = encoded[msg_text]
+                    notifications.append(notification)
+                    messages.append(message)
+
+        self._text = tuple(text)
+        self._notifications = tuple(notifications)
+        self._messages = tuple(messages)
+
+    def text(self, lang: Optional[Language], msg: LocalisedMessage, *args) -> str:
+        """Returns the text of `msg` in the language `lang`, formatted using
+        `args` if provided."""
+
+        msg_text = self._text[self.__idx(lang, msg)]
+        return msg_text.format(*args) if args else msg_text
+
+    def notification(self, lang: Optional[Language], msg: LocalisedMessage,
+                     *args) -> bytes:
+        """Returns a notification packet for `msg` in the language `lang`.
+        Static messages are returned pre-encoded."""
+
+        idx = self.__idx(lang, msg)
+        if (packet := self._notifications[idx]) is not None:
+            return packet
+
+        return bytes(builders.notification(self._text[idx].format(*args)))
+
+    def message(self, lang: Optional[Language], msg: LocalisedMessage,
+                *args) -> bytes:
+        """Returns a chat message packet for `msg` in the language `lang`,
+        sent from the bot to the table channel. Static messages are returned
+        pre-encoded."""
+
+        idx = self.__idx(lang, msg)
+        if (packet := self._messages[idx]) is not None:
+            return packet
+
+        return bytes(builders.send_message(
+            self._sender_name,
+            self._text[idx].format(*args),
+            self._channel,
+            self._sender_id,
+        ))
+
+    async def kisumi_load(self) -> None:
+        """A startup task compiling the table from all language packs indexed
+        by the resource catalogue."""
+
+        # Imported here as `state.repos` creates this table.
+        from state import repos
+
+        info("Compiling the localisation tables...")
+
+        packs = []
+        for doc in await repos.resources.documents(DataType.LANGUAGE_PACK):
+            packs.extend(parse_into_model(doc.data))
+
+        if not packs:
+            warning("No language packs were found! Messages will be sent "
+                    "as their identifiers.")
+
+        self.compile(packs)
+        info("Compiled %d language packs into the localisation tables!", len(packs))
+
+def _is_template(msg: LocalisedMessage, text: str) -> bool:
+    """Checks if `text` of the message `msg` contains any format fields.
+    Text with stray braces is reported and treated as static."""
+
+    try:
+        return any(field is not None for _, field, _, _ in _FORMATTER.parse(text))
+    except ValueError:
+        warning("The text of %s is not a valid template, so it is sent as is: %r",
+                msg.value, text)
+        return False
@@ -1,5 +1,10 @@
 from functools import cache
 from enum import IntEnum
+from typing import Any, Optional, TextIO
+import threading
+import atexit
+import queue
+import json
 import sys
 import time
 
@@ -9,6 +14,8 @@ __all__ = (
     "error",
     "warning",
     "debug",
+    "configure",
+    "LogSampler",
 )
 
 # https://github.com/cmyui/cmyui_pkg/blob/master/cmyui/logging.py#L20-L45
@@ -37,22 +44,214 @@ class Ansi(IntEnum):
     def __repr__(self) -> str:
         return f"\x1b[{self.value}m"
 
-def _log(content: str, action: str, colour: Ansi = Ansi.WHITE):
-    timestamp = time.strftime("%d-%m-%Y %H:%M:%S", time.localtime())
-    sys.stdout.write( # This is mess but it forms in really cool log.
+# A log record of (unix time, action, colour, content, format args).
+_Record = tuple[float, str, Ansi, str, tuple[Any, ...]]
+
+# The maximum number of records written by the log thread in a single write.
+_BATCH_SIZE = 512
+
+def _render_text(content: str, args: tuple[Any, ...]) -> str:
+    """Applies the lazy %-style format `args` to `content`, if any."""
+
+    if not args:
+        return content
+
+    try:
+        return content % args
+    except (TypeError, ValueError):
+        return f"{content} {args!r}"
+
+def _format_pretty(record: _Record) -> str:
+    t, action, colour, content, args = record
+    timestamp = time.strftime("%d-%m-%Y %H:%M:%S", time.localtime(t))
+    # This is mess but it forms in really cool log.
+    return (
         f"\x1b[90m[{timestamp} - {colour!r}\033[1"
-        f"m{action}\033[0m\x1b[90m]: \x1b[94m{content}\x1b[0m\n"
+        f"m{action}\033[0m\x1b[90m]: \x1b[94m{_render_text(content, args)}\x1b[0m\n"
     )
 
-def info(text: str):
-    _log(text, "INFO", Ansi.GREEN)
+def _format_json(record: _Record) -> str:
+    t, action, _, content, args = record
+    return json.dumps({
+        "time": t,
+        "level": action.lower(),
+        "message": _render_text(content, args),
+    }) + "\n"
+
+class _LogWriter:
+    """Writes log records to a stream from a background thread, in batches,
+    so that a slow or blocked stream never stalls the event loop.
+
+    Note:
+        Records are dropped (and counted) rather than blocking the caller
+            once the queue is full.
+    """
+
+    __slots__ = (
+        "_stream",
+        "_formatter",
+        "_queue",
+        "_thread",
+        "_dropped_lock",
+        "dropped",
+    )
+
+    def __init__(self, stream: TextIO, json_lines: bool, max_queue: int) -> None:
+        self._stream = stream
+        self._formatter = _format_json if json_lines else _format_pretty
+        self._queue: queue.Queue[Optional[_Record]] = queue.Queue(max_queue)
+        # Records are logged from the executor threads too. Only taken once
+        # the queue is full.
+        self._dropped_lock = threading.Lock()
+        self.dropped = 0
+
+        self._thread = threading.Thread(
+            target= self.__run,
+            name= "kisumi-logger",
+            daemon= True,
+        )
+        self._thread.start()
+
+    def put(self, record: _Record) -> None:
+        """Queues `record` to be written."""
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self) -> None:
+        """Writes all of the queued records and stops the log thread."""
+
+        # Blocking here is fine, this is only done at exit.
+        self._queue.put(None)
+        self._thread.join()
+
+    def __run(self) -> None:
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            out = "".join(self._formatter(record) for record in batch)
+            if dropped:
+                out += self._formatter((
+                    time.time(), "WARNING", Ansi.BLUE,
+                    "Dropped %d log records as logging fell behind.", (dropped,),
+                ))
+
+            try:
+                self._stream.write(out)
+                self._stream.flush()
+            except (OSError, ValueError):
+                # The stream has been closed. Nothing else to report it to.
+                pass
+
+# `None` while logs are written synchronously (before `configure` is called).
+_writer: Optional[_LogWriter] = None
+_json_lines = False
+
+def configure(json_lines: bool = False, buffered: bool = True,
+              max_queue: int = 65536, stream: TextIO = sys.stdout) -> None:
+    """Configures the logging backend.
+
+    Args:
+        json_lines (bool): Whether to write each record as a JSON object on
+            its own line rather than in the coloured format.
+        buffered (bool): Whether records should be written in batches by a
+            background thread. Otherwise, they are written synchronously.
+        max_queue (int): The maximum number of records queued for the log
+            thread before new ones are dropped.
+        stream (TextIO): The stream to write the records to.
+    """
+
+    global _writer, _json_lines
+
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+    _json_lines = json_lines
+    if buffered:
+        _writer = _LogWriter(stream, json_lines, max_queue)
+
+def _flush_at_exit() -> None:
+    if _writer is not None:
+        _writer.close()
+
+atexit.register(_flush_at_exit)
+
+def _log(content: str, args: tuple[Any, ...], action: str,
+         colour: Ansi = Ansi.WHITE) -> None:
+    record = (time.time(), action, colour, content, args)
+
+    if _writer is not None:
+        _writer.put(record)
+    else:
+        sys.stdout.write(
+            _format_json(record) if _json_lines else _format_pretty(record)
+        )
+
+# All of the functions take optional %-style format args, only applied once
+# written. Prefer them over f-strings for messages that may be filtered out.
+def info(text: str, *args: Any) -> None:
+    _log(text, args, "INFO", Ansi.GREEN)
+
+def error(text: str, *args: Any) -> None:
+    _log(text, args, "ERROR", Ansi.RED)
+
+def warning(text: str, *args: Any) -> None:
+    _log(text, args, "WARNING", Ansi.BLUE)
+
+def debug(text: str, *args: Any) -> None:
+    if not DEBUG:
+        return
+
+    _log(text, args, "DEBUG", Ansi.WHITE)
+
+class LogSampler:
+    """Decides whether a frequent event (such as a request) should be logged,
+    logging only a fraction `rate` (0 to 1) of them.
+
+    Note:
+        Sampling is deterministic, logging every n-th event, so the cost is
+            a counter increment rather than a random number.
+    """
+
+    __slots__ = (
+        "_interval",
+        "_count",
+    )
+
+    def __init__(self, rate: float) -> None:
+        rate = min(max(rate, 0.0), 1.0)
+        self._interval = round(1 / rate) if rate else 0
+        self._count = 0
+
+    def __bool__(self) -> bool:
+        """Checks if any events are ever sampled."""
+
+        return self._interval != 0
 
-def error(text: str):
-    _log(text, "ERROR", Ansi.RED)
+    def sample(self) -> bool:
+        """Registers an event, returning whether it should be logged."""
 
-def warning(text: str):
-    _log(text, "WARNING", Ansi.BLUE)
+        if not self._interval:
+            return False
 
-def debug(text: str):
-    if DEBUG:
-        _log(text, "DEBUG", Ansi.WHITE)
+        self._count += 1
+        if self._count >= self._interval:
+            self._count = 0
+            return True
+        return False
@@ -1,9 +1,16 @@
-from starlette.routing import Host
+from starlette.routing import Host, Route
 from fastapi.applications import FastAPI
-from logger import error, DEBUG, info
+from logger import error, DEBUG, info, configure as configure_logging
+from pathlib import Path
+from typing import Optional
+import traceback
+import multiprocessing.connection
+import multiprocessing
 import asyncio
 import uvicorn
+import signal
 import sys
+import os
 
 # Pre-config imports.
 from state.db import (
@@ -12,13 +19,25 @@ from state.db import (
 from state import config, repos
 from user._testing import (
     configure_test_user,
+    seed_synthetic_users,
 )
+from user.sessions import (
+    SNAPSHOT_PATH,
+    restore_sessions,
+    snapshot_sessions,
+)
+from utils.startup import StartupGraph
+from utils.looplag import LoopLagMonitor
+from utils.debugserver import DebugServer
+from utils.event import close_all as close_events
+from utils import capture
 
 # Router imports.
-from handlers.bancho.router import router as bancho_router
-
-# FIXME: Find another way to initalise these files.
-from handlers.bancho.main_handler import main_post as _
+from handlers.bancho.router import create_router as create_bancho_router
+from handlers.bancho.asgi import BanchoASGIApp
+from handlers.metrics import metrics_get
+from handlers.debug.router import create_router as create_debug_router
+from utils.lazy import LAZY_IMPORTS, load_deferred
 
 # Use uvloop if possible.
 try:
@@ -26,58 +45,286 @@ try:
 except ImportError:
     error("Uvloop could not be installed! Expect degraded performance.")
 
-_STARTUP_TASKS = (
-    initialise_database_connections(),
-    configure_test_user(),
-    repos.json_loader.load(),
-    repos.geoloc.kisumi_load(),
+# The index of this worker process, when started with `config.WORKERS`.
+_worker: Optional[int] = None
+
+def _per_worker(path: Path) -> Path:
+    """Gives each worker its own copy of a data file."""
+
+    if _worker is None:
+        return path
+    return path.with_name(f"{path.stem}.{_worker}{path.suffix}")
+
+async def _restore_sessions() -> None:
+    await restore_sessions(_per_worker(SNAPSHOT_PATH))
+
+# Tasks that do not depend on each other are ran concurrently.
+_STARTUP = StartupGraph()
+_STARTUP.add("database", initialise_database_connections)
+_STARTUP.add("test_user", configure_test_user)
+_STARTUP.add("synthetic_users", seed_synthetic_users)
+_STARTUP.add("resources", repos.resources.load)
+_STARTUP.add("locale", repos.locale.kisumi_load, depends_on= ("resources",))
+_STARTUP.add("geolocation", repos.geoloc.kisumi_load)
+if repos.cluster is not None:
+    _STARTUP.add("cluster", repos.cluster.start, depends_on= ("database",))
+# Only exchanged with the other processes once anything is subscribed.
+if repos.cluster is not None and repos.invalidation.subscribed:
+    _STARTUP.add("invalidation", repos.invalidation.start, depends_on= ("database",))
+# Restored after the users exist, so clients keep their `osu-token` valid.
+# In cluster mode, they are registered with the cluster as they are restored.
+_STARTUP.add(
+    "sessions",
+    _restore_sessions,
+    depends_on= (
+        "test_user",
+        "synthetic_users",
+        *(("cluster",) if repos.cluster is not None else ()),
+    ),
 )
 
+async def _load_deferred_imports() -> None:
+    """Imports all deferred modules so the first requests do not pay for them."""
+
+    # Imported in the executor, so the other startup tasks are not blocked.
+    loop = asyncio.get_running_loop()
+    loaded = await loop.run_in_executor(None, load_deferred)
+    info("Imported %d deferred modules.", len(loaded))
+
+# In lazy import mode, heavy modules are only imported upon first use.
+if not LAZY_IMPORTS:
+    _STARTUP.add("imports", _load_deferred_imports)
+
+_LOOP_LAG = LoopLagMonitor(
+    threshold= config.LOOP_LAG_THRESHOLD_MS / 1e+3,
+    report_interval= config.LOOP_LAG_REPORT_INTERVAL,
+)
+
+_debug_server: Optional[DebugServer] = None
+
+def _create_debug_server() -> DebugServer:
+    """Creates the debug server, bound to localhost. It serves the metrics
+    and (if enabled) the debugging tools."""
+
+    return DebugServer(
+        FastAPI(
+            title= "Kisumi Debug",
+            openapi_url= None,
+            docs_url= None,
+            redoc_url= None,
+            routes= (
+                *(create_debug_router().routes
+                if config.DEBUG_SERVER_ENABLED else ()),
+                *((Route("/metrics", metrics_get, methods= ["GET"]),)
+                if config.METRICS_ENABLED else ()),
+            ),
+        ),
+        port= config.DEBUG_SERVER_PORT + (_worker or 0),
+    )
+
+# Strong references to signal spawned tasks so they are not garbage collected.
+_SIGNAL_TASKS: set[asyncio.Task] = set()
+
+async def _reload_resources() -> None:
+    """Re-indexes the changed resource documents, recompiling the
+    localisation tables from them."""
+
+    changed = await repos.resources.refresh()
+    await repos.locale.kisumi_load()
+    info("Re-indexed %d changed resource documents.", changed)
+
+def _on_sighup() -> None:
+    """Reloads the geolocation database and the resources upon receiving
+    `SIGHUP`."""
+
+    info("Received SIGHUP, reloading the geolocation database and resources...")
+    for coro in (repos.geoloc.reload(), _reload_resources()):
+        task = asyncio.create_task(coro)
+        _SIGNAL_TASKS.add(task)
+        task.add_done_callback(_SIGNAL_TASKS.discard)
+
 async def on_startup() -> None:
     info("Kisumi is starting...")
 
+    # Started first so that blocking startup tasks are reported too.
+    if config.LOOP_LAG_THRESHOLD_MS:
+        _LOOP_LAG.start()
+
     # Run all startup tasks.
-    for task in _STARTUP_TASKS:
-        await task
+    report = await _STARTUP.run()
+    report.log()
     
-    info(f"Completed {len(_STARTUP_TASKS)} startup tasks!")
+    # Allow for the geolocation database and the resources to be updated
+    # without a restart.
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _on_sighup)
+    except (AttributeError, NotImplementedError):
+        error("SIGHUP reloading is not supported on this platform.")
+    
+    info("Completed %d startup tasks!", len(_STARTUP))
+
+    if config.CAPTURE_ENABLED:
+        try:
+            capture.start(_per_worker(config.CAPTURE_PATH), config.CAPTURE_SAMPLE_RATE)
+        except OSError:
+            error("Failed starting the traffic capture!\n%s", traceback.format_exc())
+
+    # Started after the sessions are restored, giving them a full timeout.
+    if config.SESSION_TIMEOUT:
+        repos.reaper.start()
+
+    if config.DEBUG_SERVER_ENABLED or config.METRICS_ENABLED:
+        global _debug_server
+        _debug_server = _create_debug_server()
+        await _debug_server.start()
 
 async def on_shutdown() -> None:
     info("Kisumi is shutting down...")
 
-    ...
+    # The clients are not timed out while the server is down.
+    await repos.reaper.stop()
+    # Allow for the online clients to carry on after a restart.
+    await snapshot_sessions(_per_worker(SNAPSHOT_PATH))
+    # The other nodes see this node's users go offline until it is back.
+    if repos.cluster is not None:
+        await repos.cluster.stop()
+    await repos.invalidation.stop()
+    # Deliver the events that are still queued.
+    await close_events()
+    await _LOOP_LAG.stop()
+    capture.stop()
+
+    if _debug_server is not None:
+        await _debug_server.stop()
 
 
 BANCHO_SUBDOMAINS = ("c", "c4", "c5", "c6", "ce")
-def main(argv: list[str]) -> int:
-    """Kisumi main entry point."""
+BANCHO_HOSTS = (
+    *(f"{subdomain}.ppy.sh" for subdomain in BANCHO_SUBDOMAINS),
+    *(f"{subdomain}.{config.SERVER_DOMAIN}" for subdomain in BANCHO_SUBDOMAINS),
+)
 
-    uvicorn.run(
-        FastAPI(
-            title= "Kisumi",
-            openapi_url= None,
-            docs_url= None,
-            redoc_url= None,
-            debug= DEBUG,
-            on_startup= (
-                on_startup,
-            ),
-            on_shutdown= (
-                on_shutdown,
-            ),
-            routes= (
-                # The bancho protocol operates on many donains, alongside supporting
-                # switchers.
-                *(Host(f"{subdomain}.ppy.sh", bancho_router, "Bancho Switcher")
-                for subdomain in BANCHO_SUBDOMAINS),
-                *(Host(f"{subdomain}.{config.SERVER_DOMAIN}", bancho_router, "Bancho Devserver")
-                for subdomain in BANCHO_SUBDOMAINS),
-            ),
+def create_app() -> BanchoASGIApp:
+    """Creates the Kisumi ASGI application. Bancho POST requests are served
+    directly, with FastAPI handling everything else.
+
+    Note:
+        The startup tasks only run once the app receives the ASGI lifespan
+            startup event.
+    """
+
+    bancho_router = create_bancho_router()
+
+    app = FastAPI(
+        title= "Kisumi",
+        openapi_url= None,
+        docs_url= None,
+        redoc_url= None,
+        debug= DEBUG,
+        on_startup= (
+            on_startup,
+        ),
+        on_shutdown= (
+            on_shutdown,
+        ),
+        routes= (
+            # The bancho protocol operates on many donains, alongside supporting
+            # switchers.
+            *(Host(f"{subdomain}.ppy.sh", bancho_router, "Bancho Switcher")
+            for subdomain in BANCHO_SUBDOMAINS),
+            *(Host(f"{subdomain}.{config.SERVER_DOMAIN}", bancho_router, "Bancho Devserver")
+            for subdomain in BANCHO_SUBDOMAINS),
         ),
-        port= config.SERVER_PORT,
+    )
+    return BanchoASGIApp(BANCHO_HOSTS, app)
+
+def _serve(port: int) -> None:
+    # Logs are written from a separate thread to not block the event loop.
+    configure_logging(
+        json_lines= config.LOG_JSON,
+        max_queue= config.LOG_QUEUE_SIZE,
+    )
+
+    uvicorn.run(
+        create_app(),
+        port= port,
         #access_log= False,
         #log_level= "error",
     )
+
+def _run_worker(index: int) -> None:
+    """The entry point of a forked worker process."""
+
+    global _worker
+    _worker = index
+    if repos.cluster is not None:
+        repos.cluster.assign_worker(index)
+
+    _serve(config.SERVER_PORT + index)
+
+def _run_workers(count: int) -> int:
+    """Starts `count` worker processes, each serving on its own port, and
+    waits for them to exit.
+
+    Note:
+        A session has to keep being routed to the worker it logged in on,
+            eg by balancing on the client address.
+        If a worker exits, the rest are stopped too.
+    """
+
+    # Created before forking, so it is shared by all of the workers.
+    table = None
+    if (create_table := getattr(repos.cluster, "create_table", None)) is not None:
+        table = create_table()
+
+    # Forked (rather than spawned) to inherit the shared memory mapping.
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(target= _run_worker, args= (idx,), name= f"kisumi-worker-{idx}")
+        for idx in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop_workers(*_) -> None:
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    configure_logging(
+        json_lines= config.LOG_JSON,
+        max_queue= config.LOG_QUEUE_SIZE,
+    )
+    info("Started %d workers on ports %d-%d.", count, config.SERVER_PORT,
+         config.SERVER_PORT + count - 1)
+
+    try:
+        # Wait for any of them to exit.
+        while all(worker.is_alive() for worker in workers):
+            multiprocessing.connection.wait(
+                [worker.sentinel for worker in workers],
+            )
+
+        stop_workers()
+        for worker in workers:
+            worker.join()
+    finally:
+        if table is not None:
+            table.close()
+            table.unlink()
+
+    return int(any(worker.exitcode for worker in workers))
+
+def main(argv: list[str]) -> int:
+    """Kisumi main entry point."""
+
+    if config.WORKERS > 1:
+        return _run_workers(config.WORKERS)
+
+    _serve(config.SERVER_PORT)
     return 0
 
 if __name__ == "__main__":
@@ -29,6 +29,19 @@ def notification(content: str) -> bytearray:
             .finish(PacketID.SRV_NOTIFICATION)
     )
 
+def send_message(sender: str, content: str, target: str, sender_id: int) -> bytearray:
+    """Builds a chat message packet from `sender` to the channel or user
+    `target`."""
+
+    return (
+        BinaryWriter()
+            .write_str(sender)
+            .write_str(content)
+            .write_str(target)
+            .write_i32(sender_id)
+            .finish(PacketID.SRV_SEND_MESSAGE)
+    )
+
 def login_reply(resp_val: Union[int, LoginReply]) -> bytearray:
     """Builds a login response packet buffer and returns it."""
 
@@ -50,6 +63,18 @@ def channel_info_end() -> bytearray:
             .finish(PacketID.SRV_CHANNEL_INFO_END)
     )
 
+def user_logout(user_id: int) -> bytearray:
+    """Builds a packet telling the client that the user with the ID of
+    `user_id` has gone offline."""
+
+    return (
+        BinaryWriter()
+            .write_i32(user_id)
+            # Unused by the client.
+            .write_u8(0)
+            .finish(PacketID.SRV_USER_LOGOUT)
+    )
+
 # TODO: Remove placeholder data
 def presence(user: "User") -> bytearray:
     """Builds a presence for a user's main client."""
@@ -111,3 +136,13 @@ def protocol_ver(ver: int = 19) -> bytearray:
             .write_i32(ver)
             .finish(PacketID.SRV_PROTOCOL_VERSION)
     )
+
+def restart(delay_ms: int = 0) -> bytearray:
+    """Builds a packet telling the client to reconnect to the server after
+    `delay_ms` milliseconds."""
+
+    return (
+        BinaryWriter()
+            .write_i32(delay_ms)
+            .finish(PacketID.SRV_RESTART)
+    )
@@ -129,9 +129,6 @@ class BinaryReader:
     def read_uleb128(self) -> int:
         """Reads an unsigned 128-bit LEB variable length integer from the buffer."""
 
-        if self.read_bytes(1)[0] != 0x0B:
-            return ""
-
         val = shift = 0
         while True:
             b = self.read_bytes(1)[0]
@@ -145,7 +142,7 @@ class BinaryReader:
         """Reads an osu-styled binary string from the buffer."""
 
         # The exists byte.
-        if self.read_bytes(1)[0] == 0:
+        if self.read_bytes(1)[0] != 0x0B:
             return ""
         
         length = self.read_uleb128()
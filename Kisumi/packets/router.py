@@ -15,16 +15,29 @@ from .reader import BinaryReader
 from user.user import User
 from user.client.components.queue import ByteLike
 from .constants import PacketID
+from utils import metrics
+import time
+
+_DECODE_SECONDS = metrics.histogram(
+    "kisumi_packet_decode_seconds",
+    "Time spent reading the arguments of a packet.",
+    labels= ("packet",),
+)
+_DISPATCH_SECONDS = metrics.histogram(
+    "kisumi_packet_dispatch_seconds",
+    "Time spent running the handler of a packet.",
+    labels= ("packet",),
+)
 
 # TODO: Make a coroutine function alias.
-PACKET_CORO_FUNC = Callable[[User, Type[Union[int, str, float]], Awaitable[Optional[ByteLike]]]]
+PACKET_CORO_FUNC = Callable[[User, Type[Union[int, str, float]]], Awaitable[Optional[ByteLike]]]
 @dataclass
 class PacketHandler:
     """A class representing a handler function for a specific packet id."""
 
     id: PacketID
     handler: PACKET_CORO_FUNC
-    req_priv: ... # Privilege enum type.
+    privilege: ... # Privilege enum type.
 
     def read_from_annotations(
         self, reader: BinaryReader
@@ -34,7 +47,10 @@ class PacketHandler:
 
         args = []
 
-        arg_iter = iter(get_annotations(self.handler))
+        arg_iter = iter(
+            anno for name, anno in get_annotations(self.handler, eval_str= True).items()
+            if name != "return"
+        )
         # Skip first item as it will always be the user.
         next(arg_iter)
 
@@ -71,9 +87,16 @@ class PacketHandler:
             Does no validation itself. All on you buddy.
         """
 
+        start = time.perf_counter()
         args = self.read_from_annotations(reader)
+        decoded = time.perf_counter()
 
-        return await self.handler(user, *args)
+        try:
+            return await self.handler(user, *args)
+        finally:
+            name = self.id.name
+            _DECODE_SECONDS.labels(name).observe(decoded - start)
+            _DISPATCH_SECONDS.labels(name).observe(time.perf_counter() - decoded)
 
 class PacketRouter:
     """A router for identifying packet ids to their respective handlers."""
@@ -95,12 +118,14 @@ class PacketRouter:
             privilege= privilege,
         )
     
-    def register(self, p_id: PacketID, p_handle: PACKET_CORO_FUNC,
-                        privilege: Optional[Any] = None) -> PACKET_CORO_FUNC:
+    def register(self, p_id: PacketID,
+                 privilege: Optional[Any] = None) -> Callable[
+                     [PACKET_CORO_FUNC], PACKET_CORO_FUNC
+                 ]:
         """Decorator equivalent of `register_packet`."""
 
         def wrapper(coro: PACKET_CORO_FUNC) -> PACKET_CORO_FUNC:
-            self.register_packet(p_id, p_handle, privilege)
+            self.register_packet(p_id, coro, privilege)
             return coro
         
         return wrapper
@@ -108,10 +108,12 @@ class BinaryWriter:
         """
 
         if string:
+            # The length is of the encoded bytes, not the characters.
+            encoded = string.encode()
             (
                 self.write_u8(11)
-                    .write_uleb128(len(string))
-                    .write_raw(string.encode())
+                    .write_uleb128(len(encoded))
+                    .write_raw(encoded)
             )
         
         else:
@@ -142,6 +144,13 @@ class BinaryWriter:
         self._buffer += contents
         return self
     
+    @property
+    def buffer(self) -> bytearray:
+        """The contents written so far, without a packet header being
+        written."""
+
+        return self._buffer
+
     def finish(self, packet_id: PacketID) -> bytearray:
         """Completes packet serialisation by writing the packet header to the front."""
 
@@ -4,6 +4,8 @@ import asyncio
 from dataclasses import dataclass
 from typing import (
     TYPE_CHECKING,
+    Awaitable,
+    Callable,
     Iterable,
     Optional,
     AsyncGenerator,
@@ -11,12 +13,34 @@ from typing import (
 from user.client.constants.client import ClientType
 from user.client.components.queue import ByteLike
 from utils.event import Event
+from utils import metrics
+import time
 
-from packets.builders import presence
+from packets.builders import presence, stats, user_logout
 
 if TYPE_CHECKING:
     from user.client.client import AbstractClient, StableClient
     from user.user import User
+    from state.cluster import AbstractNode
+
+_ONLINE_USERS = metrics.gauge(
+    "kisumi_online_users",
+    "Users with at least one client attached.",
+)
+_QUEUED_BYTES = metrics.gauge(
+    "kisumi_queued_bytes",
+    "Bytes queued for stable clients, awaiting their next poll.",
+    labels= ("stat",),
+)
+_BROADCAST_RECIPIENTS = metrics.histogram(
+    "kisumi_broadcast_recipients",
+    "The number of clients each broadcast was sent to.",
+    buckets= metrics.SIZE_BUCKETS,
+)
+_BROADCAST_SECONDS = metrics.histogram(
+    "kisumi_broadcast_seconds",
+    "Time taken to queue a broadcast for all of its recipients.",
+)
 
 class AbstractUserRepo(ABC):
     """An abstract base class for any user-based repository."""
@@ -37,12 +61,22 @@ class AbstractUserRepo(ABC):
     async def get(self, user_id: int) -> Optional["User"]:
         ...
 
+    @abstractmethod
+    async def get_by_name(self, name: str) -> Optional["User"]:
+        ...
+
+def safe_name(name: str) -> str:
+    """Normalises a username for case and space insensitive lookups."""
+
+    return name.lower().replace(" ", "_")
+
 class UserRepo(AbstractUserRepo):
     """Handles the storage of direct user references. Not thread-safe."""
 
     __slots__ = (
         "name",
         "_repo",
+        "_names",
     )
 
     # Special Methods
@@ -57,6 +91,8 @@ class UserRepo(AbstractUserRepo):
 
         self.name = name
         self._repo: dict[int, "User"] = {}
+        # An index of the users by their safe name.
+        self._names: dict[str, "User"] = {}
     
     def __len__(self) -> int:
         """Returns the length of the repository."""
@@ -100,6 +136,7 @@ class UserRepo(AbstractUserRepo):
         """
 
         self._repo[user.id] = user
+        self._names[safe_name(user.name)] = user
         return True
     
     async def remove_id(self, user_id: int) -> bool:
@@ -110,11 +147,11 @@ class UserRepo(AbstractUserRepo):
             `True` on success.
         """
 
-        try:
-            del self._repo[user_id]
-            return True
-        except KeyError:
+        if (user := self._repo.pop(user_id, None)) is None:
             return False
+
+        self._names.pop(safe_name(user.name), None)
+        return True
     
     async def remove(self, user: "User") -> bool:
         """Removes a `User` instance from the repository.
@@ -143,6 +180,17 @@ class UserRepo(AbstractUserRepo):
 
         return self._repo.get(user_id)
 
+    async def get_by_name(self, name: str) -> Optional["User"]:
+        """Attempts to retrieve a user by their username, ignoring case and
+        treating spaces and underscores as the same.
+
+        Returns:
+            Instance of `User` with the given name if found.
+            Else `None`.
+        """
+
+        return self._names.get(safe_name(name))
+
 """
 @dataclass
 class _AsyncUserIterator:
@@ -192,12 +240,16 @@ class AsyncUserRepo(UserRepo):
             return await super().remove_id(user_id)
     
     async def remove(self, user: "User") -> bool:
-        async with self._lock:
-            return await super().remove(user)
+        # `UserRepo.remove` calls `remove_id`, which acquires the lock.
+        return await self.remove_id(user.id)
     
     async def get(self, user_id: int) -> Optional["User"]:
         async with self._lock:
             return await super().get(user_id)
+
+    async def get_by_name(self, name: str) -> Optional["User"]:
+        async with self._lock:
+            return await super().get_by_name(name)
     """
     def __aiter__(self) -> _AsyncUserIterator:
         \"""Returns an asynchronous iterator over the entire repo.\"""
@@ -217,18 +269,33 @@ class AsyncUserRepo(UserRepo):
             return [user for user in self._repo.values()]
 
 class OnlineUsersRepo:
-    """A repository of all online users."""
+    """A repository of all online users.
+
+    Note:
+        With a `cluster` node, the users are also registered with the other
+            nodes (or workers), and broadcasts reach the users of every
+            node. Lookups (and `len`) only cover the users of this node,
+            other than for their presences and stats.
+    """
 
     __slots__ = (
         "_repo",
+        "_cluster",
         "on_online",
     )
 
-    def __init__(self) -> None:
+    def __init__(self, cluster: Optional["AbstractNode"] = None) -> None:
         self._repo = AsyncUserRepo("OnlineUsersRepo")
-        self.on_online = Event()
+        self._cluster = cluster
+        self.on_online = Event("on_online")
 
         self.on_online.subscribe(self.on_online_event)
+        metrics.add_collector(self.collect_metrics)
+    
+    def __len__(self) -> int:
+        """Returns the number of online users."""
+
+        return len(self._repo)
     """
     Bug induced rage go brr.
     async def clients(self) -> AsyncGenerator["AbstractClient", None]:
@@ -264,6 +331,10 @@ class OnlineUsersRepo:
         """Event hook function listening to new users. Responsible for notifying
         all users of a new user."""
 
+        # They may have gone offline before being announced.
+        if user not in self._repo:
+            return
+
         # Notify all stable clients of the new user.
         await self.broadcast(
             presence(user),
@@ -273,17 +344,167 @@ class OnlineUsersRepo:
         """Adds the user to the online user list."""
 
         await self._repo.insert(user)
+        if self._cluster is not None:
+            await self._cluster.register(user, presence(user), stats(user))
         await self.on_online.call(user)
     
+    async def update_user(self, user: "User") -> None:
+        """Shares the current presence and stats of an online user, once they
+        changed (eg their status), with everyone else."""
+
+        if user not in self._repo:
+            return
+
+        user_stats = stats(user)
+        if self._cluster is not None:
+            await self._cluster.update(user, presence(user), user_stats)
+        await self.broadcast(user_stats)
+
+    async def remove_users(self, users: list["User"]) -> None:
+        """Removes the users from the online user list, notifying everyone
+        else of them leaving in a single broadcast."""
+
+        for user in users:
+            await self._repo.remove(user)
+
+        if self._cluster is not None:
+            await self._cluster.unregister(users)
+
+        if users:
+            await self.broadcast(
+                b"".join(user_logout(user.id) for user in users),
+            )
+    
+    async def remove_user(self, user: "User") -> None:
+        """Removes the user from the online user list."""
+
+        await self.remove_users([user])
+    
+    async def users(self) -> list["User"]:
+        """Lists all online users."""
+
+        return await self._repo.temp_user_list()
+    
     async def get(self, user_id: int) -> Optional["User"]:
         """Attempts to fetch an online user by user id. Returns `None` if
         the user is not online."""
 
         return await self._repo.get(user_id)
     
+    async def presences_of(self, user_ids: Optional[list[int]] = None) -> bytearray:
+        """Returns the presence packets of the online users out of
+        `user_ids` (or of all online users), wherever they are online.
+
+        Note:
+            The presences of this node's users are always built fresh.
+        """
+
+        return await self.__packets_of(
+            user_ids,
+            presence,
+            self._cluster.presences if self._cluster is not None else None,
+        )
+
+    async def stats_of(self, user_ids: list[int]) -> bytearray:
+        """Returns the stats packets of the online users out of `user_ids`,
+        wherever they are online.
+
+        Note:
+            The stats of this node's users are always built fresh.
+        """
+
+        return await self.__packets_of(
+            user_ids,
+            stats,
+            self._cluster.stats if self._cluster is not None else None,
+        )
+
+    async def enqueue(self, user_id: int, b: ByteLike) -> bool:
+        """Queues a sequence of bytes for the user `user_id`, wherever in the
+        cluster they are online.
+
+        Returns:
+            Whether the user is online.
+        """
+
+        if await self.enqueue_local(user_id, b):
+            return True
+
+        if self._cluster is None \
+            or (node_id := await self._cluster.owner(user_id)) is None:
+            return False
+
+        self._cluster.enqueue(node_id, user_id, b)
+        return True
+
+    async def enqueue_local(self, user_id: int, b: ByteLike) -> bool:
+        """Queues a sequence of bytes for the user `user_id` if they are
+        online on this node, returning whether they are."""
+
+        if (user := await self._repo.get(user_id)) is None \
+            or (client := await user.clients.stable_client()) is None:
+            return False
+
+        await client.queue.append(b)
+        return True
+
     async def broadcast(self, b: ByteLike) -> None:
         """Broadcasts a sequence of bytes to all users."""
 
-        for client in await self.stable_clients():
+        await self.broadcast_local(b)
+        if self._cluster is not None:
+            self._cluster.broadcast(b)
+
+    async def broadcast_local(self, b: ByteLike) -> None:
+        """Broadcasts a sequence of bytes to all users on this node."""
+
+        start = time.perf_counter()
+        clients = await self.stable_clients()
+        for client in clients:
             await client.queue.append(b)
+
+        _BROADCAST_RECIPIENTS.observe(len(clients))
+        _BROADCAST_SECONDS.observe(time.perf_counter() - start)
+    
+    async def __packets_of(
+        self,
+        user_ids: Optional[list[int]],
+        builder: Callable[["User"], bytearray],
+        fetch_remote: Optional[Callable[..., Awaitable[dict[int, bytes]]]],
+    ) -> bytearray:
+        """Builds the packets of the local users, alongside fetching those
+        of the users of other nodes with `fetch_remote`."""
+
+        if user_ids is None:
+            local = {user.id: user for user in await self._repo.temp_user_list()}
+        else:
+            local = {
+                user_id: user for user_id in user_ids
+                if (user := await self._repo.get(user_id)) is not None
+            }
+
+        packets = bytearray()
+        for user in local.values():
+            packets += builder(user)
+
+        if fetch_remote is None:
+            return packets
+
+        remote = await fetch_remote(
+            None if user_ids is None
+            else [user_id for user_id in user_ids if user_id not in local]
+        )
+        for user_id, packet in remote.items():
+            if user_id not in local:
+                packets += packet
+        return packets
+
+    async def collect_metrics(self) -> None:
+        """Updates the online user and queue depth metrics."""
+
+        depths = [len(client.queue) for client in await self.stable_clients()]
+
+        _ONLINE_USERS.set(len(self))
+        _QUEUED_BYTES.labels("total").set(sum(depths))
+        _QUEUED_BYTES.labels("max").set(max(depths, default= 0))
     
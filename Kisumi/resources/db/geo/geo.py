@@ -1,18 +1,46 @@
 # The Kisumi Geo API.
 from utils.vector2 import Vector2
 from utils.cache import LRUCache
-from typing import Optional
-from geoip2 import database
+from utils.memoise import memoise
+from typing import (
+    Iterable,
+    Optional,
+)
 from logger import info, error
+from utils.lazy import lazy_import
+from utils import metrics
 from .iploc import IPLocation
+import asyncio
 import os
 
+database = lazy_import("geoip2.database")
+geoip2_errors = lazy_import("geoip2.errors")
+
+_CACHE_SIZE = metrics.gauge(
+    "kisumi_geo_cache_entries",
+    "Addresses held in the geolocation cache.",
+)
+_CACHE_LOOKUPS = metrics.counter(
+    "kisumi_geo_cache_lookups_total",
+    "Geolocation cache lookups, by their result.",
+    labels= ("result",),
+)
+_CACHE_EVICTIONS = metrics.counter(
+    "kisumi_geo_cache_evictions_total",
+    "Addresses evicted from the geolocation cache.",
+)
+
 class GeolocationDB:
     """A wrapper around the MaxMind GeoIP DB."""
 
     __slots__ = (
         "_reader",
         "_cache",
+        "_location",
+        "_version",
+        "_leases",
+        "_lease_released",
+        "_reload_lock",
     )
 
     def __init__(self) -> None:
@@ -22,21 +50,29 @@ class GeolocationDB:
             To load a MMDB, please use the `load` function.
         """
 
-        self._reader: Optional[database.Reader] = None
-        self._cache: LRUCache[IPLocation] = LRUCache(200) # Do we really need this?
+        self._reader: Optional["database.Reader"] = None
+        # Shared with the batched lookups of `from_ips`.
+        self._cache: LRUCache[IPLocation] = GeolocationDB.from_ip.cache
+        self._location: Optional[str] = None
+
+        # Reader versioning, allowing for the database to be swapped at runtime.
+        self._version = 0
+        self._leases: dict[int, int] = {}
+        self._lease_released = asyncio.Event()
+        self._reload_lock = asyncio.Lock()
+
+        metrics.add_collector(self.collect_metrics)
     
     def load(self, location: str = "resources/ip.mmdb") -> bool:
         """Attempts to load a MMDB geoip database from `location`, returning
         bool of success."""
 
-        if not os.path.exists(location):
-            return False
-        
-        try:
-            self._reader = database.Reader(location)
-        except Exception: # Do something more specific.
+        reader = _open_reader(location)
+        if reader is None:
             return False
         
+        self._reader = reader
+        self._location = location
         return True
     
     async def kisumi_load(self, location: str = "resources/ip.mmdb") -> None:
@@ -44,26 +80,172 @@ class GeolocationDB:
 
         info("Loading the geolocation database...")
 
-        if not self.load():
+        if not self.load(location):
             raise Exception("Failed to load database!")
         
         info("Geolocation database loaded!")
     
+    async def reload(self, location: Optional[str] = None) -> bool:
+        """Atomically replaces the currently loaded database with the MMDB at
+        `location` (defaults to the currently loaded one), returning bool of
+        success.
+        
+        Note:
+            The new database is opened inside of a loop executor and is only
+            swapped in once fully ready, so lookups are never dropped. The
+            cache is cleared on swap and the old reader is closed once all
+            in-flight lookups using it have finished.
+        """
+
+        location = location or self._location
+        assert location is not None, "No database location to reload from!"
+
+        async with self._reload_lock:
+            loop = asyncio.get_running_loop()
+            reader = await loop.run_in_executor(
+                None,
+                _open_reader,
+                location,
+            )
+
+            if reader is None:
+                error("Failed to reload the geolocation database from %s!", location)
+                return False
+            
+            old_reader, old_version = self._reader, self._version
+            self._reader = reader
+            self._location = location
+            self._version += 1
+            # Also keeps lookups in-flight from being cached.
+            GeolocationDB.from_ip.clear()
+        
+        info("Geolocation database reloaded from %s!", location)
+
+        if old_reader is not None:
+            await self.__close_when_released(old_reader, old_version)
+        return True
+    
+    @memoise(capacity= 200, key= lambda self, ip: ip)
     async def from_ip(self, ip: str) -> IPLocation:
         """Attempts to create an instance of `IPLocation` from the database
-        or cache."""
+        or cache.
+
+        Note:
+            Addresses not present in the database (eg local ones) resolve to
+                `IPLocation.default()` rather than raising.
+            Concurrent lookups of the same address are only resolved once.
+        """
+
+        # Looked up without blocking the event loop.
+        return (await self.__lookup_many([ip]))[ip]
+    
+    async def from_ips(self, ips: Iterable[str]) -> list[IPLocation]:
+        """Resolves many IP addresses at once, returning a list of `IPLocation`
+        objects in the same order as `ips`.
+        
+        Note:
+            Duplicate addresses are only resolved once. All cache misses are
+            looked up together within a single loop executor task.
+            Addresses not present in the database resolve to `IPLocation.default()`.
+        """
+
+        ips = list(ips)
+        unique_ips = list(dict.fromkeys(ips))
+
+        resolved = self._cache.fetch_many(unique_ips)
+        misses = [ip for ip in unique_ips if ip not in resolved]
+
+        if misses:
+            version = self._version
+            looked_up = await self.__lookup_many(misses)
+
+            # Results from a swapped out database should not be cached.
+            if version == self._version:
+                self._cache.insert_many(looked_up)
+            resolved |= looked_up
+        
+        return [resolved[ip] for ip in ips]
+    
+    def collect_metrics(self) -> None:
+        """Mirrors the cache statistics into the metrics registry."""
+
+        stats = self._cache.stats
+        _CACHE_SIZE.set(stats.size)
+        _CACHE_LOOKUPS.labels("hit").set(stats.hits + stats.negative_hits)
+        _CACHE_LOOKUPS.labels("miss").set(stats.misses)
+        _CACHE_EVICTIONS.set(stats.evictions + stats.expirations)
+    
+    # Private methods.
+    async def __lookup_many(self, ips: list[str]) -> dict[str, IPLocation]:
+        """Looks the addresses `ips` up in the database inside of a loop
+        executor, bypassing the cache."""
 
         assert self._reader is not None, "Database reader not established! Use " \
                                          "GeolocationDB.load() first!"
 
-        if cached_ip := await self._cache.fetch(ip):
-            # Cache hit
-            return cached_ip
+        loop = asyncio.get_running_loop()
+        version, reader = self.__acquire_reader()
+        try:
+            return await loop.run_in_executor(
+                None,
+                _lookup_many,
+                reader,
+                ips,
+            )
+        finally:
+            self.__release_reader(version)
+
+    def __acquire_reader(self) -> tuple[int, "database.Reader"]:
+        """Leases the current reader for usage outside of the event loop,
+        returning its version alongside it."""
+
+        version = self._version
+        self._leases[version] = self._leases.get(version, 0) + 1
+        return version, self._reader
+    
+    def __release_reader(self, version: int) -> None:
+        """Releases a lease on the reader of the given `version`."""
+
+        if count := self._leases[version] - 1:
+            self._leases[version] = count
+        else:
+            del self._leases[version]
+        
+        self._lease_released.set()
+    
+    async def __close_when_released(self, reader: "database.Reader",
+                                    version: int) -> None:
+        """Waits until all leases on the reader of `version` are released,
+        then closes it."""
+
+        while self._leases.get(version):
+            self._lease_released.clear()
+            await self._lease_released.wait()
         
-        # Miss, use db
-        city_data = self._reader.city(ip)
-        ip_loc = IPLocation.from_city(ip, city_data)
+        reader.close()
+
+def _open_reader(location: str) -> Optional["database.Reader"]:
+    """Attempts to open a MMDB reader for the database at `location`. Returns
+    `None` on fail."""
 
-        # Cache for the future.
-        await self._cache.insert(ip, ip_loc)
-        return ip_loc
+    if not os.path.exists(location):
+        return None
+    
+    try:
+        return database.Reader(location)
+    except Exception: # Do something more specific.
+        return None
+
+def _lookup_many(reader: "database.Reader", ips: list[str]) -> dict[str, IPLocation]:
+    """Looks up all of the `ips` directly within the database using `reader`,
+    bypassing the cache. Meant to be ran inside of a loop executor."""
+
+    res = {}
+
+    for ip in ips:
+        try:
+            res[ip] = IPLocation.from_city(ip, reader.city(ip))
+        except (geoip2_errors.AddressNotFoundError, ValueError):
+            res[ip] = IPLocation.default()
+    
+    return res
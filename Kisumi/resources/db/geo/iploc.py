@@ -2,7 +2,10 @@ from dataclasses import dataclass
 from utils.vector2 import Vector2
 from .constants import COUNTRY_CODES
 from logger import warning
-from geoip2.models import City
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from geoip2.models import City
 
 @dataclass
 class IPLocation:
@@ -24,7 +27,7 @@ class IPLocation:
             return 0
     
     @staticmethod
-    def from_city(ip: str, city: City, time_zone: int = 0) -> "IPLocation":
+    def from_city(ip: str, city: "City", time_zone: int = 0) -> "IPLocation":
         """Creates an instance of `IPLocation` from MMDB IP city data."""
 
         return IPLocation(
@@ -2,11 +2,25 @@ import json
 from utils.singleton import Singleton
 from .constants import DataType
 from pydantic import BaseModel, ValidationError
-from typing import Any, Union
+from typing import Any, Iterable, Optional, Union
 from logger import info, debug, error
 from dataclasses import dataclass
+from pathlib import Path
+import asyncio
 import os
 
+# Use orjson for parsing document bodies if possible.
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+# The directory containing all Kisumi formatted JSON documents.
+RESOURCE_ROOT = Path(__file__).parent / "json"
+# The number of bytes read when attempting to parse just the metadata header.
+_HEADER_READ_SIZE = 4096
+_HEADER_DECODER = json.JSONDecoder()
+
 class JSONMetadata(BaseModel):
     """A pydantic model for the JSON metadata provided."""
 
@@ -22,85 +36,270 @@ class JSONDocument:
     metadata: JSONMetadata
     data: Union[DataType, dict[str, Any]]
 
-class JSONLoader(Singleton):
-    """Class managing a repository of all Kisumi formatted JSON documents."""
+@dataclass
+class CatalogueEntry:
+    """An indexed document within the resource catalogue. The document body
+    is only parsed once first accessed."""
+
+    path: Path
+    mtime_ns: int
+    metadata: JSONMetadata
+    document: Optional[JSONDocument] = None
+
+class ResourceCatalogue(Singleton):
+    """Class managing an index of all Kisumi formatted JSON documents inside
+    of the resource root, lazily parsing their contents."""
 
     # Special methods
-    def __init__(self) -> None:
-        """Initialises an empty JSON loader repositository."""
+    def __init__(self, root: Path = RESOURCE_ROOT) -> None:
+        """Initialises an empty catalogue for the documents in `root`."""
+
+        self._root = root
+        self._entries: dict[Path, CatalogueEntry] = {}
+        self._index: dict[DataType, dict[str, CatalogueEntry]] = {}
+        self._parsing: dict[Path, asyncio.Future] = {}
 
-        self._repo: dict[DataType, list[JSONDocument]] = {}
-    
     def __len__(self) -> int:
-        """Returns the number of documents stored in the repository."""
+        """Returns the number of documents indexed by the catalogue."""
+
+        return len(self._entries)
 
-        return len(self._repo)
-    
     # Public methods
     async def load(self) -> None:
-        """Loads all documents inside of the `resources/json` directory and
-        its subdirectories."""
-
-        files = _crawl_json_documents()
-        file_count = len(files)
-        successes = 0
-        info(f"Attempting to load {file_count} into the JSON repository...")
-
-        for file in files:
-            if self.load_document(file):
-                debug(f"Successfully loaded {file} into the repository.")
-                successes += 1
-            else:
-                # TODO: Specify what error happened.
-                error(f"Failed loading {file} into the repository.")
-
-        info(f"Successfully loaded {successes}/{file_count} into the JSON repository!")        
-    
-    def load_document(self, path: str) -> bool:
-        """Loads and inserts a document from a specific path.
-        
+        """Indexes all documents inside of the resource root and its
+        subdirectories, reading only their metadata."""
+
+        info("Indexing the resource catalogue at %s...", self._root)
+        changed = await self.refresh()
+        info("Successfully indexed %d documents into the resource catalogue!", changed)
+
+    async def refresh(self) -> int:
+        """Rescans the resource root, re-indexing any added or modified
+        documents (by modification time) and dropping removed ones. Parsed
+        bodies of modified documents are discarded.
+
         Returns:
-            `bool` relating to the success of the action.
+            The number of documents (re-)indexed.
         """
 
-        if not os.path.exists(path):
-            return False
-        
-        with open(path, "r") as f:
-            data_json = json.load(f)
-            return self.__parse_json(data_json)
+        loop = asyncio.get_running_loop()
+        entries, changed = await loop.run_in_executor(
+            None,
+            self.__scan,
+            self._entries.copy(),
+        )
+
+        self._entries = entries
+        self._index = _build_index(entries.values())
+        return changed
+
+    def entries(self, data_type: DataType) -> list[CatalogueEntry]:
+        """Returns all of the indexed entries of the given `data_type`."""
+
+        return list(self._index.get(data_type, {}).values())
+
+    def get_entry(self, data_type: DataType, name: str) -> Optional[CatalogueEntry]:
+        """Fetches the entry of the given `data_type` with the metadata name
+        `name`. Returns `None` if not indexed."""
+
+        return self._index.get(data_type, {}).get(name)
+
+    async def document(self, data_type: DataType, name: str) -> Optional[JSONDocument]:
+        """Returns the parsed document of the given `data_type` and `name`,
+        parsing it inside of a loop executor on first access.
+
+        Returns:
+            `JSONDocument` if indexed and parsed successfully.
+            Else `None`.
+        """
+
+        if (entry := self.get_entry(data_type, name)) is None:
+            return None
+
+        return await self.__parse_entry(entry)
+
+    async def documents(self, data_type: DataType) -> list[JSONDocument]:
+        """Returns all successfully parsed documents of the given `data_type`."""
+
+        docs = await asyncio.gather(
+            *(self.__parse_entry(entry) for entry in self.entries(data_type))
+        )
+        return [doc for doc in docs if doc is not None]
 
     def clear(self) -> None:
-        """Removes all of the items in the repository."""
+        """Removes all of the documents from the catalogue."""
 
-        self._repo.clear()
+        self._entries.clear()
+        self._index.clear()
 
     # Private methods.
-    def __parse_json(self, d: dict[str, Any]) -> bool:
-        """Attempts to parse a documents JSON into objects, inserting into the
-        repo on success.
-        
+    async def __parse_entry(self, entry: CatalogueEntry) -> Optional[JSONDocument]:
+        """Parses the body of the document for `entry` if not yet parsed,
+        deduplicating concurrent requests for the same document."""
+
+        if entry.document is not None:
+            return entry.document
+
+        if (fut := self._parsing.get(entry.path)) is not None:
+            return await fut
+
+        loop = asyncio.get_running_loop()
+        fut = self._parsing[entry.path] = loop.run_in_executor(
+            None,
+            _parse_document,
+            entry.path,
+        )
+
+        try:
+            entry.document = await fut
+        finally:
+            del self._parsing[entry.path]
+
+        if entry.document is None:
+            error("Failed parsing %s from the resource catalogue.", entry.path)
+        return entry.document
+
+    def __scan(self, old_entries: dict[Path, CatalogueEntry]) -> tuple[
+        dict[Path, CatalogueEntry], int
+    ]:
+        """Crawls the resource root for JSON documents, reusing entries from
+        `old_entries` that have not been modified. Meant to be ran inside of a
+        loop executor.
+
         Returns:
-            `bool` relating to the success of the action.
+            Tuple of the new entries and the number of documents (re-)indexed.
         """
 
-        try:
-            metadata = JSONMetadata(**d["metadata"])
-            self._repo[metadata.data_type] = JSONDocument(
+        entries = {}
+        changed = 0
+
+        for path, mtime_ns in _crawl_json_documents(self._root):
+            old = old_entries.get(path)
+            if old is not None and old.mtime_ns == mtime_ns:
+                entries[path] = old
+                continue
+
+            if (metadata := _read_metadata(path)) is None:
+                error("Failed indexing %s into the resource catalogue.", path)
+                continue
+
+            debug("Indexed %s into the resource catalogue.", path)
+            entries[path] = CatalogueEntry(
+                path= path,
+                mtime_ns= mtime_ns,
                 metadata= metadata,
-                data= d["data"],
             )
-            return True
-        except (ValidationError, KeyError):
-            return False
-
-# https://stackoverflow.com/a/59596244
-def _crawl_json_documents() -> list[str]:
-    """Crawls the directories of all JSON documents inside of `resources/json`
-    and its subdirectories."""
-
-    return [
-        os.path.join(dirpath, filename)
-        for dirpath, _, filenames in os.walk('.')
-        for filename in filenames if filename.endswith('.json')
-    ]
+            changed += 1
+
+        return entries, changed
+
+def _build_index(entries: Iterable[CatalogueEntry]) -> dict[
+    DataType, dict[str, CatalogueEntry]
+]:
+    """Creates a lookup of the entries by their data type and name."""
+
+    index = {}
+    for entry in entries:
+        index.setdefault(entry.metadata.data_type, {})[entry.metadata.name] = entry
+    return index
+
+def _read_metadata(path: Path) -> Optional[JSONMetadata]:
+    """Parses just the metadata header of the document at `path`, avoiding
+    parsing the document body where possible. Returns `None` on fail."""
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_HEADER_READ_SIZE)
+            metadata = _decode_header(head.decode(errors= "ignore"))
+
+            # The header did not fit in the initial read.
+            if metadata is None:
+                metadata = _decode_header(
+                    (head + f.read()).decode(errors= "ignore"),
+                )
+    except OSError:
+        return None
+
+    if metadata is None:
+        return None
+
+    try:
+        return JSONMetadata(**metadata)
+    except (ValidationError, TypeError):
+        return None
+
+def _decode_header(text: str) -> Optional[dict[str, Any]]:
+    """Decodes the value of the top level `metadata` key from a (possibly
+    partial) JSON document. Returns `None` if not present or incomplete.
+
+    Note:
+        Only the top level keys (and values) preceding `metadata` are
+            decoded, so documents should start with it.
+    """
+
+    idx = _skip_whitespace(text, 0)
+    if text[idx:idx + 1] != "{":
+        return None
+
+    try:
+        while True:
+            key, idx = _HEADER_DECODER.raw_decode(text, _skip_whitespace(text, idx + 1))
+            idx = _skip_whitespace(text, idx)
+            if text[idx:idx + 1] != ":":
+                return None
+
+            value, idx = _HEADER_DECODER.raw_decode(text, _skip_whitespace(text, idx + 1))
+            if key == "metadata":
+                return value if isinstance(value, dict) else None
+
+            idx = _skip_whitespace(text, idx)
+            if text[idx:idx + 1] != ",":
+                return None
+    except json.JSONDecodeError:
+        return None
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    """Returns the index of the first non-whitespace character from `idx`,
+    as `raw_decode` does not skip leading whitespace."""
+
+    while idx < len(text) and text[idx].isspace():
+        idx += 1
+    return idx
+
+def _parse_document(path: Path) -> Optional[JSONDocument]:
+    """Reads and parses an entire document from `path`. Returns `None`
+    on fail."""
+
+    try:
+        with open(path, "rb") as f:
+            d = _loads(f.read())
+
+        return JSONDocument(
+            metadata= JSONMetadata(**d["metadata"]),
+            data= d["data"],
+        )
+    except (OSError, ValueError, ValidationError, KeyError, TypeError):
+        return None
+
+def _crawl_json_documents(root: Path) -> list[tuple[Path, int]]:
+    """Crawls the directories of all JSON documents inside of `root` and its
+    subdirectories, returning their paths alongside modification times."""
+
+    res = []
+    stack = [root]
+
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+
+        with it:
+            for dir_entry in it:
+                # Symlinked directories could lead back to their parents.
+                if dir_entry.is_dir(follow_symlinks= False):
+                    stack.append(Path(dir_entry.path))
+                elif dir_entry.name.endswith(".json"):
+                    res.append((Path(dir_entry.path), dir_entry.stat().st_mtime_ns))
+
+    return res
@@ -0,0 +1,295 @@
+# An in-process stand-in for the subset of the `aioredis` (1.x) API used by
+# Kisumi, allowing for the cluster mode to be ran and tested without a Redis
+# server. Selected with a `REDIS_DSN` of `local://`.
+from collections import deque
+from typing import (
+    Callable,
+    Optional,
+    Union,
+)
+import asyncio
+import time
+
+RedisValue = Union[bytes, str, int, float]
+
+def _encode(value: RedisValue) -> bytes:
+    """Converts a value to bytes the same way Redis stores it."""
+
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return str(value).encode()
+
+class LocalChannel:
+    """A pub/sub channel subscription, mirroring `aioredis.Channel`."""
+
+    __slots__ = (
+        "name",
+        "_messages",
+        "_waiter",
+        "_closed",
+    )
+
+    def __init__(self, name: bytes) -> None:
+        self.name = name
+        self._messages: deque[bytes] = deque()
+        self._waiter = asyncio.Event()
+        self._closed = False
+
+    @property
+    def is_active(self) -> bool:
+        """Whether the channel is subscribed or still holds messages."""
+
+        return not self._closed or bool(self._messages)
+
+    # Public methods.
+    async def wait_message(self) -> bool:
+        """Waits for a message to be available, returning `False` once the
+        channel is closed and empty."""
+
+        while not self._messages:
+            if self._closed:
+                return False
+
+            self._waiter.clear()
+            await self._waiter.wait()
+        return True
+
+    async def get(self) -> Optional[bytes]:
+        """Returns the next message, or `None` once the channel is closed
+        and empty."""
+
+        if not await self.wait_message():
+            return None
+        return self._messages.popleft()
+
+    def close(self) -> None:
+        self._closed = True
+        self._waiter.set()
+
+    # Private methods.
+    def _put(self, message: bytes) -> None:
+        self._messages.append(message)
+        self._waiter.set()
+
+class LocalRedis:
+    """An in-process Redis holding strings and hashes, alongside pub/sub.
+
+    Note:
+        Several `LocalRedis` clients may share a single `LocalRedisServer`,
+            acting as separate nodes connected to the same Redis.
+    """
+
+    __slots__ = (
+        "_server",
+        "_channels",
+    )
+
+    def __init__(self, server: Optional["LocalRedisServer"] = None) -> None:
+        self._server = server or LocalRedisServer()
+        # The subscriptions made through this client.
+        self._channels: dict[bytes, LocalChannel] = {}
+
+    # Strings.
+    async def get(self, key: RedisValue) -> Optional[bytes]:
+        return self._server.strings.get(_encode(key))
+
+    async def set(self, key: RedisValue, value: RedisValue) -> bool:
+        key = _encode(key)
+        self._server.strings[key] = _encode(value)
+        # Setting a key clears its expiry, as in Redis.
+        self._server.expiries.pop(key, None)
+        return True
+
+    async def delete(self, key: RedisValue, *keys: RedisValue) -> int:
+        deleted = 0
+        for k in map(_encode, (key, *keys)):
+            self._server.expiries.pop(k, None)
+            deleted += (self._server.strings.pop(k, None) is not None) \
+                + (self._server.hashes.pop(k, None) is not None)
+        return deleted
+
+    async def incr(self, key: RedisValue) -> int:
+        key = _encode(key)
+        value = int(self._server.strings.get(key, b"0")) + 1
+        self._server.strings[key] = _encode(value)
+        return value
+
+    async def expire(self, key: RedisValue, timeout: float) -> int:
+        """Expires `key` after `timeout` seconds, returning whether it
+        exists."""
+
+        key = _encode(key)
+        if key not in self._server.strings and key not in self._server.hashes:
+            return 0
+
+        self._server.expiries[key] = time.monotonic() + timeout
+        return 1
+
+    def multi_exec(self) -> "LocalTransaction":
+        """Starts a `MULTI`/`EXEC` block, see `LocalTransaction`."""
+
+        return LocalTransaction(self)
+
+    # Hashes.
+    async def hset(self, key: RedisValue, field: RedisValue,
+                   value: RedisValue) -> int:
+        h = self._server.hashes.setdefault(_encode(key), {})
+        field = _encode(field)
+        created = field not in h
+        h[field] = _encode(value)
+        return int(created)
+
+    async def hsetnx(self, key: RedisValue, field: RedisValue,
+                     value: RedisValue) -> int:
+        h = self._server.hashes.setdefault(_encode(key), {})
+        field = _encode(field)
+        if field in h:
+            return 0
+
+        h[field] = _encode(value)
+        return 1
+
+    async def hget(self, key: RedisValue, field: RedisValue) -> Optional[bytes]:
+        return self._server.hashes.get(_encode(key), {}).get(_encode(field))
+
+    async def hmget(self, key: RedisValue, field: RedisValue,
+                    *fields: RedisValue) -> list[Optional[bytes]]:
+        h = self._server.hashes.get(_encode(key), {})
+        return [h.get(_encode(f)) for f in (field, *fields)]
+
+    async def hdel(self, key: RedisValue, field: RedisValue,
+                   *fields: RedisValue) -> int:
+        key = _encode(key)
+        if (h := self._server.hashes.get(key)) is None:
+            return 0
+
+        deleted = sum(
+            h.pop(f, None) is not None for f in map(_encode, (field, *fields))
+        )
+        if not h:
+            del self._server.hashes[key]
+        return deleted
+
+    async def hgetall(self, key: RedisValue) -> dict[bytes, bytes]:
+        return dict(self._server.hashes.get(_encode(key), {}))
+
+    async def hlen(self, key: RedisValue) -> int:
+        return len(self._server.hashes.get(_encode(key), {}))
+
+    # Pub/sub.
+    async def publish(self, channel: RedisValue, message: RedisValue) -> int:
+        """Publishes `message`, returning the number of subscribers it was
+        delivered to."""
+
+        subscribers = self._server.subscribers.get(_encode(channel), ())
+        message = _encode(message)
+        for sub in subscribers:
+            sub._put(message)
+        return len(subscribers)
+
+    async def subscribe(self, channel: RedisValue,
+                        *channels: RedisValue) -> list[LocalChannel]:
+        subscribed = []
+        for name in map(_encode, (channel, *channels)):
+            if (ch := self._channels.get(name)) is None:
+                ch = self._channels[name] = LocalChannel(name)
+                self._server.subscribers.setdefault(name, []).append(ch)
+            subscribed.append(ch)
+        return subscribed
+
+    async def unsubscribe(self, channel: RedisValue, *channels: RedisValue) -> None:
+        for name in map(_encode, (channel, *channels)):
+            if (ch := self._channels.pop(name, None)) is None:
+                continue
+
+            self._server.subscribers[name].remove(ch)
+            ch.close()
+
+    def close(self) -> None:
+        for name, ch in self._channels.items():
+            self._server.subscribers[name].remove(ch)
+            ch.close()
+        self._channels.clear()
+
+    async def wait_closed(self) -> None:
+        ...
+
+class LocalTransaction:
+    """A `MULTI`/`EXEC` block, mirroring `aioredis.commands.MultiExec`.
+    Commands return futures of their results, and are only ran once
+    `execute` is awaited.
+
+    Note:
+        None of the `LocalRedis` commands yield to the event loop, so the
+            block is ran without anything interleaving it.
+    """
+
+    __slots__ = (
+        "_redis",
+        "_commands",
+    )
+
+    def __init__(self, redis: LocalRedis) -> None:
+        self._redis = redis
+        self._commands: list[tuple[asyncio.Future, Callable, tuple]] = []
+
+    def __getattr__(self, name: str) -> Callable[..., asyncio.Future]:
+        command = getattr(self._redis, name)
+
+        def queue(*args) -> asyncio.Future:
+            fut = asyncio.get_running_loop().create_future()
+            self._commands.append((fut, command, args))
+            return fut
+        return queue
+
+    # Public methods.
+    async def execute(self) -> list:
+        """Runs the queued commands, returning their results in order."""
+
+        commands, self._commands = self._commands, []
+        results = []
+        for fut, command, args in commands:
+            result = await command(*args)
+            fut.set_result(result)
+            results.append(result)
+        return results
+
+class LocalRedisServer:
+    """The data shared by all `LocalRedis` clients connected to it."""
+
+    __slots__ = (
+        "_strings",
+        "_hashes",
+        "subscribers",
+        "expiries",
+    )
+
+    def __init__(self) -> None:
+        self._strings: dict[bytes, bytes] = {}
+        self._hashes: dict[bytes, dict[bytes, bytes]] = {}
+        self.subscribers: dict[bytes, list[LocalChannel]] = {}
+        # When keys set to expire do, by key.
+        self.expiries: dict[bytes, float] = {}
+
+    @property
+    def strings(self) -> dict[bytes, bytes]:
+        self.__purge_expired()
+        return self._strings
+
+    @property
+    def hashes(self) -> dict[bytes, dict[bytes, bytes]]:
+        self.__purge_expired()
+        return self._hashes
+
+    # Private methods.
+    def __purge_expired(self) -> None:
+        if not self.expiries:
+            return
+
+        now = time.monotonic()
+        for key in [k for k, at in self.expiries.items() if at <= now]:
+            del self.expiries[key]
+            self._strings.pop(key, None)
+            self._hashes.pop(key, None)
@@ -0,0 +1,476 @@
+# Sharing of the online users between several Kisumi nodes (processes or
+# hosts), with packets for users on other nodes routed between them.
+#
+# Redis layout (`ClusterNode`):
+#   kisumi:cluster:online      hash of user id -> owning node id
+#   kisumi:cluster:presence    hash of user id -> presence packet
+#   kisumi:cluster:stats       hash of user id -> stats packet
+#   kisumi:cluster:broadcast   channel of broadcasts, each message being
+#                              u16 node id length, node id, packets
+#   kisumi:cluster:node:<id>   channel of packets for the users of a node,
+#                              each message being repeated
+#                              i32 user id, u32 length, packets
+from abc import ABC, abstractmethod
+from typing import (
+    Iterable,
+    Optional,
+    TYPE_CHECKING,
+)
+from user.client.components.queue import ByteLike
+from logger import info, error
+from utils import metrics
+from state import repos
+import traceback
+import asyncio
+import struct
+
+if TYPE_CHECKING:
+    from user.user import User
+
+_ONLINE_KEY = "kisumi:cluster:online"
+_PRESENCE_KEY = "kisumi:cluster:presence"
+_STATS_KEY = "kisumi:cluster:stats"
+_BROADCAST_CHANNEL = "kisumi:cluster:broadcast"
+_NODE_CHANNEL = "kisumi:cluster:node:{}"
+
+_ORIGIN = struct.Struct("<H")
+_TARGET = struct.Struct("<iI")
+
+# Batches are sent early once they reach this size (in bytes).
+_MAX_BATCH = 1 << 20
+# Seconds waited between attempts at resubscribing to a lost channel.
+_RESUBSCRIBE_DELAY = 1.0
+
+_MESSAGES = metrics.counter(
+    "kisumi_cluster_messages_total",
+    "Batches exchanged with the other nodes, by direction.",
+    labels= ("direction",),
+)
+_MESSAGES_SENT = _MESSAGES.labels("sent")
+_MESSAGES_RECEIVED = _MESSAGES.labels("received")
+_PACKET_BYTES = metrics.counter(
+    "kisumi_cluster_packet_bytes_total",
+    "Packet bytes exchanged with the other nodes, by direction.",
+    labels= ("direction",),
+)
+_PACKET_BYTES_SENT = _PACKET_BYTES.labels("sent")
+_PACKET_BYTES_RECEIVED = _PACKET_BYTES.labels("received")
+_RESUBSCRIBES = metrics.counter(
+    "kisumi_cluster_resubscribes_total",
+    "Pub/sub channels resubscribed to after their connection was lost.",
+)
+
+class AbstractNode(ABC):
+    """This process' membership of a group of Kisumi processes sharing their
+    online users. Keeps the shared online user index and exchanges the
+    packets for users of the other nodes.
+
+    Note:
+        Outgoing packets are buffered for `flush_interval` seconds, then
+            sent as a single batch per destination. Received batches are
+            queued for the local users in one go.
+        The requests of a session have to keep being routed to the node it
+            logged in on (eg by the client address), as the clients
+            themselves are not shared.
+    """
+
+    __slots__ = (
+        "node_id",
+        "flush_interval",
+        "_broadcasts",
+        "_targeted",
+        "_pending_size",
+        "_wakeup",
+        "_flusher",
+    )
+
+    def __init__(self, node_id: str, flush_interval: float = 0.005) -> None:
+        self.node_id = node_id
+        self.flush_interval = flush_interval
+
+        self._broadcasts: list[ByteLike] = []
+        # Packets for users on other nodes, by node id.
+        self._targeted: dict[str, bytearray] = {}
+        self._pending_size = 0
+        # Created lazily as it has to be created inside of the event loop.
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    # Abstract methods.
+    @abstractmethod
+    async def start(self) -> None:
+        ...
+
+    @abstractmethod
+    async def stop(self) -> None:
+        ...
+
+    @abstractmethod
+    async def claim(self, user_id: int) -> bool:
+        """Atomically marks the user as owned by this node, unless they are
+        online on another node. Returns whether this node owns them.
+
+        Note:
+            Has to succeed before a user is `register`ed, so that a user can
+                not be logged in on two nodes at once.
+        """
+
+    @abstractmethod
+    async def register(self, user: "User", presence: bytes, stats: bytes) -> None:
+        """Marks `user` as online on this node with the `presence` and
+        `stats` packets shown to the other nodes."""
+
+    @abstractmethod
+    async def update(self, user: "User", presence: bytes, stats: bytes) -> None:
+        """Replaces the `presence` and `stats` packets of a user registered
+        on this node (eg once their status changed)."""
+
+    @abstractmethod
+    async def unregister(self, users: list["User"]) -> None:
+        """Marks the `users` as no longer online on this node."""
+
+    @abstractmethod
+    async def owner(self, user_id: int) -> Optional[str]:
+        """Returns the id of the node the user is online on, if any."""
+
+    @abstractmethod
+    async def online_count(self) -> int:
+        """Returns the number of users online across all nodes."""
+
+    @abstractmethod
+    async def presences(self, user_ids: Optional[Iterable[int]] = None) -> dict[int, bytes]:
+        """Returns the presence packets of the online users out of
+        `user_ids` (or of all online users), by their ids."""
+
+    @abstractmethod
+    async def stats(self, user_ids: Iterable[int]) -> dict[int, bytes]:
+        """Returns the stats packets of the online users out of `user_ids`,
+        by their ids."""
+
+    @abstractmethod
+    async def _send_broadcast(self, batch: bytes) -> None:
+        """Sends a batch of packets to all other nodes."""
+
+    @abstractmethod
+    async def _send_targeted(self, node_id: str, batch: bytes) -> None:
+        """Sends a batch of targeted packets to the node `node_id`."""
+
+    # Public methods.
+    def assign_worker(self, index: int) -> None:
+        """Makes this node one of the worker processes started by `main`,
+        before it is started."""
+
+        self.node_id = f"{self.node_id}/{index}"
+
+    def broadcast(self, b: ByteLike) -> None:
+        """Queues `b` to be delivered to all users on the other nodes."""
+
+        self._broadcasts.append(b)
+        self.__pending(len(b))
+
+    def enqueue(self, node_id: str, user_id: int, b: ByteLike) -> None:
+        """Queues `b` to be delivered to the user `user_id` on the node
+        `node_id`."""
+
+        if (buf := self._targeted.get(node_id)) is None:
+            buf = self._targeted[node_id] = bytearray()
+
+        buf += _TARGET.pack(user_id, len(b))
+        buf += b
+        self.__pending(len(b))
+
+    async def flush(self) -> None:
+        """Sends everything buffered."""
+
+        if not self._pending_size:
+            return
+
+        broadcasts, self._broadcasts = self._broadcasts, []
+        targeted, self._targeted = self._targeted, {}
+        _PACKET_BYTES_SENT.inc(self._pending_size)
+        self._pending_size = 0
+
+        sends = [
+            self._send_targeted(node_id, bytes(buf))
+            for node_id, buf in targeted.items()
+        ]
+        if broadcasts:
+            sends.append(self._send_broadcast(b"".join(broadcasts)))
+
+        _MESSAGES_SENT.inc(len(sends))
+        await asyncio.gather(*sends)
+
+    # Protected methods.
+    def _start_flusher(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(
+            self.__flush_loop(),
+            name= f"cluster:{self.node_id}:flush",
+        )
+
+    async def _stop_flusher(self) -> None:
+        """Stops the periodic flushing, sending anything still buffered."""
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions= True)
+            self._flusher = None
+
+        await self.flush()
+
+    async def _deliver_broadcast(self, batch: ByteLike) -> None:
+        """Queues a received batch of broadcasts for the local users."""
+
+        _MESSAGES_RECEIVED.inc()
+        _PACKET_BYTES_RECEIVED.inc(len(batch))
+        await repos.online.broadcast_local(batch)
+
+    async def _deliver_targeted(self, batch: ByteLike) -> None:
+        """Queues a received batch of targeted packets for the local users."""
+
+        _MESSAGES_RECEIVED.inc()
+        # Joined per user, so each is queued once per batch.
+        packets: dict[int, bytearray] = {}
+        view = memoryview(batch)
+        offset = 0
+        while offset < len(view):
+            user_id, length = _TARGET.unpack_from(view, offset)
+            offset += _TARGET.size
+            if (buf := packets.get(user_id)) is None:
+                buf = packets[user_id] = bytearray()
+            buf += view[offset:offset + length]
+            offset += length
+            _PACKET_BYTES_RECEIVED.inc(length)
+
+        for user_id, buf in packets.items():
+            await repos.online.enqueue_local(user_id, buf)
+
+    # Private methods.
+    def __pending(self, size: int) -> None:
+        self._pending_size += size
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def __flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Gives the rest of the batch a chance to arrive.
+            if self._pending_size < _MAX_BATCH:
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                error("Failed sending to the other nodes!\n%s", traceback.format_exc())
+
+class ClusterNode(AbstractNode):
+    """A node of a cluster spanning several hosts, sharing the online user
+    index through Redis and routing packets over its pub/sub channels."""
+
+    __slots__ = (
+        "_redis",
+        "_channel",
+        "_receivers",
+    )
+
+    def __init__(self, node_id: str, flush_interval: float = 0.005) -> None:
+        super().__init__(node_id, flush_interval)
+
+        self._redis = None
+        self._channel = _NODE_CHANNEL.format(node_id)
+        self._receivers: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        """Whether the node is connected to the cluster."""
+
+        return self._redis is not None
+
+    # Public methods.
+    def assign_worker(self, index: int) -> None:
+        super().assign_worker(index)
+        self._channel = _NODE_CHANNEL.format(self.node_id)
+
+    async def start(self, redis = None) -> None:
+        """Joins the cluster through `redis`, defaulting to the shared
+        connection pool."""
+
+        assert self._redis is None, "The cluster node is already running!"
+
+        if redis is None:
+            from state import db
+            redis = db.redis
+
+        self._redis = redis
+
+        # A previous run of this node may have not left cleanly.
+        stale = await self.__purge_users()
+
+        broadcast_ch, node_ch = await redis.subscribe(
+            _BROADCAST_CHANNEL,
+            self._channel,
+        )
+        self._receivers = [
+            asyncio.create_task(
+                self.__receive(_BROADCAST_CHANNEL, broadcast_ch, self.__on_broadcast),
+                name= "cluster:broadcast",
+            ),
+            asyncio.create_task(
+                self.__receive(self._channel, node_ch, self._deliver_targeted),
+                name= "cluster:node",
+            ),
+        ]
+        self._start_flusher()
+        info("Joined the cluster as node %s (removed %d stale users).",
+             self.node_id, stale)
+
+    async def stop(self) -> None:
+        """Leaves the cluster, publishing anything still buffered and taking
+        this node's users offline for the other nodes."""
+
+        if self._redis is None:
+            return
+
+        for task in self._receivers:
+            task.cancel()
+        await asyncio.gather(*self._receivers, return_exceptions= True)
+        self._receivers.clear()
+
+        await self._stop_flusher()
+        await self._redis.unsubscribe(_BROADCAST_CHANNEL, self._channel)
+        await self.__purge_users()
+        self._redis = None
+
+    async def claim(self, user_id: int) -> bool:
+        if await self._redis.hsetnx(_ONLINE_KEY, user_id, self.node_id):
+            return True
+
+        # Already claimed, possibly by us (eg a restored session).
+        return await self.owner(user_id) == self.node_id
+
+    async def register(self, user: "User", presence: bytes, stats: bytes) -> None:
+        tr = self._redis.multi_exec()
+        tr.hset(_ONLINE_KEY, user.id, self.node_id)
+        tr.hset(_PRESENCE_KEY, user.id, presence)
+        tr.hset(_STATS_KEY, user.id, stats)
+        await tr.execute()
+
+    async def update(self, user: "User", presence: bytes, stats: bytes) -> None:
+        tr = self._redis.multi_exec()
+        tr.hset(_PRESENCE_KEY, user.id, presence)
+        tr.hset(_STATS_KEY, user.id, stats)
+        await tr.execute()
+
+    async def unregister(self, users: list["User"]) -> None:
+        if not users:
+            return
+
+        await self.__remove([user.id for user in users])
+
+    async def owner(self, user_id: int) -> Optional[str]:
+        if (node := await self._redis.hget(_ONLINE_KEY, user_id)) is None:
+            return None
+        return node.decode()
+
+    async def online_count(self) -> int:
+        return await self._redis.hlen(_ONLINE_KEY)
+
+    async def presences(self, user_ids: Optional[Iterable[int]] = None) -> dict[int, bytes]:
+        if user_ids is None:
+            return {
+                int(user_id): packet for user_id, packet
+                in (await self._redis.hgetall(_PRESENCE_KEY)).items()
+            }
+
+        return await self.__get_many(_PRESENCE_KEY, user_ids)
+
+    async def stats(self, user_ids: Iterable[int]) -> dict[int, bytes]:
+        return await self.__get_many(_STATS_KEY, user_ids)
+
+    # Protected methods.
+    async def _send_broadcast(self, batch: bytes) -> None:
+        origin = self.node_id.encode()
+        await self._redis.publish(
+            _BROADCAST_CHANNEL,
+            b"".join((_ORIGIN.pack(len(origin)), origin, batch)),
+        )
+
+    async def _send_targeted(self, node_id: str, batch: bytes) -> None:
+        await self._redis.publish(_NODE_CHANNEL.format(node_id), batch)
+
+    # Private methods.
+    async def __get_many(self, key: str, user_ids: Iterable[int]) -> dict[int, bytes]:
+        if not (user_ids := list(user_ids)):
+            return {}
+
+        return {
+            user_id: packet for user_id, packet
+            in zip(user_ids, await self._redis.hmget(key, *user_ids))
+            if packet is not None
+        }
+
+    async def __remove(self, user_ids: list) -> None:
+        tr = self._redis.multi_exec()
+        tr.hdel(_ONLINE_KEY, *user_ids)
+        tr.hdel(_PRESENCE_KEY, *user_ids)
+        tr.hdel(_STATS_KEY, *user_ids)
+        await tr.execute()
+
+    async def __purge_users(self) -> int:
+        """Removes all users marked as online on this node from Redis."""
+
+        ours = [
+            user_id for user_id, node in (await self._redis.hgetall(_ONLINE_KEY)).items()
+            if node.decode() == self.node_id
+        ]
+        if ours:
+            await self.__remove(ours)
+        return len(ours)
+
+    async def __receive(self, name: str, channel, handler) -> None:
+        """Handles the messages of the subscribed `channel` until the node
+        stops, resubscribing to it whenever the subscription is lost.
+
+        Note:
+            Messages published while resubscribing are lost.
+        """
+
+        while True:
+            while await channel.wait_message():
+                if (message := await channel.get()) is None:
+                    continue
+
+                try:
+                    await handler(message)
+                except Exception:
+                    error("Failed handling a cluster message!\n%s",
+                          traceback.format_exc())
+
+            # Receivers are cancelled before the node unsubscribes, so the
+            # connection was lost.
+            error("Lost the subscription to the cluster channel %s, resubscribing.",
+                  name)
+            channel = await self.__resubscribe(name)
+            _RESUBSCRIBES.inc()
+
+    async def __resubscribe(self, name: str):
+        """Subscribes to the channel `name`, retrying until it succeeds."""
+
+        while True:
+            try:
+                channel, = await self._redis.subscribe(name)
+                return channel
+            except Exception:
+                error("Failed resubscribing to the cluster channel %s!\n%s",
+                      name, traceback.format_exc())
+            await asyncio.sleep(_RESUBSCRIBE_DELAY)
+
+    async def __on_broadcast(self, message: bytes) -> None:
+        origin_len, = _ORIGIN.unpack_from(message)
+        offset = _ORIGIN.size + origin_len
+        # Our own broadcasts were already delivered locally.
+        if message[_ORIGIN.size:offset].decode() == self.node_id:
+            return
+
+        await self._deliver_broadcast(memoryview(message)[offset:])
@@ -1,4 +1,5 @@
 import sys
+import socket
 from pathlib import Path
 from starlette.config import Config
 from starlette.datastructures import Secret
@@ -11,6 +12,7 @@ MONGO_HOST = config("MONGO_HOST", default= "localhost")
 MONGO_PORT = config("MONGO_PORT", cast= int, default= 27017)
 MONGO_DB = config("MONGO_DB", default= "rosu")
 
+# `local://` uses an in-process stand-in, for running without a Redis server.
 REDIS_DSN = config("REDIS_DSN", cast= Secret)
 
 DATA_DIR = config("DATA_DIR", cast= Path)
@@ -19,5 +21,69 @@ SERVER_NAME = config("SERVER_NAME", cast= str, default= "RealistikOsu")
 SERVER_DOMAIN = config("SERVER_DOMAIN", cast= str, default= "ussr.pl")
 SERVER_PORT = config("SERVER_PORT", cast= int, default= 5344)
 
+# The number of worker processes started, each listening on its own port
+# from `SERVER_PORT` onwards. The workers share the online users' presences
+# and stats through shared memory.
+WORKERS = config("WORKERS", cast= int, default= 1)
+# The number of users each worker can share with the other workers.
+WORKER_SLOTS = config("WORKER_SLOTS", cast= int, default= 16384)
+
+# Share the online users with other Kisumi nodes through Redis, routing the
+# packets for users on other nodes over pub/sub.
+CLUSTER_ENABLED = config("CLUSTER_ENABLED", cast= bool, default= False)
+# The name of this node, unique within the cluster and kept across restarts.
+CLUSTER_NODE_ID = config(
+    "CLUSTER_NODE_ID",
+    cast= str,
+    default= f"{socket.gethostname()}:{SERVER_PORT}",
+)
+# How long packets for other nodes (or workers) are held to be sent together
+# (in milliseconds).
+CLUSTER_FLUSH_INTERVAL_MS = config("CLUSTER_FLUSH_INTERVAL_MS", cast= int, default= 5)
+
+BOT_USER_ID = config("BOT_USER_ID", cast= int, default= 999)
+BOT_USER_NAME = config("BOT_USER_NAME", cast= str, default= SERVER_NAME)
+
+# Expose the runtime metrics at `/metrics` on the debug server (see
+# `DEBUG_SERVER_PORT`), which is only bound to localhost.
+METRICS_ENABLED = config("METRICS_ENABLED", cast= bool, default= True)
+
+# Report event loop stalls longer than this (in milliseconds). 0 disables
+# the loop lag monitor.
+LOOP_LAG_THRESHOLD_MS = config("LOOP_LAG_THRESHOLD_MS", cast= int, default= 100)
+# The minimum time between loop stall reports (in seconds).
+LOOP_LAG_REPORT_INTERVAL = config("LOOP_LAG_REPORT_INTERVAL", cast= int, default= 60)
+
+# Expose debugging tools such as the CPU profiler on the debug server. It is
+# always bound to localhost, and also started for the metrics.
+DEBUG_SERVER_ENABLED = config("DEBUG_SERVER_ENABLED", cast= bool, default= False)
+DEBUG_SERVER_PORT = config("DEBUG_SERVER_PORT", cast= int, default= 5345)
+
+# The number of synthetic users seeded on startup for load testing.
+SYNTHETIC_USERS = config("SYNTHETIC_USERS", cast= int, default= 0)
+
+# Write logs as JSON lines rather than the coloured format.
+LOG_JSON = config("LOG_JSON", cast= bool, default= False)
+# The maximum number of log records queued before new ones are dropped.
+LOG_QUEUE_SIZE = config("LOG_QUEUE_SIZE", cast= int, default= 65536)
+# The fraction (0 to 1) of bancho requests to log.
+LOG_REQUEST_SAMPLE_RATE = config("LOG_REQUEST_SAMPLE_RATE", cast= float, default= 0.0)
+
+# Record bancho sessions into an append-only capture file, which can be
+# replayed against another instance with `tools.replay`.
+CAPTURE_ENABLED = config("CAPTURE_ENABLED", cast= bool, default= False)
+CAPTURE_PATH = config("CAPTURE_PATH", cast= Path, default= DATA_DIR / "bancho.kcap")
+# The fraction (0 to 1) of sessions captured.
+CAPTURE_SAMPLE_RATE = config("CAPTURE_SAMPLE_RATE", cast= float, default= 1.0)
+
 CRYPT_JWT_SECRET = config("CRYPT_JWT_SECRET", cast= str, default= "very secret")
 CRYPT_JWT_EXPIRY = config("CRYPT_JWT_EXPIRY", cast= int, default= 172800)
+
+# The number of session tokens cached alongside their clients, sparing the
+# token from being verified on every poll.
+SESSION_CACHE_SIZE = config("SESSION_CACHE_SIZE", cast= int, default= 65536)
+# Clients are logged out after not polling for this long (in seconds). 0
+# disables timing out clients.
+SESSION_TIMEOUT = config("SESSION_TIMEOUT", cast= int, default= 120)
+# Sessions snapshotted on shutdown older than this (in seconds) are not restored.
+SESSION_SNAPSHOT_MAX_AGE = config("SESSION_SNAPSHOT_MAX_AGE", cast= int, default= 300)
@@ -1,12 +1,14 @@
-import aioredis
 import traceback
 from logger import error
 from state import config
-from motor import motor_asyncio
+from utils.lazy import lazy_import
 
-mongo_client: motor_asyncio.AsyncIOMotorClient
-mongo: motor_asyncio.AsyncIOMotorDatabase
-redis: aioredis.Redis
+aioredis = lazy_import("aioredis")
+motor_asyncio = lazy_import("motor.motor_asyncio")
+
+mongo_client: "motor_asyncio.AsyncIOMotorClient"
+mongo: "motor_asyncio.AsyncIOMotorDatabase"
+redis: "aioredis.Redis"
 
 async def initialise_database_connections() -> None:
     global mongo_client, mongo, redis
@@ -19,7 +21,11 @@ async def initialise_database_connections() -> None:
 
     mongo = mongo_client[config.MONGO_DB]
 
-    redis = await aioredis.create_redis_pool(str(config.REDIS_DSN))
+    if str(config.REDIS_DSN).startswith("local://"):
+        from state._local_redis import LocalRedis
+        redis = LocalRedis()
+    else:
+        redis = await aioredis.create_redis_pool(str(config.REDIS_DSN))
 
     # Redis connection test.
     # TODO: Move to function.
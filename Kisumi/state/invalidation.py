@@ -0,0 +1,266 @@
+# Invalidation of the user data cached by every Kisumi process whenever it
+# is changed by one of them, published over Redis pub/sub.
+#
+# Messages (little endian): 16 byte origin, then repeated
+#   u8 entity, i32 id, u64 version.
+from enum import IntEnum
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+)
+from utils.cache import LRUCache
+from logger import info, error
+from utils import metrics
+import traceback
+import asyncio
+import struct
+import uuid
+
+InvalidationHandler = Callable[[list[int]], Awaitable[Any]]
+
+_CHANNEL = "kisumi:invalidation"
+_VERSION_KEY = "kisumi:invalidation:version:{}:{}"
+# The time in seconds the version of an unchanged entity is kept in Redis.
+# Applied versions are forgotten in half that time, before the version
+# could restart from 1.
+_VERSION_TTL = 24 * 60 * 60
+
+_ORIGIN_SIZE = 16
+_ENTRY = struct.Struct("<BiQ")
+
+_INVALIDATIONS = metrics.counter(
+    "kisumi_invalidations_total",
+    "Cache invalidations received, by whether they were applied or dropped "
+    "as stale.",
+    labels= ("result",),
+)
+_INVALIDATIONS_APPLIED = _INVALIDATIONS.labels("applied")
+_INVALIDATIONS_STALE = _INVALIDATIONS.labels("stale")
+_INVALIDATIONS_PUBLISHED = metrics.counter(
+    "kisumi_invalidations_published_total",
+    "Cache invalidations published to the other processes.",
+)
+
+class Entity(IntEnum):
+    """The kinds of cached data which may be invalidated."""
+
+    # Name changes, restrictions and anything else stored on the user.
+    USER = 0
+    STATS = 1
+    SETTINGS = 2
+
+_ENTITY_VALUES = frozenset(Entity)
+
+class InvalidationBus:
+    """Tells every process to drop its cached copy of an entity once it has
+    changed, allowing for long cache lifetimes without serving stale data.
+
+    Note:
+        Each change is given a version, increasing per entity. Invalidations
+            no newer than the last one applied for an entity are dropped,
+            so reordered (or repeated) messages are harmless.
+        Invalidations are applied locally straight away, and sent to the
+            other processes in batches every `flush_interval` seconds. Only
+            the newest version of each entity is sent per batch.
+        Without being started (a single process), invalidations are only
+            applied locally.
+        Versions in Redis expire after `_VERSION_TTL` seconds without a
+            change, and applied versions after half of that.
+    """
+
+    __slots__ = (
+        "flush_interval",
+        "_origin",
+        "_handlers",
+        "_versions",
+        "_pending",
+        "_redis",
+        "_wakeup",
+        "_tasks",
+    )
+
+    def __init__(self, flush_interval: float = 0.005,
+                 max_versions: int = 65536) -> None:
+        self.flush_interval = flush_interval
+
+        # Identifies our own messages, which were already applied.
+        self._origin = uuid.uuid4().bytes
+        self._handlers: dict[Entity, list[InvalidationHandler]] = {}
+        # The last version applied for each entity. Entities evicted from
+        # here accept any version again.
+        self._versions: LRUCache[int] = LRUCache(
+            max_versions,
+            ttl= _VERSION_TTL / 2,
+            name= "invalidation_versions",
+        )
+        # The newest version of each entity waiting to be published.
+        self._pending: dict[tuple[Entity, int], int] = {}
+
+        self._redis = None
+        # Created lazily as it has to be created inside of the event loop.
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        """Whether invalidations are exchanged with the other processes."""
+
+        return self._redis is not None
+
+    @property
+    def subscribed(self) -> bool:
+        """Whether anything is subscribed to the invalidations. Without any
+        subscribers, there is no reason to start the bus."""
+
+        return bool(self._handlers)
+
+    # Public methods.
+    def subscribe(self, entity: Entity, handler: InvalidationHandler) -> None:
+        """Calls the coroutine function `handler` with the ids of the
+        invalidated entities of type `entity`, once per batch."""
+
+        self._handlers.setdefault(entity, []).append(handler)
+
+    def version(self, entity: Entity, entity_id: int) -> int:
+        """Returns the last version applied for an entity (0 if none)."""
+
+        return self._versions.fetch((entity, entity_id), 0)
+
+    async def start(self, redis = None) -> None:
+        """Starts exchanging invalidations through `redis`, defaulting to
+        the shared connection pool."""
+
+        assert self._redis is None, "The invalidation bus is already running!"
+
+        if redis is None:
+            from state import db
+            redis = db.redis
+
+        self._redis = redis
+        self._wakeup = asyncio.Event()
+
+        channel, = await redis.subscribe(_CHANNEL)
+        self._tasks = [
+            asyncio.create_task(self.__receive(channel), name= "invalidation:receive"),
+            asyncio.create_task(self.__flush_loop(), name= "invalidation:flush"),
+        ]
+        info("Started the cache invalidation bus.")
+
+    async def stop(self) -> None:
+        """Stops exchanging invalidations, publishing those still pending."""
+
+        if self._redis is None:
+            return
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions= True)
+        self._tasks.clear()
+
+        await self.flush()
+        await self._redis.unsubscribe(_CHANNEL)
+        self._redis = None
+
+    async def publish(self, entity: Entity, entity_id: int,
+                      version: Optional[int] = None) -> int:
+        """Invalidates an entity everywhere, returning its new version.
+
+        Note:
+            Without a `version`, the next one is taken from a counter in
+                Redis (or locally, if not running).
+        """
+
+        if version is None:
+            version = await self.__next_version(entity, entity_id)
+
+        await self.__apply([(entity, entity_id, version)])
+
+        if self._redis is not None:
+            key = (entity, entity_id)
+            if version > self._pending.get(key, 0):
+                self._pending[key] = version
+            self._wakeup.set()
+
+        return version
+
+    async def flush(self) -> None:
+        """Publishes the pending invalidations."""
+
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        message = bytearray(self._origin)
+        for (entity, entity_id), version in pending.items():
+            message += _ENTRY.pack(entity, entity_id, version)
+
+        _INVALIDATIONS_PUBLISHED.inc(len(pending))
+        await self._redis.publish(_CHANNEL, bytes(message))
+
+    # Private methods.
+    async def __next_version(self, entity: Entity, entity_id: int) -> int:
+        if self._redis is None:
+            return self.version(entity, entity_id) + 1
+
+        key = _VERSION_KEY.format(int(entity), entity_id)
+        tr = self._redis.multi_exec()
+        version = tr.incr(key)
+        tr.expire(key, _VERSION_TTL)
+        await tr.execute()
+        return await version
+
+    async def __apply(self, entries: list[tuple[Entity, int, int]]) -> None:
+        """Applies a batch of invalidations, dropping the stale ones."""
+
+        invalidated: dict[Entity, list[int]] = {}
+        for entity, entity_id, version in entries:
+            key = (entity, entity_id)
+            if version <= self._versions.fetch(key, 0):
+                _INVALIDATIONS_STALE.inc()
+                continue
+
+            self._versions.insert(key, version)
+            invalidated.setdefault(entity, []).append(entity_id)
+            _INVALIDATIONS_APPLIED.inc()
+
+        for entity, entity_ids in invalidated.items():
+            for handler in self._handlers.get(entity, ()):
+                try:
+                    await handler(entity_ids)
+                except Exception:
+                    error("Failed invalidating %s entities!\n%s",
+                          entity.name, traceback.format_exc())
+
+    async def __flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Gives the rest of the batch a chance to arrive.
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                error("Failed publishing invalidations!\n%s", traceback.format_exc())
+
+    async def __receive(self, channel) -> None:
+        while await channel.wait_message():
+            if (message := await channel.get()) is None:
+                continue
+
+            # Our own were applied when published.
+            if message[:_ORIGIN_SIZE] == self._origin:
+                continue
+
+            try:
+                await self.__apply([
+                    (Entity(entity), entity_id, version)
+                    for entity, entity_id, version
+                    in _ENTRY.iter_unpack(memoryview(message)[_ORIGIN_SIZE:])
+                    # Sent by a newer version of Kisumi.
+                    if entity in _ENTITY_VALUES
+                ])
+            except Exception:
+                error("Failed applying invalidations!\n%s", traceback.format_exc())
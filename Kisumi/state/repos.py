@@ -1,9 +1,42 @@
 from user.manager import UserManager
-from resources.loader import JSONLoader
+from resources.loader import ResourceCatalogue
 from resources.db.geo.geo import GeolocationDB
 from repositories.user import OnlineUsersRepo
+from localisation.table import LocalisationTable
+from user.activity import ActivityTracker
+from user.reaper import SessionReaper
+from state.cluster import AbstractNode, ClusterNode
+from state.workers import WorkerNode
+from state.invalidation import InvalidationBus
+from state import config
+from typing import Optional
 
 user_manager = UserManager()
-json_loader = JSONLoader()
+resources = ResourceCatalogue()
 geoloc = GeolocationDB()
-online = OnlineUsersRepo()
+# The node shared with the other Kisumi processes, if any. In cluster mode,
+# each worker is a separate node of the cluster.
+cluster: Optional[AbstractNode] = None
+if config.CLUSTER_ENABLED:
+    cluster = ClusterNode(
+        config.CLUSTER_NODE_ID,
+        flush_interval= config.CLUSTER_FLUSH_INTERVAL_MS / 1e+3,
+    )
+elif config.WORKERS > 1:
+    cluster = WorkerNode(
+        config.WORKERS,
+        config.WORKER_SLOTS,
+        config.DATA_DIR / "workers",
+        flush_interval= config.CLUSTER_FLUSH_INTERVAL_MS / 1e+3,
+    )
+online = OnlineUsersRepo(cluster)
+locale = LocalisationTable()
+activity = ActivityTracker()
+reaper = SessionReaper(config.SESSION_TIMEOUT)
+
+# Started alongside the node, keeping the caches of every process fresh.
+invalidation = InvalidationBus(
+    flush_interval= config.CLUSTER_FLUSH_INTERVAL_MS / 1e+3,
+)
+# NOTE: `user_manager.invalidate` is not subscribed until the users can be
+# loaded from the database, as invalidated users would otherwise be lost.
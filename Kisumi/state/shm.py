@@ -0,0 +1,450 @@
+# A table of the online users' presence and stats packets in shared memory,
+# read by all of the worker processes on a host without any round trips.
+#
+# Layout (all little endian):
+#   Header: 4s magic, u16 workers, u32 slots per worker, padded to 16 bytes.
+#   Partition headers, one per worker: u32 generation, u32 users, padded to
+#       16 bytes. The generation is odd while a user is being added to or
+#       removed from the partition, and even otherwise.
+#   Records, `slots` per worker, each partition written only by its worker:
+#       u32 sequence, i32 user id, u16 presence length, u16 stats length,
+#       u8 occupied, padded to 16 bytes, then the presence and stats
+#       packets in fixed size fields.
+#   Indexes, one per worker: a linear probing hash table of the partition's
+#       users, with a power of two (at least twice `slots`) entries of
+#       i32 user id, u32 slot + 1 (0 for an empty entry).
+#
+# Records and indexes are versioned seqlock style (by the record sequence
+# and the partition generation respectively): the writer makes the version
+# odd while writing, and readers retry if it was odd or changed during a
+# read.
+from multiprocessing import shared_memory
+from typing import (
+    Iterable,
+    Iterator,
+    Optional,
+)
+import struct
+import heapq
+
+_MAGIC = b"KPRS"
+_HEADER = struct.Struct("<4sHI6x")
+_PARTITION = struct.Struct("<II8x")
+_SEQ = struct.Struct("<I")
+_RECORD_HEADER = struct.Struct("<IiHHB3x")
+_INDEX_ENTRY = struct.Struct("<iI")
+
+PRESENCE_SIZE = 112
+STATS_SIZE = 256
+_RECORD_SIZE = _RECORD_HEADER.size + PRESENCE_SIZE + STATS_SIZE
+
+# Attempts at a consistent read before giving up on a record being written.
+_READ_RETRIES = 64
+
+def _index_capacity(slots: int) -> int:
+    """Returns the number of entries of a partition index, keeping it at most
+    half full."""
+
+    return 1 << (slots * 2 - 1).bit_length()
+
+def _index_home(user_id: int, mask: int) -> int:
+    """Returns the first index entry probed for `user_id`."""
+
+    # Fibonacci hashing, spreading sequential ids.
+    return ((user_id * 0x9E3779B1) & 0xFFFFFFFF) & mask
+
+class PresenceTable:
+    """A fixed size table of the online users' presence and stats packets,
+    shared by up to `workers` processes.
+
+    Note:
+        Each worker writes its users into its own partition of `slots`
+            records, so records only ever have a single writer. Users are
+            given the lowest free slot of their partition.
+        Each partition has a hash index of its users in the shared memory,
+            so finding (or missing) a user costs a probe per worker rather
+            than a scan of the partitions.
+        Packets larger than their fields are not stored, with the user
+            listed without them.
+    """
+
+    __slots__ = (
+        "workers",
+        "slots",
+        "_shm",
+        "_buf",
+        "_worker",
+        "_own",
+        "_free",
+        "_index_capacity",
+        "_index",
+        "_generations",
+    )
+
+    def __init__(self, shm: shared_memory.SharedMemory) -> None:
+        """Wraps an existing table in `shm`. See `create` and `attach`."""
+
+        magic, workers, slots = _HEADER.unpack_from(shm.buf)
+        assert magic == _MAGIC, "The shared memory does not hold a presence table!"
+
+        self.workers = workers
+        self.slots = slots
+        self._shm = shm
+        self._buf = shm.buf
+        self._worker: Optional[int] = None
+
+        # The slots of this worker's users, alongside a heap of the free ones.
+        self._own: dict[int, int] = {}
+        self._free: list[int] = []
+        self._index_capacity = _index_capacity(slots)
+        # The slots of the other workers' users by worker, as of the
+        # partition generations they were copied at. Only used for listing
+        # all users.
+        self._index: list[dict[int, int]] = [{} for _ in range(workers)]
+        self._generations = [-1] * workers
+
+    def __len__(self) -> int:
+        """Returns the number of users in the table."""
+
+        return sum(
+            _PARTITION.unpack_from(self._buf, self.__partition_offset(w))[1]
+            for w in range(self.workers)
+        )
+
+    @property
+    def name(self) -> str:
+        """The name of the shared memory block, used to `attach` to it."""
+
+        return self._shm.name
+
+    @staticmethod
+    def size(workers: int, slots: int) -> int:
+        """Returns the size of a table in bytes."""
+
+        return _HEADER.size + _PARTITION.size * workers \
+            + _RECORD_SIZE * workers * slots \
+            + _INDEX_ENTRY.size * workers * _index_capacity(slots)
+
+    @staticmethod
+    def create(workers: int, slots: int) -> "PresenceTable":
+        """Creates an empty table in a new shared memory block."""
+
+        shm = shared_memory.SharedMemory(
+            create= True,
+            size= PresenceTable.size(workers, slots),
+        )
+        # New shared memory is zeroed, leaving all records unoccupied.
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, workers, slots)
+        return PresenceTable(shm)
+
+    @staticmethod
+    def attach(name: str) -> "PresenceTable":
+        """Attaches to the table created under the shared memory `name`."""
+
+        return PresenceTable(shared_memory.SharedMemory(name= name))
+
+    # Public methods.
+    def set_worker(self, worker: int) -> None:
+        """Sets the partition written by this process."""
+
+        assert 0 <= worker < self.workers, "Worker index out of range!"
+
+        self._worker = worker
+        first = worker * self.slots
+        self._own.clear()
+        self._free = list(range(first, first + self.slots))
+
+    def put(self, user_id: int, presence: bytes, stats: bytes) -> bool:
+        """Stores the packets of `user_id` in this worker's partition,
+        returning `False` if it is full."""
+
+        assert self._worker is not None, "This process has no partition to write!"
+
+        if (slot := self._own.get(user_id)) is None:
+            if not self._free:
+                return False
+            slot = self._own[user_id] = heapq.heappop(self._free)
+            added = True
+        else:
+            added = False
+
+        if len(presence) > PRESENCE_SIZE:
+            presence = b""
+        if len(stats) > STATS_SIZE:
+            stats = b""
+
+        offset = self.__record_offset(slot)
+        seq, = _SEQ.unpack_from(self._buf, offset)
+        _SEQ.pack_into(self._buf, offset, seq + 1)
+
+        _RECORD_HEADER.pack_into(
+            self._buf, offset,
+            seq + 1, user_id, len(presence), len(stats), 1,
+        )
+        data = offset + _RECORD_HEADER.size
+        self._buf[data:data + len(presence)] = presence
+        data += PRESENCE_SIZE
+        self._buf[data:data + len(stats)] = stats
+
+        _SEQ.pack_into(self._buf, offset, seq + 2)
+
+        if added:
+            self.__begin_change()
+            self.__index_insert(user_id, slot)
+            self.__end_change(1)
+        return True
+
+    def remove(self, user_id: int) -> bool:
+        """Removes `user_id` from this worker's partition, returning whether
+        it was stored."""
+
+        if (slot := self._own.pop(user_id, None)) is None:
+            return False
+
+        offset = self.__record_offset(slot)
+        seq, = _SEQ.unpack_from(self._buf, offset)
+        _SEQ.pack_into(self._buf, offset, seq + 1)
+        _RECORD_HEADER.pack_into(self._buf, offset, seq + 1, 0, 0, 0, 0)
+        _SEQ.pack_into(self._buf, offset, seq + 2)
+
+        heapq.heappush(self._free, slot)
+        self.__begin_change()
+        self.__index_delete(user_id)
+        self.__end_change(-1)
+        return True
+
+    def clear(self) -> int:
+        """Removes all users of this worker's partition, returning the number
+        removed."""
+
+        user_ids = list(self._own)
+        for user_id in user_ids:
+            self.remove(user_id)
+        return len(user_ids)
+
+    def owner(self, user_id: int) -> Optional[int]:
+        """Returns the worker the user is online on, if any."""
+
+        if (slot := self.__find(user_id)) is None:
+            return None
+        return slot // self.slots
+
+    def presences(self, user_ids: Optional[Iterable[int]] = None) -> dict[int, bytes]:
+        """Returns the presence packets of the users out of `user_ids` (or
+        of all users), by their ids."""
+
+        if user_ids is None:
+            self.__copy_indexes()
+            presences = {}
+            for slot in self.__occupied():
+                record = self.__read(slot)
+                if record is not None and record[1]:
+                    presences[record[0]] = record[1]
+            return presences
+
+        return self.__get_many(user_ids, 0)
+
+    def stats(self, user_ids: Iterable[int]) -> dict[int, bytes]:
+        """Returns the stats packets of the users out of `user_ids`, by their
+        ids."""
+
+        return self.__get_many(user_ids, 1)
+
+    def close(self) -> None:
+        """Detaches from the shared memory."""
+
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Frees the shared memory once every process has detached."""
+
+        self._shm.unlink()
+
+    # Private methods.
+    def __partition_offset(self, worker: int) -> int:
+        return _HEADER.size + _PARTITION.size * worker
+
+    def __record_offset(self, slot: int) -> int:
+        return _HEADER.size + _PARTITION.size * self.workers \
+            + _RECORD_SIZE * slot
+
+    def __index_offset(self, worker: int) -> int:
+        return _HEADER.size + _PARTITION.size * self.workers \
+            + _RECORD_SIZE * self.workers * self.slots \
+            + _INDEX_ENTRY.size * self._index_capacity * worker
+
+    def __begin_change(self) -> None:
+        """Makes this worker's partition generation odd, for the duration of
+        a change to its index."""
+
+        offset = self.__partition_offset(self._worker)
+        generation, count = _PARTITION.unpack_from(self._buf, offset)
+        _PARTITION.pack_into(self._buf, offset, (generation + 1) & 0xFFFFFFFF, count)
+
+    def __end_change(self, delta: int) -> None:
+        offset = self.__partition_offset(self._worker)
+        generation, count = _PARTITION.unpack_from(self._buf, offset)
+        _PARTITION.pack_into(
+            self._buf, offset,
+            (generation + 1) & 0xFFFFFFFF, count + delta,
+        )
+
+    def __index_insert(self, user_id: int, slot: int) -> None:
+        base = self.__index_offset(self._worker)
+        mask = self._index_capacity - 1
+        pos = _index_home(user_id, mask)
+        # Never full, as it has twice the entries of the partition.
+        while _INDEX_ENTRY.unpack_from(self._buf, base + pos * _INDEX_ENTRY.size)[1]:
+            pos = (pos + 1) & mask
+        _INDEX_ENTRY.pack_into(self._buf, base + pos * _INDEX_ENTRY.size, user_id, slot + 1)
+
+    def __index_delete(self, user_id: int) -> None:
+        """Removes `user_id` from this worker's index, shifting back the
+        entries after it so that no probe sequence is broken."""
+
+        base = self.__index_offset(self._worker)
+        mask = self._index_capacity - 1
+        size = _INDEX_ENTRY.size
+
+        pos = _index_home(user_id, mask)
+        while True:
+            entry_id, entry_slot = _INDEX_ENTRY.unpack_from(self._buf, base + pos * size)
+            if not entry_slot:
+                return
+            if entry_id == user_id:
+                break
+            pos = (pos + 1) & mask
+
+        nxt = pos
+        while True:
+            nxt = (nxt + 1) & mask
+            entry_id, entry_slot = _INDEX_ENTRY.unpack_from(self._buf, base + nxt * size)
+            if not entry_slot:
+                break
+
+            # Entries whose home lies cyclically within (pos, nxt] stay put.
+            home = _index_home(entry_id, mask)
+            if (pos < nxt and pos < home <= nxt) or (pos > nxt and (home > pos or home <= nxt)):
+                continue
+
+            _INDEX_ENTRY.pack_into(self._buf, base + pos * size, entry_id, entry_slot)
+            pos = nxt
+
+        _INDEX_ENTRY.pack_into(self._buf, base + pos * size, 0, 0)
+
+    def __index_lookup(self, worker: int, user_id: int) -> Optional[int]:
+        """Finds the slot of `user_id` in the index of `worker`'s partition,
+        retrying if the index changed during the lookup."""
+
+        partition = self.__partition_offset(worker)
+        base = self.__index_offset(worker)
+        mask = self._index_capacity - 1
+
+        for _ in range(_READ_RETRIES):
+            generation, _ = _PARTITION.unpack_from(self._buf, partition)
+            # Being changed.
+            if generation & 1:
+                continue
+
+            slot = None
+            pos = _index_home(user_id, mask)
+            for _ in range(self._index_capacity):
+                entry_id, entry_slot = _INDEX_ENTRY.unpack_from(
+                    self._buf, base + pos * _INDEX_ENTRY.size,
+                )
+                if not entry_slot:
+                    break
+                if entry_id == user_id:
+                    slot = entry_slot - 1
+                    break
+                pos = (pos + 1) & mask
+
+            if _PARTITION.unpack_from(self._buf, partition)[0] == generation:
+                return slot
+        return None
+
+    def __read(self, slot: int) -> Optional[tuple[int, bytes, bytes]]:
+        """Reads a consistent copy of a record, returning its user id and
+        packets if occupied."""
+
+        offset = self.__record_offset(slot)
+        for _ in range(_READ_RETRIES):
+            seq, user_id, presence_len, stats_len, occupied = \
+                _RECORD_HEADER.unpack_from(self._buf, offset)
+            # Being written.
+            if seq & 1:
+                continue
+
+            if not occupied:
+                result = None
+            else:
+                data = offset + _RECORD_HEADER.size
+                result = (
+                    user_id,
+                    bytes(self._buf[data:data + presence_len]),
+                    bytes(self._buf[data + PRESENCE_SIZE:data + PRESENCE_SIZE + stats_len]),
+                )
+
+            if _SEQ.unpack_from(self._buf, offset)[0] == seq:
+                return result
+        return None
+
+    def __occupied(self) -> Iterator[int]:
+        """Iterates over the slots of this worker's users and of the other
+        workers' users as of the index."""
+
+        yield from self._own.values()
+        for index in self._index:
+            yield from index.values()
+
+    def __copy_indexes(self) -> None:
+        """Copies the indexes of the other workers' partitions which changed
+        since they were last copied."""
+
+        size = _INDEX_ENTRY.size * self._index_capacity
+        for worker in range(self.workers):
+            if worker == self._worker:
+                continue
+
+            partition = self.__partition_offset(worker)
+            for _ in range(_READ_RETRIES):
+                generation, _ = _PARTITION.unpack_from(self._buf, partition)
+                if generation & 1:
+                    continue
+                if generation == self._generations[worker]:
+                    break
+
+                base = self.__index_offset(worker)
+                index = {
+                    user_id: slot - 1 for user_id, slot
+                    in _INDEX_ENTRY.iter_unpack(self._buf[base:base + size])
+                    if slot
+                }
+                if _PARTITION.unpack_from(self._buf, partition)[0] == generation:
+                    self._index[worker] = index
+                    self._generations[worker] = generation
+                    break
+
+    def __find(self, user_id: int) -> Optional[int]:
+        """Returns the slot holding `user_id`, if any."""
+
+        if (slot := self._own.get(user_id)) is not None:
+            return slot
+
+        for worker in range(self.workers):
+            if worker == self._worker:
+                continue
+            if (slot := self.__index_lookup(worker, user_id)) is not None:
+                return slot
+        return None
+
+    def __get_many(self, user_ids: Iterable[int], field: int) -> dict[int, bytes]:
+        packets = {}
+        for user_id in user_ids:
+            if (slot := self.__find(user_id)) is None:
+                continue
+
+            record = self.__read(slot)
+            if record is not None and record[0] == user_id and record[1 + field]:
+                packets[user_id] = record[1 + field]
+        return packets
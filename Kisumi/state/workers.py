@@ -0,0 +1,265 @@
+# Sharing of the online users between the worker processes of a single host,
+# through a shared memory presence table, with packets for users of other
+# workers sent over Unix sockets.
+#
+# Socket frames (little endian): u8 kind, u32 length, batch. The batches are
+# the same as those of the cluster channels.
+from pathlib import Path
+from typing import (
+    Iterable,
+    Optional,
+    TYPE_CHECKING,
+)
+from state.cluster import AbstractNode
+from state.shm import PresenceTable
+from logger import info, warning, error
+import multiprocessing
+import traceback
+import asyncio
+import struct
+import time
+
+if TYPE_CHECKING:
+    from user.user import User
+
+_FRAME = struct.Struct("<BI")
+_FRAME_BROADCAST = 0
+_FRAME_TARGETED = 1
+
+# The least time in seconds between warnings of an unreachable worker. Also
+# the grace period given to the other workers to start listening.
+_UNREACHABLE_WARN_INTERVAL = 30.0
+
+class WorkerNode(AbstractNode):
+    """One of `workers` processes started by `main` on a single host.
+
+    Note:
+        The presence table has to be created (`create_table`) in the parent
+            process before the workers are forked, so that they all share
+            it.
+        Batches for a worker which is not (yet) listening are dropped.
+    """
+
+    __slots__ = (
+        "workers",
+        "slots",
+        "socket_dir",
+        "_table",
+        "_claim_lock",
+        "_worker",
+        "_server",
+        "_peers",
+        "_peer_locks",
+        "_receivers",
+        "_dropped",
+        "_warned_at",
+    )
+
+    def __init__(self, workers: int, slots: int, socket_dir: Path,
+                 flush_interval: float = 0.005) -> None:
+        super().__init__("worker", flush_interval)
+
+        self.workers = workers
+        self.slots = slots
+        self.socket_dir = socket_dir
+
+        self._table: Optional[PresenceTable] = None
+        # Shared by the workers, making claims atomic across them.
+        self._claim_lock = None
+        self._worker: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Connections to the other workers, by worker index.
+        self._peers: dict[int, asyncio.StreamWriter] = {}
+        # Held while connecting and writing, so batches are sent in order
+        # over a single connection.
+        self._peer_locks: dict[int, asyncio.Lock] = {}
+        # The tasks reading the connections from the other workers.
+        self._receivers: set[asyncio.Task] = set()
+        # Batches dropped for each unreachable worker since the last warning
+        # about it, alongside when that was.
+        self._dropped: dict[int, int] = {}
+        self._warned_at: dict[int, float] = {}
+
+    @property
+    def table(self) -> Optional[PresenceTable]:
+        """The presence table shared by the workers, once created."""
+
+        return self._table
+
+    # Public methods.
+    def create_table(self) -> PresenceTable:
+        """Creates the presence table shared by the workers."""
+
+        assert self._table is None, "The presence table was already created!"
+
+        self._table = PresenceTable.create(self.workers, self.slots)
+        self._claim_lock = multiprocessing.get_context("fork").Lock()
+        return self._table
+
+    def assign_worker(self, index: int) -> None:
+        assert self._table is not None, "The presence table has to be created first!"
+
+        self._worker = index
+        self.node_id = self.__node_id(index)
+        self._table.set_worker(index)
+
+    async def start(self) -> None:
+        """Starts accepting packets from the other workers."""
+
+        assert self._worker is not None, "The worker index was not assigned!"
+
+        self.socket_dir.mkdir(parents= True, exist_ok= True)
+        path = self.__socket_path(self._worker)
+        # Left behind by a previous run.
+        path.unlink(missing_ok= True)
+
+        self._server = await asyncio.start_unix_server(self.__on_peer, path= path)
+        # The other workers are given time to start before being warned of.
+        started = time.monotonic()
+        self._warned_at = dict.fromkeys(range(self.workers), started)
+        self._start_flusher()
+        info("Started as worker %d of %d.", self._worker + 1, self.workers)
+
+    async def stop(self) -> None:
+        """Stops exchanging packets, sending anything still buffered and
+        taking this worker's users offline for the other workers."""
+
+        if self._server is None:
+            return
+
+        await self._stop_flusher()
+        self._server.close()
+        for task in self._receivers:
+            task.cancel()
+        await asyncio.gather(*self._receivers, return_exceptions= True)
+        await self._server.wait_closed()
+        self._server = None
+
+        for writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+
+        self._table.clear()
+        self.__socket_path(self._worker).unlink(missing_ok= True)
+
+    async def claim(self, user_id: int) -> bool:
+        # Only held for a probe of each partition's index and a write, so
+        # blocking the loop (of every worker) is fine.
+        with self._claim_lock:
+            worker = self._table.owner(user_id)
+            if worker is not None and worker != self._worker:
+                return False
+
+            # Listed without packets until registered. A full table is
+            # reported by `register`.
+            if worker is None:
+                self._table.put(user_id, b"", b"")
+            return True
+
+    async def register(self, user: "User", presence: bytes, stats: bytes) -> None:
+        if not self._table.put(user.id, presence, stats):
+            warning("The presence table of worker %d is full! %s is not "
+                    "visible to the other workers.", self._worker, user.name)
+
+    async def update(self, user: "User", presence: bytes, stats: bytes) -> None:
+        # Not re-added if they went offline in the meantime.
+        if self._table.owner(user.id) == self._worker:
+            self._table.put(user.id, presence, stats)
+
+    async def unregister(self, users: list["User"]) -> None:
+        for user in users:
+            self._table.remove(user.id)
+
+    async def owner(self, user_id: int) -> Optional[str]:
+        if (worker := self._table.owner(user_id)) is None:
+            return None
+        return self.__node_id(worker)
+
+    async def online_count(self) -> int:
+        return len(self._table)
+
+    async def presences(self, user_ids: Optional[Iterable[int]] = None) -> dict[int, bytes]:
+        return self._table.presences(user_ids)
+
+    async def stats(self, user_ids: Iterable[int]) -> dict[int, bytes]:
+        return self._table.stats(user_ids)
+
+    # Protected methods.
+    async def _send_broadcast(self, batch: bytes) -> None:
+        await asyncio.gather(*(
+            self.__send(worker, _FRAME_BROADCAST, batch)
+            for worker in range(self.workers)
+            if worker != self._worker
+        ))
+
+    async def _send_targeted(self, node_id: str, batch: bytes) -> None:
+        await self.__send(int(node_id.rsplit("/", 1)[1]), _FRAME_TARGETED, batch)
+
+    # Private methods.
+    def __node_id(self, worker: int) -> str:
+        return f"worker/{worker}"
+
+    def __socket_path(self, worker: int) -> Path:
+        return self.socket_dir / f"{worker}.sock"
+
+    async def __send(self, worker: int, kind: int, batch: bytes) -> None:
+        if (lock := self._peer_locks.get(worker)) is None:
+            lock = self._peer_locks[worker] = asyncio.Lock()
+
+        try:
+            async with lock:
+                if (writer := self._peers.get(worker)) is None or writer.is_closing():
+                    _, writer = await asyncio.open_unix_connection(
+                        self.__socket_path(worker),
+                    )
+                    self._peers[worker] = writer
+
+                writer.write(_FRAME.pack(kind, len(batch)))
+                writer.write(batch)
+                await writer.drain()
+        except OSError:
+            if (writer := self._peers.pop(worker, None)) is not None:
+                writer.close()
+            self.__on_unreachable(worker)
+
+    def __on_unreachable(self, worker: int) -> None:
+        """Counts a batch dropped for `worker`, warning at most once every
+        `_UNREACHABLE_WARN_INTERVAL` seconds."""
+
+        dropped = self._dropped[worker] = self._dropped.get(worker, 0) + 1
+        now = time.monotonic()
+        if now - self._warned_at.get(worker, 0.0) < _UNREACHABLE_WARN_INTERVAL:
+            return
+
+        warning("Dropped %d batches for worker %d, as it is unreachable.",
+                dropped, worker)
+        self._dropped[worker] = 0
+        self._warned_at[worker] = now
+
+    async def __on_peer(self, reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._receivers.add(task)
+        try:
+            while True:
+                kind, length = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+                batch = await reader.readexactly(length)
+
+                try:
+                    if kind == _FRAME_BROADCAST:
+                        await self._deliver_broadcast(batch)
+                    else:
+                        await self._deliver_targeted(batch)
+                except Exception:
+                    error("Failed handling a batch from another worker!\n%s",
+                          traceback.format_exc())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # The other worker went away.
+            pass
+        except asyncio.CancelledError:
+            # Stopped, returned rather than raised as the task belongs to
+            # the stream.
+            pass
+        finally:
+            self._receivers.discard(task)
+            writer.close()
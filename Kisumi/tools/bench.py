@@ -0,0 +1,569 @@
+# In-process benchmarks of the bancho request path and the packet codec.
+#
+# Usage (from the Kisumi directory):
+#   python -m tools.bench [--filter SUBSTR] [--json PATH] [--compare BASE.json]
+from dataclasses import dataclass, asdict
+from functools import partial
+from pathlib import Path
+from typing import (
+    Awaitable,
+    Callable,
+    Optional,
+)
+import statistics
+import subprocess
+import argparse
+import platform
+import asyncio
+import random
+import json
+import time
+import sys
+
+from packets import builders
+from packets.writer import BinaryWriter
+from packets.reader import BinaryReader
+from packets.constants import PacketID
+from utils.cache import LRUCache
+from utils.hash import BCryptPassword
+from user.user import User
+from user.client.client import StableClient
+from user.client.components.hwid import StableHWID
+from user._testing import _create_user
+from models.request.login import LoginRequestModel
+from resources.db.geo.iploc import IPLocation
+from repositories.user import OnlineUsersRepo
+from handlers.bancho.login import login_handle
+from state import repos
+from .loadgen import build_login_body, poll_body
+
+# A benchmark runs its operation `loops` times, returning the seconds taken.
+# Any setup it does outside of the timed section is not measured.
+Benchmark = Callable[[int], Awaitable[float]]
+
+_BENCHMARKS: dict[str, Benchmark] = {}
+
+BROADCAST_SIZES = (1_000, 10_000, 50_000)
+_BENCH_IP = "127.0.0.1"
+_BENCH_PASSWORD_MD5 = "5f4dcc3b5aa765d61d8327deb882cf99"
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    """Registers a benchmark under `name`."""
+
+    def wrapper(func: Benchmark) -> Benchmark:
+        assert name not in _BENCHMARKS, f"Benchmark {name} already registered!"
+        _BENCHMARKS[name] = func
+        return func
+
+    return wrapper
+
+@dataclass
+class BenchResult:
+    """The timings of a single benchmark."""
+
+    ns_per_op: float
+    min_ns: float
+    stdev_ns: float
+    loops: int
+    rounds: int
+
+# Fixtures.
+class _PlainPassword(BCryptPassword):
+    """A password compared directly against the MD5, taking bcrypt out of
+    the measurements."""
+
+    __slots__ = (
+        "_md5",
+    )
+
+    def __init__(self, md5: str) -> None:
+        super().__init__(b"")
+        self._md5 = md5
+
+    async def compare_async(self, plaintext: str) -> bool:
+        return plaintext == self._md5
+
+_user_count = 0
+
+def _new_user() -> User:
+    """Creates a new user with a unique name and a stubbed password."""
+
+    global _user_count
+    _user_count += 1
+    return _create_user(
+        1_000_000 + _user_count,
+        f"Bench {_user_count}",
+        f"bench{_user_count}@kisumi.local",
+        _PlainPassword(_BENCH_PASSWORD_MD5),
+    )
+
+def _login_body(user: User) -> bytes:
+    return build_login_body(user.name, _BENCH_PASSWORD_MD5)
+
+async def _new_client(user: User) -> StableClient:
+    """Creates a stable client for `user`, registering it with the user
+    without putting the user online (which broadcasts to everyone)."""
+
+    client = await StableClient.from_login(
+        user= user,
+        hwid= StableHWID("", "", "", "", ""),
+        location= IPLocation.default(),
+        request= LoginRequestModel.from_req_body(_login_body(user).decode()),
+    )
+    user.clients._clients[client.id] = client
+    return client
+
+async def _cached_users(count: int) -> list[User]:
+    """Creates `count` new users, caching them in the user manager so they
+    can log in."""
+
+    users = [_new_user() for _ in range(count)]
+    for user in users:
+        await repos.user_manager.cache(user)
+    return users
+
+async def _log_out(users: list[User]) -> None:
+    """Logs the `users` out as the reaper would (releasing their cluster
+    claims), dropping them from the user manager."""
+
+    for user in users:
+        for client in list(user.clients):
+            await user.clients.detach(client)
+
+    await repos.online.remove_users(users)
+    await repos.user_manager.invalidate([user.id for user in users])
+    # Their announcements are still queued, so they are skipped now rather
+    # than during the next measurement.
+    await repos.online.on_online.join()
+
+async def _reset_online() -> None:
+    """Logs everyone out, so logins are measured against a fixed state."""
+
+    await _log_out(await repos.online.users())
+
+async def _prepare_state() -> None:
+    """Prepares the global state the request path relies on."""
+
+    await repos.resources.load()
+    await repos.locale.kisumi_load()
+    # Requests are geolocated, so serve the address from the cache.
+    repos.geoloc._cache.insert(_BENCH_IP, IPLocation.default())
+
+# In-process ASGI.
+_REQUEST_HEADERS = [
+    (b"host", b"c.ppy.sh"),
+    (b"user-agent", b"osu!"),
+    (b"x-real-ip", _BENCH_IP.encode()),
+]
+
+def _http_scope(headers: list[tuple[bytes, bytes]]) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": (_BENCH_IP, 50000),
+        "server": ("127.0.0.1", 5344),
+    }
+
+def _receiver(body: bytes):
+    sent = False
+    async def receive() -> dict:
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return receive
+
+async def asgi_post(app, body: bytes, token: Optional[str] = None) -> tuple[
+    int, dict[bytes, bytes], bytes
+]:
+    """Sends a bancho POST request directly to the ASGI `app`, returning the
+    status, headers and body of the response."""
+
+    headers = _REQUEST_HEADERS
+    if token is not None:
+        headers = headers + [(b"osu-token", token.encode())]
+
+    res = {"status": 0, "headers": {}, "body": bytearray()}
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            res["status"] = message["status"]
+            res["headers"] = dict(message.get("headers", ()))
+        elif message["type"] == "http.response.body":
+            res["body"] += message.get("body", b"")
+
+    await app(_http_scope(headers), _receiver(body), send)
+    return res["status"], res["headers"], bytes(res["body"])
+
+_app = None
+
+def _get_app():
+    global _app
+    if _app is None:
+        from main import create_app
+        _app = create_app()
+    return _app
+
+# Packet codec.
+def _write_stats_like(writer: BinaryWriter) -> bytearray:
+    return (
+        writer.write_i32(1000)
+            .write_u8(2)
+            .write_str("[Vanilla] Some Artist - Some Song [Insane]")
+            .write_str("d41d8cd98f00b204e9800998ecf8427e")
+            .write_i32(0)
+            .write_u8(0)
+            .write_i32(123456)
+            .write_i64(654888)
+            .write_f32(0.98)
+            .write_i32(1234)
+            .write_i64(453345)
+            .write_i32(1)
+            .write_i16(3727)
+            .finish(PacketID.SRV_USER_STATS)
+    )
+
+@benchmark("writer_stats_packet")
+async def bench_writer(loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        _write_stats_like(BinaryWriter())
+    return time.perf_counter() - start
+
+@benchmark("reader_stats_packet")
+async def bench_reader(loops: int) -> float:
+    data = bytes(_write_stats_like(BinaryWriter()))
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        reader = BinaryReader(data)
+        reader.read_osu_header()
+        reader.read_i32(); reader.read_u8(); reader.read_str(); reader.read_str()
+        reader.read_i32(); reader.read_u8(); reader.read_i32(); reader.read_i64()
+        reader.read_f32(); reader.read_i32(); reader.read_i64(); reader.read_i32()
+        reader.read_i16()
+    return time.perf_counter() - start
+
+@benchmark("reader_packet_split")
+async def bench_packet_split(loops: int) -> float:
+    body = poll_body(random.Random(0), 100) * 8
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        reader = BinaryReader(body)
+        while not reader.empty:
+            _, length = reader.read_osu_header()
+            reader.read_bytes(length)
+    return time.perf_counter() - start
+
+async def _builder_args() -> dict[str, tuple]:
+    """The arguments each builder is benchmarked with."""
+
+    user = _new_user()
+    client = await _new_client(user)
+
+    return {
+        "heartbeat": (),
+        "notification": ("Welcome to Kisumi!",),
+        "send_message": ("Kisumi", "Hello world!", "#osu", 999),
+        "login_reply": (1000,),
+        "channel_info_end": (),
+        "presence": (user,),
+        "presence_client": (client,),
+        "stats": (user,),
+        "stats_client": (client,),
+        "protocol_ver": (19,),
+        "restart": (0,),
+        "user_logout": (1000,),
+    }
+
+def _builders() -> dict[str, Callable]:
+    """Returns every packet builder, bypassing result caching."""
+
+    return {
+        name: getattr(func, "__wrapped__", func)
+        for name, func in vars(builders).items()
+        if callable(func) and not name.startswith("_")
+        and getattr(func, "__module__", None) == builders.__name__
+    }
+
+async def _bench_builder(name: str, loops: int) -> float:
+    func = _builders()[name]
+    args = (await _builder_args())[name]
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        func(*args)
+    return time.perf_counter() - start
+
+def _register_builders() -> None:
+    for name in _builders():
+        _BENCHMARKS[f"builder_{name}"] = partial(_bench_builder, name)
+
+# Caches.
+@benchmark("lru_fetch_hit")
+async def bench_lru_hit(loops: int) -> float:
+    cache = LRUCache(1024)
+    cache.insert_many({idx: idx for idx in range(1024)})
+
+    start = time.perf_counter()
+    for idx in range(loops):
+        cache.fetch(idx & 1023)
+    return time.perf_counter() - start
+
+@benchmark("lru_fetch_miss")
+async def bench_lru_miss(loops: int) -> float:
+    cache = LRUCache(1024)
+
+    start = time.perf_counter()
+    for idx in range(loops):
+        cache.fetch(idx)
+    return time.perf_counter() - start
+
+@benchmark("lru_insert_evict")
+async def bench_lru_insert(loops: int) -> float:
+    cache = LRUCache(1024)
+
+    start = time.perf_counter()
+    for idx in range(loops):
+        cache.insert(idx, idx)
+    return time.perf_counter() - start
+
+# Broadcasting.
+_populations: dict[int, tuple[OnlineUsersRepo, list[StableClient]]] = {}
+
+async def _population(size: int) -> tuple[OnlineUsersRepo, list[StableClient]]:
+    """Creates (once) an online repo of `size` users with stable clients."""
+
+    if size not in _populations:
+        repo = OnlineUsersRepo()
+        clients = []
+        for _ in range(size):
+            user = _new_user()
+            clients.append(await _new_client(user))
+            await repo._repo.insert(user)
+        _populations[size] = repo, clients
+
+    return _populations[size]
+
+async def _bench_broadcast(size: int, loops: int) -> float:
+    repo, clients = await _population(size)
+    packet = builders.notification("Server restarting in 5 minutes!")
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        await repo.broadcast(packet)
+    elapsed = time.perf_counter() - start
+
+    for client in clients:
+        await client.queue.clear()
+    return elapsed
+
+for _size in BROADCAST_SIZES:
+    _BENCHMARKS[f"broadcast_{_size}"] = partial(_bench_broadcast, _size)
+
+# The request path.
+@benchmark("login_handle")
+async def bench_login_handle(loops: int) -> float:
+    await _reset_online()
+    users = await _cached_users(loops)
+    bodies = [_login_body(user) for user in users]
+
+    start = time.perf_counter()
+    for body in bodies:
+        _, token = await login_handle(body, _BENCH_IP)
+        assert token is not None, "Benchmark login failed!"
+    elapsed = time.perf_counter() - start
+
+    await _log_out(users)
+    return elapsed
+
+@benchmark("asgi_login")
+async def bench_asgi_login(loops: int) -> float:
+    app = _get_app()
+    await _reset_online()
+    users = await _cached_users(loops)
+    bodies = [_login_body(user) for user in users]
+
+    start = time.perf_counter()
+    for body in bodies:
+        await asgi_post(app, body)
+    elapsed = time.perf_counter() - start
+
+    await _log_out(users)
+    return elapsed
+
+async def _logged_in_token(app) -> tuple[User, str]:
+    """Logs a new user in through `app`, returning them alongside their
+    token."""
+
+    await _reset_online()
+    user, = await _cached_users(1)
+    _, headers, _ = await asgi_post(app, _login_body(user))
+    token = headers[b"cho-token"].decode()
+    assert token != "no", "Benchmark login failed!"
+    return user, token
+
+@benchmark("asgi_poll_idle")
+async def bench_asgi_poll_idle(loops: int) -> float:
+    app = _get_app()
+    user, token = await _logged_in_token(app)
+    body = bytes(builders.heartbeat())
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        await asgi_post(app, body, token)
+    elapsed = time.perf_counter() - start
+
+    await _log_out([user])
+    return elapsed
+
+@benchmark("asgi_poll_packets")
+async def bench_asgi_poll_packets(loops: int) -> float:
+    app = _get_app()
+    user, token = await _logged_in_token(app)
+    rng = random.Random(0)
+    bodies = [poll_body(rng, 100) for _ in range(64)]
+
+    start = time.perf_counter()
+    for idx in range(loops):
+        await asgi_post(app, bodies[idx & 63], token)
+    elapsed = time.perf_counter() - start
+
+    await _log_out([user])
+    return elapsed
+
+# The runner.
+async def measure(bench: Benchmark, min_time: float = 0.1,
+                  rounds: int = 5) -> BenchResult:
+    """Calibrates the number of loops so a round takes at least `min_time`
+    seconds, then times `rounds` rounds."""
+
+    loops = 1
+    while (elapsed := await bench(loops)) < min_time and loops < 1 << 24:
+        loops *= 2 if elapsed <= 0 else max(2, min(int(min_time / elapsed) + 1, 16))
+
+    timings = [elapsed / loops * 1e+9]
+    for _ in range(rounds - 1):
+        timings.append(await bench(loops) / loops * 1e+9)
+
+    return BenchResult(
+        ns_per_op= statistics.median(timings),
+        min_ns= min(timings),
+        stdev_ns= statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        loops= loops,
+        rounds= rounds,
+    )
+
+def _metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ("git", "rev-parse", "HEAD"),
+            capture_output= True,
+            text= True,
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.time(),
+    }
+
+async def run(names: list[str], min_time: float, rounds: int) -> dict[str, BenchResult]:
+    """Runs the benchmarks `names`, printing the results as they complete."""
+
+    await _prepare_state()
+
+    results = {}
+    for name in names:
+        res = results[name] = await measure(_BENCHMARKS[name], min_time, rounds)
+        print(f"{name:<32} {_format_ns(res.ns_per_op):>12} "
+              f"(min {_format_ns(res.min_ns)}, {res.loops} loops)")
+
+    return results
+
+def compare(base: dict, results: dict[str, BenchResult], threshold: float) -> int:
+    """Prints the change of each benchmark against the `base` report,
+    returning the number of regressions beyond `threshold` (a ratio)."""
+
+    regressions = 0
+    print(f"\n{'benchmark':<32} {'base':>12} {'new':>12} {'change':>8}")
+    for name, res in results.items():
+        if (old := base["results"].get(name)) is None:
+            continue
+
+        change = res.ns_per_op / old["ns_per_op"] - 1
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSED"
+        print(f"{name:<32} {_format_ns(old['ns_per_op']):>12} "
+              f"{_format_ns(res.ns_per_op):>12} {change:>+8.1%}{flag}")
+
+    return regressions
+
+def _format_ns(ns: float) -> str:
+    for unit, scale in (("s", 1e+9), ("ms", 1e+6), ("μs", 1e+3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f}{unit}"
+    return f"{ns:.0f}ns"
+
+def main(argv: list[str]) -> int:
+    """Runs the benchmark suite."""
+
+    parser = argparse.ArgumentParser(
+        description= "Benchmarks the Kisumi request path and packet codec.",
+    )
+    parser.add_argument("--filter", default= "",
+                        help= "Only run benchmarks containing this string.")
+    parser.add_argument("--min-time", type= float, default= 0.1,
+                        help= "The minimum duration of a single round in seconds.")
+    parser.add_argument("--rounds", type= int, default= 5)
+    parser.add_argument("--json", type= Path, default= None,
+                        help= "Write the results to this path.")
+    parser.add_argument("--compare", type= Path, default= None,
+                        help= "A previous results file to compare against.")
+    parser.add_argument("--threshold", type= float, default= 0.1,
+                        help= "The slowdown ratio reported as a regression.")
+    parser.add_argument("--list", action= "store_true")
+    args = parser.parse_args(argv)
+
+    _register_builders()
+    names = [name for name in _BENCHMARKS if args.filter in name]
+
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    results = asyncio.run(run(names, args.min_time, args.rounds))
+
+    if args.json is not None:
+        args.json.write_text(json.dumps({
+            "meta": _metadata(),
+            "results": {name: asdict(res) for name, res in results.items()},
+        }, indent= 4))
+
+    if args.compare is not None:
+        base = json.loads(args.compare.read_text())
+        if compare(base, results, args.threshold):
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(
+        main(sys.argv[1:])
+    )
@@ -0,0 +1,170 @@
+# Checks two cluster nodes sharing an in-process Redis: claiming users,
+# registering them and delivering broadcasts and targeted packets between
+# the nodes, including after a node lost its pub/sub connection.
+#
+# Usage (from the Kisumi directory):
+#   python -m tools.cluster_check
+from typing import (
+    Awaitable,
+    Callable,
+)
+import asyncio
+
+from user.client.components.queue import ByteLike
+from user._testing import _create_user
+from utils.hash import BCryptPassword
+from state.cluster import ClusterNode
+from state._local_redis import (
+    LocalRedis,
+    LocalRedisServer,
+)
+
+Check = Callable[["_RecordingNode", "_RecordingNode"], Awaitable[None]]
+
+_CHECKS: dict[str, Check] = {}
+
+# Seconds waited for a message to arrive at the other node.
+_DELIVERY_TIMEOUT = 1.0
+
+def check(func: Check) -> Check:
+    """Registers a check, ran against a fresh pair of nodes."""
+
+    _CHECKS[func.__name__] = func
+    return func
+
+class _RecordingNode(ClusterNode):
+    """A cluster node recording what it receives rather than delivering it
+    to the online users."""
+
+    __slots__ = (
+        "broadcasts",
+        "targeted",
+        "_received",
+    )
+
+    def __init__(self, node_id: str) -> None:
+        super().__init__(node_id, flush_interval= 0.001)
+
+        self.broadcasts: list[bytes] = []
+        self.targeted: list[bytes] = []
+        self._received = asyncio.Event()
+
+    async def wait_received(self) -> None:
+        """Waits for the next batch received from another node."""
+
+        await asyncio.wait_for(self._received.wait(), _DELIVERY_TIMEOUT)
+        self._received.clear()
+
+    async def _deliver_broadcast(self, batch: ByteLike) -> None:
+        self.broadcasts.append(bytes(batch))
+        self._received.set()
+
+    async def _deliver_targeted(self, batch: ByteLike) -> None:
+        self.targeted.append(bytes(batch))
+        self._received.set()
+
+def _user(user_id: int):
+    return _create_user(
+        user_id,
+        f"Cluster {user_id}",
+        f"cluster{user_id}@kisumi.local",
+        BCryptPassword(b""),
+    )
+
+# Checks.
+@check
+async def claims(a: _RecordingNode, b: _RecordingNode) -> None:
+    assert await a.claim(1), "The first claim of a user failed!"
+    assert not await b.claim(1), "A user was claimed by two nodes!"
+    assert await a.claim(1), "A node could not reclaim its own user!"
+    assert await b.owner(1) == a.node_id
+
+    await a.unregister([_user(1)])
+    assert await b.claim(1), "An unregistered user could not be claimed!"
+
+@check
+async def registration(a: _RecordingNode, b: _RecordingNode) -> None:
+    user = _user(2)
+    await a.register(user, b"presence", b"stats")
+    assert await b.online_count() == 1
+    assert await b.presences() == {user.id: b"presence"}
+    assert await b.stats([user.id]) == {user.id: b"stats"}
+
+    await a.update(user, b"presence 2", b"stats 2")
+    assert await b.presences() == {user.id: b"presence 2"}
+    assert await b.stats([user.id]) == {user.id: b"stats 2"}
+
+    await a.unregister([user])
+    assert await b.online_count() == 0
+    assert await b.owner(user.id) is None
+
+@check
+async def broadcasts(a: _RecordingNode, b: _RecordingNode) -> None:
+    a.broadcast(b"\x01\x02")
+    a.broadcast(b"\x03")
+    await a.flush()
+    await b.wait_received()
+
+    assert b.broadcasts == [b"\x01\x02\x03"]
+    # Broadcasts are delivered locally by the sender itself.
+    assert not a.broadcasts, "A node received its own broadcast!"
+
+@check
+async def targeted(a: _RecordingNode, b: _RecordingNode) -> None:
+    a.enqueue(b.node_id, 3, b"XY")
+    a.enqueue(b.node_id, 4, b"Z")
+    await a.flush()
+    await b.wait_received()
+
+    assert b.targeted == [
+        b"\x03\x00\x00\x00\x02\x00\x00\x00XY"
+        b"\x04\x00\x00\x00\x01\x00\x00\x00Z"
+    ]
+    assert not a.targeted, "Packets were delivered to the wrong node!"
+
+@check
+async def resubscribe(a: _RecordingNode, b: _RecordingNode) -> None:
+    # Drops the pub/sub connection of `b`, closing its channels.
+    b._redis.close()
+    await asyncio.sleep(0.01)
+
+    a.broadcast(b"\x05")
+    a.enqueue(b.node_id, 5, b"W")
+    await a.flush()
+    await b.wait_received()
+    if len(b.broadcasts) + len(b.targeted) < 2:
+        await b.wait_received()
+
+    assert b.broadcasts == [b"\x05"]
+    assert b.targeted == [b"\x05\x00\x00\x00\x01\x00\x00\x00W"]
+
+# The runner.
+async def run_check(func: Check) -> None:
+    server = LocalRedisServer()
+    a, b = _RecordingNode("a"), _RecordingNode("b")
+    await a.start(LocalRedis(server))
+    await b.start(LocalRedis(server))
+
+    try:
+        await func(a, b)
+    finally:
+        await b.stop()
+        await a.stop()
+
+async def run() -> int:
+    failed = 0
+    for name, func in _CHECKS.items():
+        try:
+            await run_check(func)
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {name}: {e!r}")
+        else:
+            print(f"ok   {name}")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(
+        asyncio.run(run())
+    )
@@ -0,0 +1,134 @@
+# A minimal keep-alive HTTP/1.1 client over asyncio streams, keeping the
+# overhead of the benchmarking tools themselves as low as possible.
+from dataclasses import dataclass
+from typing import Optional
+import asyncio
+
+@dataclass
+class HTTPResponse:
+    """A fully read HTTP response."""
+
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+class HTTPConnection:
+    """A single persistent connection to an HTTP server, sending one request
+    at a time. Reconnects transparently if the server closed the connection
+    before a request was sent."""
+
+    __slots__ = (
+        "host",
+        "port",
+        "_reader",
+        "_writer",
+    )
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, headers: dict[str, str],
+                      body: bytes = b"") -> HTTPResponse:
+        """Sends a request, returning the response.
+
+        Note:
+            Raises `ConnectionError` (or `OSError`) on connection failures.
+            Raises `asyncio.IncompleteReadError` if the connection was closed
+                while reading the response.
+            Requests are only resent if writing them to a kept alive
+                connection failed.
+        """
+
+        head = [f"{method} {path} HTTP/1.1", f"Content-Length: {len(body)}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        data = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+        reused = self._writer is not None
+        if not reused:
+            await self.__connect()
+
+        try:
+            await self.__send(data)
+        except ConnectionError:
+            # A kept alive connection may have been closed by the server
+            # since, in which case the request never reached it. Anything
+            # else may have been handled, so is not sent again.
+            if not reused:
+                raise
+            await self.__connect()
+            await self.__send(data)
+
+        try:
+            return await self.__read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        """Closes the connection if open."""
+
+        if self._writer is None:
+            return
+
+        writer, self._writer, self._reader = self._writer, None, None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    # Private methods.
+    async def __connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host,
+            self.port,
+        )
+
+    async def __send(self, data: bytes) -> None:
+        """Writes `data` to the connection, closing it on failure."""
+
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+        except ConnectionError:
+            await self.close()
+            raise
+
+    async def __read_response(self) -> HTTPResponse:
+        status_line = await self._reader.readuntil(b"\r\n")
+        if not status_line.strip():
+            raise ConnectionError("The server closed the connection.")
+        status = int(status_line.split(b" ", 2)[1])
+
+        headers = {}
+        while (line := await self._reader.readuntil(b"\r\n")) != b"\r\n":
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self.__read_chunked()
+        else:
+            body = await self._reader.readexactly(
+                int(headers.get("content-length", 0))
+            )
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+
+        return HTTPResponse(status, headers, body)
+
+    async def __read_chunked(self) -> bytes:
+        body = bytearray()
+        while True:
+            size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if not size:
+                # The trailing headers (if any) end with an empty line.
+                while await self._reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return bytes(body)
+
+            body += await self._reader.readexactly(size)
+            await self._reader.readexactly(2)
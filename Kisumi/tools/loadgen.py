@@ -0,0 +1,402 @@
+# Simulates many osu!stable clients against a running Kisumi instance,
+# reporting throughput, latency percentiles and error rates.
+#
+# Seed the server with users first (eg `SYNTHETIC_USERS=5000`), then run
+# (from the Kisumi directory):
+#   python -m tools.loadgen --clients 1000 --duration 60 [--json PATH]
+from dataclasses import dataclass, field, asdict
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+from packets.writer import BinaryWriter
+from packets.reader import BinaryReader
+from packets.constants import PacketID
+from .http import HTTPConnection, HTTPResponse
+import argparse
+import asyncio
+import hashlib
+import random
+import struct
+import json
+import time
+import sys
+
+# Match the synthetic population seeded by `user._testing`.
+DEFAULT_NAME_FORMAT = "Synthetic {}"
+DEFAULT_PASSWORD = "synthetic"
+DEFAULT_ID_OFFSET = 100_000
+
+_OSU_VERSION = "b20220101"
+
+@dataclass
+class LoadConfig:
+    """The parameters of a single load test."""
+
+    host: str = "127.0.0.1"
+    port: int = 5344
+    # The bancho routes are only served to the bancho domains.
+    host_header: str = "c.ppy.sh"
+    clients: int = 100
+    duration: float = 30.0
+    # Seconds between the polls of each client (osu! polls roughly once a second).
+    poll_interval: float = 1.0
+    # The number of logins performed at once while ramping up.
+    login_concurrency: int = 50
+    name_format: str = DEFAULT_NAME_FORMAT
+    password: str = DEFAULT_PASSWORD
+    # The index of the first synthetic user used, allowing for runs to not
+    # collide with users still logged in from a previous run.
+    offset: int = 0
+    seed: int = 0
+
+@dataclass
+class RequestStats:
+    """Latencies and errors of a single kind of request."""
+
+    latencies: list[float] = field(default_factory= list)
+    errors: Counter = field(default_factory= Counter)
+
+    @property
+    def count(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    def percentile(self, pct: float) -> float:
+        """Returns the `pct` percentile latency in seconds."""
+
+        if not self.latencies:
+            return 0.0
+
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+    def summary(self, elapsed: float) -> dict:
+        return {
+            "requests": self.count,
+            "throughput": self.count / elapsed if elapsed else 0.0,
+            "error_rate": sum(self.errors.values()) / self.count if self.count else 0.0,
+            "errors": dict(self.errors),
+            "p50_ms": self.percentile(50) * 1e+3,
+            "p90_ms": self.percentile(90) * 1e+3,
+            "p99_ms": self.percentile(99) * 1e+3,
+            "max_ms": max(self.latencies, default= 0.0) * 1e+3,
+        }
+
+@dataclass
+class LoadReport:
+    """The results of a load test."""
+
+    config: LoadConfig
+    elapsed: float = 0.0
+    logged_in: int = 0
+    login: RequestStats = field(default_factory= RequestStats)
+    poll: RequestStats = field(default_factory= RequestStats)
+    # Packets received from the server, by name.
+    packets: Counter = field(default_factory= Counter)
+
+    def into_dict(self) -> dict:
+        return {
+            "config": asdict(self.config),
+            "elapsed": self.elapsed,
+            "logged_in": self.logged_in,
+            "login": self.login.summary(self.elapsed),
+            "poll": self.poll.summary(self.elapsed),
+            "packets": dict(self.packets.most_common()),
+        }
+
+    def print(self) -> None:
+        print(f"{self.logged_in}/{self.config.clients} clients logged in, "
+              f"ran for {self.elapsed:.1f}s.\n")
+        print(f"{'':>6} {'requests':>9} {'req/s':>9} {'errors':>7} "
+              f"{'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+        for name, stats in (("login", self.login), ("poll", self.poll)):
+            s = stats.summary(self.elapsed)
+            print(f"{name:>6} {s['requests']:>9} {s['throughput']:>9.1f} "
+                  f"{s['error_rate']:>6.1%} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} "
+                  f"{s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+
+        errors = self.login.errors + self.poll.errors
+        if errors:
+            print("\nErrors: " + ", ".join(f"{k} ({v})" for k, v in errors.most_common()))
+
+def build_login_body(username: str, password_md5: str, utc_offset: int = 0,
+                     hwid_seed: str = "") -> bytes:
+    """Builds a login request body as sent by osu!stable (and parsed by
+    `LoginRequestModel.from_req_body`)."""
+
+    hashes = ":".join(
+        _md5(f"{hwid_seed}{part}") for part in ("path", "adapters", "adapters_md5",
+                                                "uninstall", "serial")
+    ) + ":"
+    return (
+        f"{username}\n{password_md5}\n"
+        f"{_OSU_VERSION}|{utc_offset}|0|{hashes}|1\n"
+    ).encode()
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()
+
+# Client packet builders.
+def heartbeat() -> bytearray:
+    return BinaryWriter().finish(PacketID.OSU_HEARTBEAT)
+
+def change_action(rng: random.Random) -> bytearray:
+    return (
+        BinaryWriter()
+            .write_u8(rng.choice((0, 1, 2, 4, 5)))
+            .write_str(rng.choice(("", "Some Artist - Some Song [Insane]")))
+            .write_str(_md5(str(rng.random())))
+            .write_u32(0)
+            .write_u8(rng.randrange(4))
+            .write_i32(rng.randrange(1, 4_000_000))
+            .finish(PacketID.OSU_CHANGE_ACTION)
+    )
+
+def public_message(rng: random.Random) -> bytearray:
+    return (
+        BinaryWriter()
+            .write_str("")
+            .write_str(rng.choice(("hello", "gg", "anyone up for multi?")))
+            .write_str("#osu")
+            .write_i32(0)
+            .finish(PacketID.OSU_SEND_PUBLIC_MESSAGE)
+    )
+
+def stats_request(user_ids: list[int]) -> bytearray:
+    return (
+        BinaryWriter()
+            .write_osu_list(user_ids)
+            .finish(PacketID.OSU_USER_STATS_REQUEST)
+    )
+
+def presence_request(user_ids: list[int]) -> bytearray:
+    return (
+        BinaryWriter()
+            .write_osu_list(user_ids)
+            .finish(PacketID.OSU_USER_PRESENCE_REQUEST)
+    )
+
+def logout() -> bytearray:
+    return BinaryWriter().write_i32(0).finish(PacketID.OSU_LOGOUT)
+
+def poll_body(rng: random.Random, population: int, offset: int = 0) -> bytes:
+    """Builds the body of a single poll, roughly following the mix of
+    packets sent by an idle or playing client.
+
+    Note:
+        Stats and presences are requested for the `population` synthetic
+            users starting at the index `offset`.
+    """
+
+    first_id = DEFAULT_ID_OFFSET + offset
+
+    body = bytearray()
+    roll = rng.random()
+
+    if roll < 0.05:
+        body += change_action(rng)
+    elif roll < 0.07:
+        body += public_message(rng)
+
+    if rng.random() < 0.10:
+        ids = [first_id + rng.randrange(population) for _ in range(rng.randint(1, 32))]
+        body += stats_request(ids)
+    if rng.random() < 0.05:
+        ids = [first_id + rng.randrange(population) for _ in range(rng.randint(1, 32))]
+        body += presence_request(ids)
+
+    # Idle clients send heartbeats when they have nothing else to send.
+    return bytes(body or heartbeat())
+
+def decode_packets(body: bytes) -> list[tuple[int, bytes]]:
+    """Splits a response body into its packets.
+
+    Note:
+        Raises `AssertionError`, `IndexError` or `struct.error` on malformed
+            bodies.
+    """
+
+    reader = BinaryReader(body)
+    packets = []
+    while not reader.empty:
+        p_id, length = reader.read_osu_header()
+        packets.append((p_id, bytes(reader.read_bytes(length))))
+    return packets
+
+def packet_name(p_id: int) -> str:
+    try:
+        return PacketID(p_id).name
+    except ValueError:
+        return f"UNKNOWN_{p_id}"
+
+class SimulatedClient:
+    """A single simulated osu!stable client with its own connection."""
+
+    __slots__ = (
+        "index",
+        "token",
+        "_config",
+        "_report",
+        "_conn",
+        "_rng",
+    )
+
+    def __init__(self, index: int, config: LoadConfig, report: LoadReport) -> None:
+        self.index = index
+        self.token: Optional[str] = None
+        self._config = config
+        self._report = report
+        self._conn = HTTPConnection(config.host, config.port)
+        self._rng = random.Random(config.seed * 1_000_003 + index)
+
+    async def login(self) -> bool:
+        """Logs in, storing the session token. Returns success."""
+
+        body = build_login_body(
+            self._config.name_format.format(self._config.offset + self.index),
+            _md5(self._config.password),
+            hwid_seed= str(self.index),
+        )
+        resp = await self.__post(self._report.login, body, None)
+        if resp is None:
+            return False
+
+        token = resp.headers.get("cho-token", "no")
+        if token == "no":
+            self._report.login.errors["rejected"] += 1
+            return False
+
+        self.token = token
+        return True
+
+    async def run(self, until: float) -> None:
+        """Polls the server until the `until` loop time, then logs out."""
+
+        loop = asyncio.get_running_loop()
+        # Spread the polls out rather than all clients polling at once.
+        await asyncio.sleep(self._rng.random() * self._config.poll_interval)
+
+        while loop.time() < until and self.token:
+            body = poll_body(
+                self._rng,
+                max(self._config.clients, 1),
+                self._config.offset,
+            )
+            await self.__post(self._report.poll, body, self.token)
+            await asyncio.sleep(self._config.poll_interval)
+
+        if self.token:
+            await self.__post(self._report.poll, bytes(logout()), self.token)
+        await self._conn.close()
+
+    async def __post(self, stats: RequestStats, body: bytes,
+                     token: Optional[str]) -> Optional[HTTPResponse]:
+        headers = {
+            "Host": self._config.host_header,
+            "User-Agent": "osu!",
+            "X-Real-IP": "127.0.0.1",
+        }
+        if token:
+            headers["osu-token"] = token
+
+        start = time.perf_counter()
+        try:
+            resp = await self._conn.request("POST", "/", headers, body)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            stats.errors[type(e).__name__] += 1
+            return None
+        latency = time.perf_counter() - start
+
+        if resp.status != 200:
+            stats.errors[f"http_{resp.status}"] += 1
+            return None
+
+        try:
+            packets = decode_packets(resp.body)
+        except (AssertionError, IndexError, struct.error):
+            stats.errors["malformed"] += 1
+            return None
+
+        stats.latencies.append(latency)
+        for p_id, _ in packets:
+            name = packet_name(p_id)
+            self._report.packets[name] += 1
+            # The server asked the client to reconnect (eg unknown session).
+            if name == "SRV_RESTART":
+                self.token = None
+                stats.errors["restart"] += 1
+
+        return resp
+
+async def run(config: LoadConfig) -> LoadReport:
+    """Runs a load test, returning its report."""
+
+    report = LoadReport(config)
+    clients = [SimulatedClient(idx, config, report) for idx in range(config.clients)]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    # Ramp up with bounded concurrency, as every login costs a bcrypt check.
+    sem = asyncio.Semaphore(config.login_concurrency)
+    async def login(client: SimulatedClient) -> bool:
+        async with sem:
+            return await client.login()
+
+    results = await asyncio.gather(*(login(client) for client in clients))
+    report.logged_in = sum(results)
+
+    until = loop.time() + config.duration
+    await asyncio.gather(*(
+        client.run(until) for client, ok in zip(clients, results) if ok
+    ))
+
+    report.elapsed = loop.time() - start
+    return report
+
+def main(argv: list[str]) -> int:
+    """Runs a load test against a Kisumi instance."""
+
+    defaults = LoadConfig()
+    parser = argparse.ArgumentParser(
+        description= "Simulates osu!stable clients against a Kisumi instance.",
+    )
+    parser.add_argument("--host", default= defaults.host)
+    parser.add_argument("--port", type= int, default= defaults.port)
+    parser.add_argument("--host-header", default= defaults.host_header)
+    parser.add_argument("--clients", type= int, default= defaults.clients)
+    parser.add_argument("--duration", type= float, default= defaults.duration)
+    parser.add_argument("--poll-interval", type= float, default= defaults.poll_interval)
+    parser.add_argument("--login-concurrency", type= int, default= defaults.login_concurrency)
+    parser.add_argument("--name-format", default= defaults.name_format)
+    parser.add_argument("--password", default= defaults.password)
+    parser.add_argument("--offset", type= int, default= defaults.offset)
+    parser.add_argument("--seed", type= int, default= defaults.seed)
+    parser.add_argument("--json", type= Path, default= None,
+                        help= "Additionally write the full report to this path.")
+    args = parser.parse_args(argv)
+
+    config = LoadConfig(
+        host= args.host,
+        port= args.port,
+        host_header= args.host_header,
+        clients= args.clients,
+        duration= args.duration,
+        poll_interval= args.poll_interval,
+        login_concurrency= args.login_concurrency,
+        name_format= args.name_format,
+        password= args.password,
+        offset= args.offset,
+        seed= args.seed,
+    )
+
+    report = asyncio.run(run(config))
+    report.print()
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(report.into_dict(), indent= 4))
+
+    return 0 if report.logged_in else 1
+
+if __name__ == "__main__":
+    raise SystemExit(
+        main(sys.argv[1:])
+    )
@@ -0,0 +1,367 @@
+# Replays a traffic capture (recorded with `CAPTURE_ENABLED`, see
+# `utils.capture`) against a Kisumi instance, diffing each response against
+# the recorded one.
+#
+# Usage (from the Kisumi directory):
+#   python -m tools.replay CAPTURE [--speed 1|N|max] [--rewrite-logins] [--json PATH]
+#
+# Sessions are replayed concurrently, keeping each session's requests in
+# order. The passwords are not captured, so `--rewrite-logins` logs each
+# captured user in as a synthetic user instead.
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Optional
+from utils.capture import CapturedRequest, read_capture
+from .http import HTTPConnection
+from .loadgen import (
+    DEFAULT_NAME_FORMAT,
+    DEFAULT_PASSWORD,
+    RequestStats,
+    decode_packets,
+    packet_name,
+)
+from utils.hash import hash_md5
+import argparse
+import asyncio
+import struct
+import json
+import time
+import sys
+
+# Headers set by the replayer (or the HTTP client) rather than copied over.
+_REPLACED_HEADERS = frozenset((
+    "host",
+    "osu-token",
+    "content-length",
+    "connection",
+    "transfer-encoding",
+))
+
+@dataclass
+class ReplayConfig:
+    """The parameters of a single replay."""
+
+    path: Path
+    host: str = "127.0.0.1"
+    port: int = 5344
+    host_header: str = "c.ppy.sh"
+    # The playback speed multiplier. 0 replays as fast as possible.
+    speed: float = 1.0
+    # Log in as synthetic users instead of the captured ones.
+    rewrite_logins: bool = False
+    name_format: str = DEFAULT_NAME_FORMAT
+    password: str = DEFAULT_PASSWORD
+    offset: int = 0
+    # Compare the response contents rather than only their packet IDs.
+    strict: bool = False
+    # The maximum number of differences kept in the report.
+    max_diffs: int = 20
+
+@dataclass
+class ResponseDiff:
+    """A replayed response which differs from the recorded one."""
+
+    session: int
+    request: int
+    expected: list[str]
+    actual: list[str]
+
+@dataclass
+class ReplayReport:
+    """The results of a replay."""
+
+    config: ReplayConfig
+    elapsed: float = 0.0
+    sessions: int = 0
+    # Sessions captured after their login, which cannot be replayed.
+    skipped_sessions: int = 0
+    matched: int = 0
+    mismatched: int = 0
+    # The furthest a request fell behind its scheduled time, in seconds.
+    max_lag: float = 0.0
+    recorded: RequestStats = field(default_factory= RequestStats)
+    replayed: RequestStats = field(default_factory= RequestStats)
+    diffs: list[ResponseDiff] = field(default_factory= list)
+
+    def add_diff(self, diff: ResponseDiff) -> None:
+        self.mismatched += 1
+        if len(self.diffs) < self.config.max_diffs:
+            self.diffs.append(diff)
+
+    def into_dict(self) -> dict:
+        config = asdict(self.config)
+        config["path"] = str(self.config.path)
+        return {
+            "config": config,
+            "elapsed": self.elapsed,
+            "sessions": self.sessions,
+            "skipped_sessions": self.skipped_sessions,
+            "matched": self.matched,
+            "mismatched": self.mismatched,
+            "max_lag": self.max_lag,
+            "recorded": self.recorded.summary(self.elapsed),
+            "replayed": self.replayed.summary(self.elapsed),
+            "diffs": [asdict(diff) for diff in self.diffs],
+        }
+
+    def print(self) -> None:
+        print(f"Replayed {self.sessions} sessions in {self.elapsed:.1f}s "
+              f"({self.skipped_sessions} skipped, max lag {self.max_lag * 1e+3:.1f}ms).")
+        total = self.matched + self.mismatched
+        print(f"{self.matched}/{total} responses matched.\n")
+
+        print(f"{'':>9} {'requests':>9} {'errors':>7} {'p50 (ms)':>9} "
+              f"{'p90 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+        for name, stats in (("recorded", self.recorded), ("replayed", self.replayed)):
+            s = stats.summary(self.elapsed)
+            print(f"{name:>9} {s['requests']:>9} {s['error_rate']:>6.1%} "
+                  f"{s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} {s['p99_ms']:>9.2f} "
+                  f"{s['max_ms']:>9.2f}")
+
+        if self.replayed.errors:
+            print("\nErrors: " + ", ".join(
+                f"{k} ({v})" for k, v in self.replayed.errors.most_common()
+            ))
+
+        for diff in self.diffs:
+            print(f"\nSession {diff.session}, request {diff.request}:\n"
+                  f"  expected {', '.join(diff.expected) or '(empty)'}\n"
+                  f"  received {', '.join(diff.actual) or '(empty)'}")
+
+def group_sessions(requests: list[CapturedRequest]) -> list[list[CapturedRequest]]:
+    """Groups the captured requests by session, in the order of their first
+    request. Failed logins form sessions of their own."""
+
+    sessions: dict[str, list[CapturedRequest]] = {}
+    for idx, req in enumerate(requests):
+        key = req.request_token or req.token or f"#{idx}"
+        sessions.setdefault(key, []).append(req)
+    return list(sessions.values())
+
+class _LoginRewriter:
+    """Maps the captured usernames onto synthetic users."""
+
+    __slots__ = (
+        "_config",
+        "_names",
+    )
+
+    def __init__(self, config: ReplayConfig) -> None:
+        self._config = config
+        self._names: dict[str, str] = {}
+
+    def rewrite(self, body: bytes) -> bytes:
+        try:
+            username, _, rest = body.decode().split("\n", 2)
+        except ValueError:
+            # Malformed, so replayed as is.
+            return body
+
+        if username not in self._names:
+            self._names[username] = self._config.name_format.format(
+                self._config.offset + len(self._names)
+            )
+
+        return f"{self._names[username]}\n{hash_md5(self._config.password)}\n{rest}".encode()
+
+def _response_key(body: bytes, strict: bool) -> list[str]:
+    """Summarises a response body for comparison."""
+
+    packets = decode_packets(body)
+    if strict:
+        return [f"{packet_name(p_id)}:{data.hex()}" for p_id, data in packets]
+    return [packet_name(p_id) for p_id, _ in packets]
+
+class _SessionReplayer:
+    """Replays the requests of a single session over its own connection."""
+
+    __slots__ = (
+        "index",
+        "_requests",
+        "_config",
+        "_report",
+        "_rewriter",
+        "_conn",
+        "_token",
+    )
+
+    def __init__(self, index: int, requests: list[CapturedRequest],
+                 config: ReplayConfig, report: ReplayReport,
+                 rewriter: Optional[_LoginRewriter]) -> None:
+        self.index = index
+        self._requests = requests
+        self._config = config
+        self._report = report
+        self._rewriter = rewriter
+        self._conn = HTTPConnection(config.host, config.port)
+        self._token: Optional[str] = None
+
+    async def run(self, origin: float, start: float) -> None:
+        """Replays the session, scheduling each request relative to the
+        capture's `origin` time, with the replay starting at loop time
+        `start`."""
+
+        loop = asyncio.get_running_loop()
+        try:
+            for idx, req in enumerate(self._requests):
+                if self._config.speed:
+                    delay = start + (req.time - origin) / self._config.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self._report.max_lag = max(self._report.max_lag, -delay)
+
+                if not await self.__replay(idx, req):
+                    break
+        finally:
+            await self._conn.close()
+
+    async def __replay(self, idx: int, req: CapturedRequest) -> bool:
+        """Replays a single request, returning whether the session may
+        continue."""
+
+        headers = {
+            name: value for name, value in req.headers.items()
+            if name not in _REPLACED_HEADERS
+        }
+        headers["host"] = self._config.host_header
+
+        body = req.body
+        if req.request_token is None:
+            if self._rewriter is not None:
+                body = self._rewriter.rewrite(body)
+        else:
+            # The session's login failed when replayed.
+            if self._token is None:
+                self._report.replayed.errors["no_session"] += 1
+                return False
+            headers["osu-token"] = self._token
+
+        self._report.recorded.latencies.append(req.elapsed)
+        start = time.perf_counter()
+        try:
+            resp = await self._conn.request("POST", "/", headers, body)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self._report.replayed.errors[type(e).__name__] += 1
+            return False
+        self._report.replayed.latencies.append(time.perf_counter() - start)
+
+        if resp.status != 200:
+            self._report.replayed.errors[f"http_{resp.status}"] += 1
+            return False
+
+        if req.request_token is None:
+            token = resp.headers.get("cho-token", "no")
+            self._token = token if token != "no" else None
+
+        try:
+            expected = _response_key(req.response, self._config.strict)
+            actual = _response_key(resp.body, self._config.strict)
+        except (AssertionError, IndexError, struct.error):
+            self._report.replayed.errors["malformed"] += 1
+            return True
+
+        if expected == actual:
+            self._report.matched += 1
+        else:
+            self._report.add_diff(ResponseDiff(self.index, idx, expected, actual))
+        return True
+
+async def run(config: ReplayConfig) -> ReplayReport:
+    """Replays the capture, returning the report."""
+
+    report = ReplayReport(config)
+    requests = list(read_capture(config.path))
+    if not requests:
+        return report
+
+    rewriter = _LoginRewriter(config) if config.rewrite_logins else None
+    replayers = []
+    for session in group_sessions(requests):
+        # Captured mid-session, so there is no login to replay.
+        if session[0].request_token is not None:
+            report.skipped_sessions += 1
+            continue
+
+        replayers.append(_SessionReplayer(
+            len(replayers), session, config, report, rewriter,
+        ))
+    report.sessions = len(replayers)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(*(
+        replayer.run(requests[0].time, start) for replayer in replayers
+    ))
+
+    report.elapsed = loop.time() - start
+    return report
+
+def _parse_speed(value: str) -> float:
+    if value == "max":
+        return 0.0
+
+    speed = float(value.rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("The speed must be positive.")
+    return speed
+
+def main(argv: list[str]) -> int:
+    """Replays a traffic capture against a Kisumi instance."""
+
+    defaults = ReplayConfig(Path())
+    parser = argparse.ArgumentParser(
+        description= "Replays a bancho traffic capture against a Kisumi instance.",
+    )
+    parser.add_argument("path", type= Path)
+    parser.add_argument("--host", default= defaults.host)
+    parser.add_argument("--port", type= int, default= defaults.port)
+    parser.add_argument("--host-header", default= defaults.host_header)
+    parser.add_argument("--speed", type= _parse_speed, default= defaults.speed,
+                        help= "The playback speed (eg 1, 10x or max).")
+    parser.add_argument("--rewrite-logins", action= "store_true",
+                        help= "Log in as synthetic users instead of the captured ones.")
+    parser.add_argument("--name-format", default= defaults.name_format)
+    parser.add_argument("--password", default= defaults.password)
+    parser.add_argument("--offset", type= int, default= defaults.offset)
+    parser.add_argument("--strict", action= "store_true",
+                        help= "Compare the packet contents, not only their IDs.")
+    parser.add_argument("--max-diffs", type= int, default= defaults.max_diffs)
+    parser.add_argument("--fail-on-diff", action= "store_true",
+                        help= "Exit with an error if any response differs.")
+    parser.add_argument("--json", type= Path, default= None,
+                        help= "Additionally write the full report to this path.")
+    args = parser.parse_args(argv)
+
+    config = ReplayConfig(
+        path= args.path,
+        host= args.host,
+        port= args.port,
+        host_header= args.host_header,
+        speed= args.speed,
+        rewrite_logins= args.rewrite_logins,
+        name_format= args.name_format,
+        password= args.password,
+        offset= args.offset,
+        strict= args.strict,
+        max_diffs= args.max_diffs,
+    )
+
+    try:
+        report = asyncio.run(run(config))
+    except (OSError, ValueError) as e:
+        print(f"Could not read the capture: {e}")
+        return 1
+    report.print()
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(report.into_dict(), indent= 4))
+
+    if report.replayed.errors or (args.fail_on_diff and report.mismatched):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(
+        main(sys.argv[1:])
+    )
@@ -2,31 +2,41 @@
 # Holds constants just for testing!!! I haven't hooked up a db yet.
 from utils.hash import BCryptPassword
 from user.user import User
+from user.clients import ClientList
 from user.stats import Stats, ModeStats
 from user.settings import Settings
 from scores.constants.mode import CustomMode, Mode
 from state.repos import user_manager
+from state import config
 from utils.hash import hash_md5
+from logger import info
 
-async def configure_test_user() -> None:
-    """Configures a user instance made for testing."""
+# The synthetic population used for load testing. `tools.loadgen` logs in
+# using the same names and password.
+SYNTHETIC_ID_OFFSET = 100_000
+SYNTHETIC_NAME_FORMAT = "Synthetic {}"
+SYNTHETIC_PASSWORD = "synthetic"
 
-    REALISTIK_USER = User(
-        1000,
-        "RealistikDash",
-        "realistik@da.sh",
+def _create_user(user_id: int, name: str, email: str,
+                 password: BCryptPassword) -> User:
+    """Creates a user instance with placeholder stats."""
+
+    user = User(
+        user_id,
+        name,
+        email,
+        None,
         None,
-        [],
         None,
-        BCryptPassword.from_str(hash_md5("bruhh")),
+        password,
         None,
         [],
         Settings.new(),
     )
 
-    REALISTIK_STATS = Stats(
+    user.stats = Stats(
         {(c_mode, mode): ModeStats(
-            REALISTIK_USER,
+            user,
             mode,
             c_mode,
             654888,
@@ -38,8 +48,42 @@ async def configure_test_user() -> None:
             0,
             1
         ) for c_mode in CustomMode for mode in Mode},
-        REALISTIK_USER, 0, 0
+        user, 0, 0
     )
+    user.clients = ClientList(user)
+    return user
+
+async def configure_test_user() -> None:
+    """Configures a user instance made for testing."""
 
-    REALISTIK_USER.stats = REALISTIK_STATS
+    REALISTIK_USER = _create_user(
+        1000,
+        "RealistikDash",
+        "realistik@da.sh",
+        await BCryptPassword.from_str_async(hash_md5("bruhh")),
+    )
     await user_manager._repo.insert(REALISTIK_USER)
+
+async def seed_synthetic_users(count: int = config.SYNTHETIC_USERS) -> None:
+    """Inserts `count` synthetic users into the user manager, named by
+    `SYNTHETIC_NAME_FORMAT` starting from 0.
+
+    Note:
+        All synthetic users share a single password hash, as hashing one per
+            user would take minutes at scale.
+    """
+
+    if not count:
+        return
+
+    password = await BCryptPassword.from_str_async(hash_md5(SYNTHETIC_PASSWORD))
+
+    for idx in range(count):
+        await user_manager._repo.insert(_create_user(
+            SYNTHETIC_ID_OFFSET + idx,
+            SYNTHETIC_NAME_FORMAT.format(idx),
+            f"synthetic{idx}@kisumi.local",
+            password,
+        ))
+
+    info("Seeded %d synthetic users.", count)
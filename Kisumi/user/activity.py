@@ -0,0 +1,42 @@
+from typing import Optional
+import time
+
+class ActivityTracker:
+    """Records when each attached client last made a request.
+
+    Note:
+        The timestamps are kept in a single dictionary (by client ID) rather
+            than on each client, making recording a single store.
+        Only written while reaping is enabled (see `SessionReaper`), with
+            clients forgotten once detached.
+        Times are from `time.monotonic`.
+    """
+
+    __slots__ = (
+        "_last_seen",
+    )
+
+    def __init__(self) -> None:
+        self._last_seen: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        """Returns the number of clients tracked."""
+
+        return len(self._last_seen)
+
+    # Public methods.
+    def touch(self, client_id: str, now: Optional[float] = None) -> None:
+        """Records that the client with the ID of `client_id` made a request
+        at `now` (defaults to the current time)."""
+
+        self._last_seen[client_id] = time.monotonic() if now is None else now
+
+    def last_seen(self, client_id: str) -> Optional[float]:
+        """Returns the time the client last made a request, if tracked."""
+
+        return self._last_seen.get(client_id)
+
+    def forget(self, client_id: str) -> None:
+        """Stops tracking the client with the ID of `client_id`."""
+
+        self._last_seen.pop(client_id, None)
@@ -0,0 +1,123 @@
+# A serial execution context for the state of a single user, replacing the
+# separate locks of its components.
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+    TypeVar,
+)
+from logger import error
+import traceback
+import asyncio
+
+T = TypeVar("T")
+
+class UserActor:
+    """Runs the jobs changing a single user's state (their clients, auth and
+    queues) one at a time, in the order they were submitted. Actors of
+    different users run independently of each other.
+
+    Note:
+        Without contention, a job runs straight away within the caller's
+            task, costing no more than a flag check. Jobs submitted while
+            another is running wait in the mailbox, drained by a task
+            started only for as long as it is non-empty.
+        Jobs submitted from within a job of the same actor (by the same
+            task) run immediately, as they are already serialised. Tasks
+            created by a job are not part of it, so their jobs are queued.
+    """
+
+    __slots__ = (
+        "_mailbox",
+        "_busy",
+        "_owner",
+        "_drainer",
+    )
+
+    def __init__(self) -> None:
+        self._mailbox: deque[tuple[Callable[..., Awaitable[Any]], tuple, asyncio.Future]] = deque()
+        self._busy = False
+        # The task running the current job.
+        self._owner: Optional[asyncio.Task] = None
+        self._drainer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Returns the number of jobs waiting in the mailbox."""
+
+        return len(self._mailbox)
+
+    @property
+    def busy(self) -> bool:
+        """Whether a job is currently running."""
+
+        return self._busy
+
+    # Public methods.
+    async def run(self, func: Callable[..., Awaitable[T]], *args: Any) -> T:
+        """Runs the coroutine function `func` with `*args` once all of the
+        previously submitted jobs have finished, returning its result.
+
+        Note:
+            Exceptions raised by `func` are propagated to the caller.
+        """
+
+        task = asyncio.current_task()
+        if self._busy:
+            if self._owner is task:
+                return await func(*args)
+
+            future = asyncio.get_running_loop().create_future()
+            self._mailbox.append((func, args, future))
+            return await future
+
+        self._busy = True
+        self._owner = task
+        try:
+            return await func(*args)
+        finally:
+            self._owner = None
+            self.__release()
+
+    # Private methods.
+    def __release(self) -> None:
+        """Hands the actor over to the mailbox, if anything is waiting."""
+
+        if not self._mailbox:
+            self._busy = False
+            return
+
+        self._drainer = asyncio.create_task(self.__drain())
+
+    async def __drain(self) -> None:
+        self._owner = asyncio.current_task()
+        try:
+            while self._mailbox:
+                func, args, future = self._mailbox.popleft()
+                # The caller stopped waiting (eg cancelled).
+                if future.done():
+                    continue
+
+                try:
+                    result = await func(*args)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    else:
+                        error("Actor job failed after its caller left!\n%s",
+                              traceback.format_exc())
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._drainer = None
+            self._owner = None
+            self._busy = False
+            # Cancelled with jobs still waiting.
+            for _, _, future in self._mailbox:
+                future.cancel()
+            self._mailbox.clear()
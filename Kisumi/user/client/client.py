@@ -72,11 +72,14 @@ class StableClient(AbstractClient):
                          request: LoginRequestModel) -> "StableClient":
         """Creates a default instance of `StableClient` using data from login."""
 
+        client_id = str(uuid.uuid4())
+
         return StableClient(
             type= ClientType.STABLE,
             auth= StableAuthComponent(
                 user.password,
                 user,
+                client_id,
             ),
             chat= None,
             queue= ByteBuffer.new(),
@@ -85,7 +88,7 @@ class StableClient(AbstractClient):
             location= location,
             user= user,
             timezone= request.utc_timezone,
-            id= str(uuid.uuid4()),
+            id= client_id,
         )
 
     async def logout(self) -> None:
@@ -12,7 +12,6 @@ from user.token import (
     encode_jwt_dict,
 )
 from state import config
-import asyncio
 import time
 
 if TYPE_CHECKING:
@@ -36,10 +35,13 @@ class AbstractAuthComponent(ABC):
         ...
 
 class StableAuthComponent(AbstractAuthComponent):
-    """A component utilised for processing a user's authentication."""
+    """A component utilised for processing a user's authentication.
+
+    Note:
+        Changes to the state are serialised through the user's actor.
+    """
 
     __slots__ = (
-        "_lock",
         "_pw_bcrypt",
         "_cached_md5",
         "_user",
@@ -49,7 +51,6 @@ class StableAuthComponent(AbstractAuthComponent):
     def __init__(self, pw: BCryptPassword, user: "User", client_id: str) -> None:
         super().__init__()
 
-        self._lock = asyncio.Lock()
         self._pw_bcrypt = pw
         self._cached_md5 = None
         self._user = user
@@ -95,10 +96,9 @@ class StableAuthComponent(AbstractAuthComponent):
     
     async def clear_cached_password(self) -> None:
         """Clears the cached password MD5 for the user, forcing the MD5 to
-        be checked again the next time. Acquires the authentication lock."""
+        be checked again the next time. Ran by the user's actor."""
 
-        async with self._lock:
-            self.__clear_cached_pw()
+        await self._user.actor.run(self.__clear_cached_pw_async)
     
     # Making these a functions just in case i want to make a timed cache in the future.
     def __clear_cached_pw(self) -> None:
@@ -106,6 +106,9 @@ class StableAuthComponent(AbstractAuthComponent):
 
         self._cached_md5 = None
     
+    async def __clear_cached_pw_async(self) -> None:
+        self.__clear_cached_pw()
+    
     def __set_cached_pw(self, pw: str) -> None:
         """Sets the cached password md5."""
 
@@ -125,21 +128,25 @@ class StableAuthComponent(AbstractAuthComponent):
         
         return False
     
+    async def __authenticate(self, token: str) -> bool:
+        # It is a password MD5.
+        if _is_valid_md5(token):
+            return await self.__compare_bcrypt(token)
+        else:
+            return self.__confirm_jwt(token)
+    
+    async def __reload(self) -> None:
+        self.__clear_cached_pw()
+        raise NotImplementedError
+    
     async def authenticate(self, token: str) -> bool:
         """Handles user authentication, accepting password md5 or token
-        as input. Acquires the authentication lock."""
-
-        async with self._lock:
-            # It is a password MD5.
-            if _is_valid_md5(token):
-                return await self.__compare_bcrypt(token)
-            else:
-                return await self.__confirm_jwt(token)
+        as input. Ran by the user's actor."""
+
+        return await self._user.actor.run(self.__authenticate, token)
     
     async def reload(self) -> None:
         """Reloads the authentication information for the user. Clears the cached
-        password MD5. Acquires the authentication lock."""
+        password MD5. Ran by the user's actor."""
 
-        async with self._lock:
-            self.__clear_cached_pw()
-            raise NotImplementedError
+        await self._user.actor.run(self.__reload)
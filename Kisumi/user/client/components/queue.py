@@ -1,21 +1,23 @@
 from typing import Union
-import asyncio
 
 ByteLike = Union[bytes, bytearray]
 
 class ByteBuffer:
-    """A thread-safe implementation of a buffer of bytes."""
+    """A buffer of bytes queued for a client.
+
+    Note:
+        No operation suspends, so each is atomic within the event loop and
+            does not require a lock (or the user's actor).
+    """
 
     __slots__ = (
         "_buf",
-        "_lock",
     )
 
     def __init__(self, buf: bytearray) -> None:
         """Creates an instance of a `ByteBuffer` from an existing bytearray."""
 
-        self._lock = asyncio.Lock()
-        self._buf = bytearray()
+        self._buf = buf
     
     @staticmethod
     def new() -> "ByteBuffer":
@@ -23,26 +25,37 @@ class ByteBuffer:
 
         return ByteBuffer(bytearray())
 
+    def __len__(self) -> int:
+        """Returns the number of bytes currently queued."""
+
+        return len(self._buf)
+    
+    def __sizeof__(self) -> int:
+        """Returns the size of the buffer alongside its contents."""
+
+        return object.__sizeof__(self) + self._buf.__sizeof__()
+
+    def __bytes__(self) -> bytes:
+        """Returns a copy of the currently queued bytes, without clearing
+        them."""
+
+        return bytes(self._buf)
+
     @property
     def empty(self) -> bool:
         """Checks if the buffer is empty."""
 
-        # should this be locked?
         return len(self._buf) == 0
     
     async def append(self, e: ByteLike) -> None:
-        """Appends `e` to the end of the buffer, acquiring the lock in the
-        process."""
+        """Appends `e` to the end of the buffer."""
 
-        async with self._lock:
-            self._buf += e
+        self._buf += e
     
     async def clear(self) -> bytearray:
         """Clears the contents of the `ByteBuffer`, returning its previous
-        contents. Acquires the buffer lock."""
-
-        async with self._lock:
-            old = self._buf.copy()
-            self._buf.clear()
+        contents."""
 
+        # Swapped rather than copied, the old buffer is handed over as is.
+        old, self._buf = self._buf, bytearray()
         return old
@@ -4,17 +4,22 @@ from .client.client import (
 )
 from .client.constants.client import ClientType
 from typing import (
+    Iterator,
     Optional,
     TYPE_CHECKING,
 )
 from state import repos
-import asyncio
 
 if TYPE_CHECKING:
     from .user import User
 
 class ClientList:
-    """A class storing all clients attached to a user."""
+    """A class storing all clients attached to a user.
+
+    Note:
+        Changes to the list are serialised through the user's actor. Reads
+            do not wait for anything, so see a consistent list without it.
+    """
 
     __slots__ = (
         "_user",
@@ -27,7 +32,6 @@ class ClientList:
 
         self._user = user
         self._clients: dict[str, AbstractClient] = {}
-        self._lock = asyncio.Lock()
     
     def __len__(self) -> int:
         """Returns the amount of attached clients."""
@@ -40,6 +44,23 @@ class ClientList:
 
         return bool(self._clients)
     
+    def __contains__(self, client: AbstractClient) -> bool:
+        """Checks if `client` is attached to the user."""
+
+        return self._clients.get(client.id) is client
+    
+    def __iter__(self) -> Iterator[AbstractClient]:
+        """Returns an iterator over all attached clients, in priority order."""
+
+        return iter(self._clients.values())
+    
+    # Properties.
+    @property
+    def primary(self) -> Optional[AbstractClient]:
+        """The highest priority attached client, if any."""
+
+        return next(iter(self._clients.values()), None)
+    
     # Private methods.
     def __insert_client(self, client: AbstractClient) -> None:
         """Inserts a client in the next available position in the
@@ -58,6 +79,7 @@ class ClientList:
         """Actions performed when a client is attached to a user."""
 
         await client.on_attach(self._user)
+        repos.reaper.track(client)
         # If this is our first client added.
         if len(self) == 1:
             await repos.online.add_user(self._user)
@@ -79,7 +101,7 @@ class ClientList:
             return client.type
     
     async def __attach_client(self, client: AbstractClient) -> None:
-        """Handles attaching a client to a user."""
+        """Handles attaching a client to a user. Ran by the user's actor."""
 
         # Stable clients have different ordering logic.
         if client.type == ClientType.STABLE and not self.__stable_client():
@@ -122,90 +144,86 @@ class ClientList:
             if cl.type == client_type
         ]
 
+    async def __detach_client(self, client: AbstractClient) -> bool:
+        """Handles detaching a client from a user. Ran by the user's actor."""
+
+        if self._clients.get(client.id) is client:
+            del self._clients[client.id]
+            repos.activity.forget(client.id)
+        return not self._clients
+
     # Public methods
     async def attach(self, client: AbstractClient) -> None:
         """Attaches a client to the user, registering it.
         
         Note:
-            Acquires the user client list lock.
+            Ran by the user's actor.
             Stable clients are given priority in the ordering.
         """
 
-        async with self._lock:
-            self.__attach_client(client)
+        await self._user.actor.run(self.__attach_client, client)
+    
+    async def detach(self, client: AbstractClient) -> bool:
+        """Detaches a client from the user.
+        
+        Note:
+            Ran by the user's actor.
+            Does not remove the user from the online users, allowing for the
+                caller to do so for many users at once.
+        
+        Returns:
+            Whether the user has no more clients attached (so should no
+                longer be online).
+        """
+
+        return await self._user.actor.run(self.__detach_client, client)
     
     async def from_id(self, client_id: str) -> Optional[AbstractClient]:
         """Attempts to fetch an instance inheriting form `AbstractClient`
         with the matching id.
 
-        Note:
-            Acquires the user client list lock.
-        
         Returns:
             Child class of `AbstractClient` if attached to this specific user.
             Else `None`.
         """
         
-        async with self._lock:
-            return self.__client_from_id(client_id)
+        return self.__client_from_id(client_id)
     
     async def type_from_id(self, client_id: str) -> Optional[ClientType]:
         """Returns the client type enum of a client with the given `client_id`.
         
-        Note:
-            Acquires the user client list lock.
-        
         Returns:
             Enum of `ClientType` of the found client if found.
             Else `None`.
         """
 
-        async with self._lock:
-            return self.__client_type_from_id(client_id)
+        return self.__client_type_from_id(client_id)
     
     async def has_any(self, client_type: ClientType) -> bool:
-        """Checks if the user has any clients of type `client_type` attached.
-        
-        Note:
-            Acquires the user client list lock.
-        """
+        """Checks if the user has any clients of type `client_type` attached."""
 
-        async with self._lock:
-            return self.__has_any(client_type)
+        return self.__has_any(client_type)
     
     async def get_with_type(self, client_type: ClientType) -> Optional[ClientType]:
         """Returns the first client of the given `client_type`.
         
-        Note:
-            Acquires the user client list lock.
-        
         Returns:
             Child class of `AbstractClient` if exists.
             Else `None`.
         """
 
-        async with self._lock:
-            return self.__get_of_type(client_type)
+        return self.__get_of_type(client_type)
     
     async def get_all_with_type(self, client_type: ClientType) -> Optional[ClientType]:
         """Returns all clients of the given `client_type`.
         
-        Note:
-            Acquires the user client list lock.
-        
         Returns:
             List of child class of `AbstractClient` that may be empty.
         """
 
-        async with self._lock:
-            return self.__get_all_of_type(client_type)
+        return self.__get_all_of_type(client_type)
     
     async def stable_client(self) -> Optional[StableClient]:
-        """Returns the primary stable client if exists.
-        
-        Note:
-            Acquires the user client list lock.
-        """
+        """Returns the primary stable client if exists."""
 
-        async with self._lock:
-            return self.__stable_client()
+        return self.__stable_client()
@@ -18,6 +18,11 @@ class UserManager(Singleton):
         self._repo = UserRepo("Manager")
         self._lock = asyncio.Lock()
     
+    def __len__(self) -> int:
+        """Returns the number of cached users."""
+
+        return len(self._repo)
+    
     # Private methods.
     async def __get_user(self, user_id: int) -> Optional["User"]:
         """Attempts to retrieve an insance of `User` with the given ID from
@@ -34,6 +39,15 @@ class UserManager(Singleton):
         # Db logic.
         ...
 
+    async def __get_user_by_name(self, name: str) -> Optional["User"]:
+        """Same as `UserManager.__get_user` but by the username."""
+
+        if (user := await self._repo.get_by_name(name)):
+            return user
+
+        # Db logic.
+        ...
+
     # Public methods.
     async def get_user(self, user_id: int) -> Optional["User"]:
         """Attempts to retrieve an insance of `User` with the given ID from
@@ -45,3 +59,42 @@ class UserManager(Singleton):
 
         async with self._lock:
             return await self.__get_user(user_id)
+
+    async def get_user_by_name(self, name: str) -> Optional["User"]:
+        """Attempts to retrieve an instance of `User` by their username from
+        the cache or database.
+
+        Note:
+            Acquires the UserManager lock.
+        """
+
+        async with self._lock:
+            return await self.__get_user_by_name(name)
+
+    async def cache(self, user: "User") -> None:
+        """Caches an already created user, so they can be retrieved without
+        being loaded.
+
+        Note:
+            Acquires the UserManager lock.
+        """
+
+        async with self._lock:
+            await self._repo.insert(user)
+
+    async def invalidate(self, user_ids: list[int]) -> int:
+        """Drops the cached users with the given ids, so that they are loaded
+        again upon their next lookup. Returns the number of users dropped.
+
+        Note:
+            Acquires the UserManager lock.
+            Users that are online remain referenced by their clients.
+            Until users are loaded from the database, dropped users can not
+                be retrieved again.
+        """
+
+        async with self._lock:
+            dropped = 0
+            for user_id in user_ids:
+                dropped += await self._repo.remove_id(user_id)
+            return dropped
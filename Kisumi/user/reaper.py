@@ -0,0 +1,139 @@
+# Removal of the clients which stopped polling, keeping the online users
+# (and their presences) accurate.
+from typing import Optional, TYPE_CHECKING
+from utils.timingwheel import TimingWheel
+from user.client.constants.client import ClientType
+from utils import metrics
+from state import repos
+from logger import info, error
+import traceback
+import asyncio
+import time
+
+if TYPE_CHECKING:
+    from user.client.client import AbstractClient
+    from user.user import User
+
+_SESSIONS_REAPED = metrics.counter(
+    "kisumi_sessions_reaped_total",
+    "Clients detached after not making a request within the timeout.",
+)
+_SESSIONS_TRACKED = metrics.gauge(
+    "kisumi_sessions_tracked",
+    "Attached clients tracked by the session reaper.",
+)
+
+class SessionReaper:
+    """Detaches clients which have not made a request in `timeout` seconds,
+    taking users without any remaining clients offline.
+
+    Note:
+        A `timeout` of 0 disables reaping, with clients never tracked.
+        Requests are not rescheduled on the wheel as they happen, only
+            recorded in `repos.activity`. A client is only rescheduled when
+            its deadline is reached, for the remainder of the timeout since
+            its last request. This keeps each request to a single store.
+        Users going offline together are announced in a single broadcast.
+    """
+
+    __slots__ = (
+        "timeout",
+        "_wheel",
+        "_clients",
+        "_task",
+    )
+
+    def __init__(self, timeout: float, resolution: float = 1.0) -> None:
+        self.timeout = timeout
+        self._wheel: TimingWheel[str] = TimingWheel(
+            resolution,
+            # A single rotation covers the timeout.
+            slots= max(int(timeout / resolution) + 1, 1),
+        )
+        self._clients: dict[str, "AbstractClient"] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Returns the number of tracked clients."""
+
+        return len(self._clients)
+
+    # Public methods.
+    def track(self, client: "AbstractClient") -> None:
+        """Starts tracking a newly attached client, counting it as active."""
+
+        if not self.timeout:
+            return
+
+        repos.activity.touch(client.id)
+        self._clients[client.id] = client
+        self._wheel.schedule(client.id, self.timeout)
+
+    def start(self) -> None:
+        """Starts periodically reaping the timed out clients."""
+
+        assert self._task is None, "The session reaper is already running!"
+        assert self.timeout, "Reaping is disabled by a timeout of 0."
+        self._task = asyncio.create_task(self.__run(), name= "session_reaper")
+
+    async def stop(self) -> None:
+        """Stops reaping clients."""
+
+        if self._task is None:
+            return
+
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def reap(self, now: Optional[float] = None) -> int:
+        """Detaches all clients which timed out by `now`, returning the
+        number detached."""
+
+        if now is None:
+            now = time.monotonic()
+
+        expired: list["AbstractClient"] = []
+        for client_id in self._wheel.advance(now):
+            last_seen = repos.activity.last_seen(client_id)
+            if last_seen is not None and (remaining := last_seen + self.timeout - now) > 0:
+                self._wheel.schedule(client_id, remaining, now)
+            elif (client := self._clients.pop(client_id, None)) is not None:
+                expired.append(client)
+
+        _SESSIONS_TRACKED.set(len(self._clients))
+        if not expired:
+            return 0
+
+        offline: list["User"] = []
+        for client in expired:
+            repos.activity.forget(client.id)
+            # It may have already been detached (eg replaced on login).
+            if client not in client.user.clients:
+                continue
+
+            if await client.user.clients.detach(client):
+                offline.append(client.user)
+            await client.logout()
+            # Free anything still queued for it.
+            if client.type == ClientType.STABLE:
+                await client.queue.clear()
+
+        await repos.online.remove_users(offline)
+
+        _SESSIONS_REAPED.inc(len(expired))
+        info("Timed out %d sessions (%d users went offline).",
+             len(expired), len(offline))
+        return len(expired)
+
+    # Private methods.
+    async def __run(self) -> None:
+        while True:
+            await asyncio.sleep(self._wheel.resolution)
+            try:
+                await self.reap()
+            except Exception:
+                error("Failed reaping timed out sessions!\n%s", traceback.format_exc())
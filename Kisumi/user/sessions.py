@@ -0,0 +1,276 @@
+# Resolution of session tokens alongside persisting stable sessions across
+# restarts, so that clients do not have to log in again after a deploy.
+from packets.writer import BinaryWriter
+from packets.reader import BinaryReader
+from scores.constants.mode import CustomMode, Mode
+from state import repos, config
+from .client.client import StableClient
+from .client.constants.client import ClientType
+from .client.components.auth import StableAuthComponent
+from .client.components.constants.actions import Actions
+from .client.components.constants.tokens import AuthType
+from .client.components.action import Action
+from .client.components.hwid import StableHWID
+from .client.components.queue import ByteBuffer
+from .token import decode_jwt_str, confirm_token_expiry
+from resources.db.geo.iploc import IPLocation
+from utils.vector2 import Vector2
+from utils.cache import LRUCache
+from logger import info, error
+from pathlib import Path
+from typing import Optional
+import asyncio
+import struct
+import time
+import os
+
+# Identifies the file as a Kisumi session snapshot.
+_SNAPSHOT_MAGIC = b"KSES"
+_SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = config.DATA_DIR / "sessions.kss"
+
+# Tokens already verified, by the client they were issued for. Entries expire
+# alongside their token.
+_token_cache: LRUCache[StableClient] = LRUCache(
+    config.SESSION_CACHE_SIZE,
+    name= "session_tokens",
+)
+
+async def client_from_token(token: str) -> Optional[StableClient]:
+    """Resolves the `osu-token` header of a request to the online stable
+    client it was issued for.
+
+    Note:
+        Does not acquire any locks for tokens which have been resolved
+            before, as is the case for all but the first poll of a session.
+
+    Returns:
+        Instance of `StableClient` if the token is valid and the client is
+            still attached.
+        Else `None`.
+    """
+
+    if (client := _token_cache.fetch(token)) is not None:
+        if client in client.user.clients:
+            return client
+        _token_cache.discard(token)
+
+    if (jwt_d := decode_jwt_str(token)) is None:
+        return None
+
+    if jwt_d["type"] != AuthType.STABLE or not confirm_token_expiry(jwt_d):
+        return None
+
+    if (user := await repos.online.get(jwt_d["user_id"])) is None:
+        return None
+
+    client = await user.clients.from_id(jwt_d["client_id"])
+    if client is None or client.type != ClientType.STABLE:
+        return None
+
+    _token_cache.insert(token, client, ttl= jwt_d["expiry"] - time.time())
+    return client
+
+async def snapshot_sessions(path: Path = SNAPSHOT_PATH) -> int:
+    """Serialises the state of all online stable clients into `path`, to be
+    restored by `restore_sessions` on the next startup.
+
+    Note:
+        Tokens are stateless JWTs bound to the client ID, so persisting the
+            ID is enough for them to remain valid.
+        The cached password MD5 is deliberately not persisted.
+
+    Returns:
+        The number of sessions written.
+    """
+
+    clients = [
+        client for user in await repos.online.users()
+        for client in user.clients
+        if client.type == ClientType.STABLE
+    ]
+
+    writer = BinaryWriter(pralloc_header= False)
+    (
+        writer.write_raw(_SNAPSHOT_MAGIC)
+            .write_u8(_SNAPSHOT_VERSION)
+            .write_i64(int(time.time()))
+            .write_u32(len(clients))
+    )
+
+    for client in clients:
+        _write_client(writer, client)
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, _write_atomic, path, writer.buffer)
+    except OSError:
+        error("Failed writing the session snapshot to %s!", path)
+        return 0
+
+    info("Wrote %d sessions to %s.", len(clients), path)
+    return len(clients)
+
+async def restore_sessions(path: Path = SNAPSHOT_PATH) -> int:
+    """Restores the stable clients from a snapshot created by
+    `snapshot_sessions`, attaching them to their users. The snapshot is
+    removed afterwards, so it is only ever restored once.
+
+    Note:
+        Snapshots older than `config.SESSION_SNAPSHOT_MAX_AGE` seconds are
+            ignored, as their clients have long given up on the server.
+
+    Returns:
+        The number of sessions restored.
+    """
+
+    loop = asyncio.get_running_loop()
+    try:
+        data = await loop.run_in_executor(None, path.read_bytes)
+    except FileNotFoundError:
+        return 0
+    except OSError:
+        error("Failed reading the session snapshot at %s!", path)
+        return 0
+
+    try:
+        os.remove(path)
+    except OSError:
+        error("Failed removing the session snapshot at %s!", path)
+
+    reader = BinaryReader(data)
+    try:
+        if reader.read_bytes(len(_SNAPSHOT_MAGIC)) != _SNAPSHOT_MAGIC \
+            or reader.read_u8() != _SNAPSHOT_VERSION:
+            error("The session snapshot at %s is not supported.", path)
+            return 0
+
+        created = reader.read_i64()
+        count = reader.read_u32()
+    except struct.error:
+        error("The session snapshot at %s is corrupted.", path)
+        return 0
+
+    if time.time() - created > config.SESSION_SNAPSHOT_MAX_AGE:
+        info("Skipping restoring sessions as the snapshot is outdated.")
+        return 0
+
+    restored = 0
+    for _ in range(count):
+        try:
+            user_id, client = _read_client(reader)
+        except (struct.error, ValueError, IndexError):
+            error("The session snapshot at %s is corrupted.", path)
+            break
+
+        if (user := await repos.user_manager.get_user(user_id)) is None:
+            continue
+
+        # The user may have logged in again in the meantime.
+        if await user.clients.from_id(client.id):
+            continue
+        # Or on another node.
+        if repos.cluster is not None and not await repos.cluster.claim(user_id):
+            continue
+
+        client.user = user
+        client.auth = StableAuthComponent(user.password, user, client.id)
+        await user.clients.attach(client)
+        restored += 1
+
+    info("Restored %d sessions from the snapshot.", restored)
+    return restored
+
+def _write_client(writer: BinaryWriter, client: StableClient) -> None:
+    """Serialises a single stable client into `writer`."""
+
+    action = client.action
+    location = client.location
+    hwid = client.hwid
+    queued = bytes(client.queue)
+
+    (
+        writer.write_i32(client.user.id)
+            .write_str(client.id)
+            .write_i32(client.timezone)
+            # Action.
+            .write_u8(action.id.value)
+            .write_str(action._text)
+            .write_u8(action.mode.value)
+            .write_u8(action.c_mode.value)
+            # Location.
+            .write_str(location.ip)
+            .write_str(location.city or "")
+            .write_str(location.country or "")
+            .write_f32(location.location.x or 0.0)
+            .write_f32(location.location.y or 0.0)
+            .write_i32(location.utc_offset)
+            # HWID.
+            .write_str(hwid.client_md5)
+            .write_str(hwid.adapter)
+            .write_str(hwid.adapter_md5)
+            .write_str(hwid.uninstaller_md5)
+            .write_str(hwid.serial_md5)
+            # Packets not yet delivered.
+            .write_u32(len(queued))
+            .write_raw(queued)
+    )
+
+def _read_client(reader: BinaryReader) -> tuple[int, StableClient]:
+    """Deserialises a single stable client from `reader`. The user and auth
+    component are left unset.
+
+    Returns:
+        Tuple of the ID of the client's user and the client.
+    """
+
+    user_id = reader.read_i32()
+    client_id = reader.read_str()
+    timezone = reader.read_i32()
+
+    action = Action.new()
+    action.id = Actions(reader.read_u8())
+    action._text = reader.read_str()
+    action.mode = Mode(reader.read_u8())
+    action.c_mode = CustomMode(reader.read_u8())
+
+    location = IPLocation(
+        ip= reader.read_str(),
+        city= reader.read_str(),
+        country= reader.read_str(),
+        location= Vector2(reader.read_f32(), reader.read_f32()),
+        utc_offset= reader.read_i32(),
+    )
+
+    hwid = StableHWID(
+        client_md5= reader.read_str(),
+        adapter= reader.read_str(),
+        adapter_md5= reader.read_str(),
+        uninstaller_md5= reader.read_str(),
+        serial_md5= reader.read_str(),
+    )
+
+    queued = bytearray(reader.read_bytes(reader.read_u32()))
+
+    return user_id, StableClient(
+        type= ClientType.STABLE,
+        id= client_id,
+        auth= None,
+        chat= None,
+        user= None,
+        action= action,
+        location= location,
+        queue= ByteBuffer(queued),
+        hwid= hwid,
+        timezone= timezone,
+    )
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Writes `data` into `path` through a temporary file, so a partially
+    written snapshot is never read."""
+
+    path.parent.mkdir(parents= True, exist_ok= True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -3,6 +3,8 @@ from scores.constants.mode import (
     CustomMode,
     Mode,
 )
+from localisation.constants.language import Language
+from typing import Optional
 
 @dataclass
 class Settings:
@@ -11,7 +13,7 @@ class Settings:
     # User settings.
     preferred_mode: Mode
     preferred_c_mode: CustomMode
-    language: ...
+    language: Optional[Language]
     overwrite_rules: ...
 
     @staticmethod
@@ -1,8 +1,10 @@
 from .client.components.constants.tokens import AuthType
 from state import config
 from typing import TypedDict, Optional
+from utils.lazy import lazy_import
 import time
-import jwt
+
+jwt = lazy_import("jwt")
 
 
 class AuthJWT(TypedDict):
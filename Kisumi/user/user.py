@@ -1,6 +1,8 @@
 # XXX: Perhaps look into moving this into __innit__.py
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from utils.hash import BCryptPassword
+from .actor import UserActor
+from .clients import ClientList
 from .stats import Stats
 from .settings import Settings
 from .client.constants.client import ClientType
@@ -22,12 +24,14 @@ class User:
     name: str
     email: str
     stats: Stats
-    clients: dict[str, AbstractClient] # TODO: Client List object with lock.
+    clients: ClientList
     scores: Any # Iterable object holding a list of top 100 scores and able to fetch more.
     password: BCryptPassword
     notifications: Any
     name_history: list[str]
     settings: Settings
+    # Serialises all changes to the user's clients and their state.
+    actor: UserActor = field(default_factory= UserActor, repr= False, compare= False)
 
     ...
 
@@ -48,7 +52,8 @@ class User:
         """Returns the primary stable client attached to the user if present,
         else returns `None`."""
 
-        return self.client if self.client.type is ClientType.STABLE else None
+        client = self.client
+        return client if client and client.type is ClientType.STABLE else None
     
     @property
     def stable_clients(self) -> list[StableClient]:
@@ -59,39 +64,17 @@ class User:
     @property
     def stable_clients_generator(self) -> Generator[StableClient, None, None]:
         """Same as `User.stable_clients` except returns a generator."""
-        return (cl for cl in self.clients.values() 
+        return (cl for cl in self.clients
                 if cl.type is ClientType.STABLE)
     
     @property
     def client(self) -> Optional[AbstractClient]:
         """Returns the user's primary client if attached."""
 
-        return next(iter(self.clients)) if self.clients else None
+        return self.clients.primary
 
     @property
     def online(self) -> bool:
         """Checks if the user has any clients attached to it."""
 
         return bool(self.clients)
-    
-    # Public functions
-    async def insert_client(self, client: AbstractClient) -> None:
-        """Attaches a client to a user, managing client prioritisation."""
-
-        # Stable client assumes priority as long as no other ones are attached
-        # (tourney).
-        if client.type is ClientType.STABLE and not self.stable_client:
-            # Dies ordered dicts that dont allow indexes.
-            self.__insert_client_to_front(client)
-        else:
-            self.clients[client.id] = client
-        
-        await client.on_attach(self)
-    
-    def __insert_client_to_front(self, client: AbstractClient) -> None:
-        """Inserts a client to the front of the client registry. Temporary
-        function prior to the addition of a proper client manager."""
-
-        self.client = {
-                client.id: client
-        } | self.client
@@ -1,101 +1,333 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import (
     Any,
     TypeVar,
     Optional,
     Generic,
     Union,
+    Iterable,
+    Callable,
 )
-import asyncio
+import weakref
+import sys
+import time
 
 T = TypeVar("T")
 ALLOWED_IDX = Union[int, str, tuple[Any, ...]]
 
+class _Sentinel:
+    """A unique marker object used for signalling special cache states."""
+
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __repr__(self) -> str:
+        return f"<{self._name}>"
+
+    def __bool__(self) -> bool:
+        return False
+
+# Returned by `LRUCache.lookup` when there is no entry for a key.
+MISS = _Sentinel("MISS")
+# Stored (and returned by `LRUCache.lookup`) for keys known not to exist.
+NEGATIVE = _Sentinel("NEGATIVE")
+
+@dataclass
+class CacheStats:
+    """A snapshot of the statistics of an `LRUCache`."""
+
+    size: int
+    bytes: int
+    hits: int
+    negative_hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+    @property
+    def hit_rate(self) -> float:
+        """The ratio of lookups that were served from the cache (including
+        negative hits)."""
+
+        total = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / total if total else 0.0
+
+# Every cache that has not yet been garbage collected, for memory reports.
+_live_caches: "weakref.WeakSet[LRUCache]" = weakref.WeakSet()
+
+def live_caches() -> list["LRUCache"]:
+    """Returns all of the caches currently alive."""
+
+    return list(_live_caches)
+
 class LRUCache(Generic[T]):
-    """A thread-safe implementation of an LRU (least recently used) cache,
-    managing a max capacity and dropping the least recently used items."""
+    """An implementation of an LRU (least recently used) cache, managing a max
+    capacity and dropping the least recently used items.
+
+    Supports per-entry expiry, negative caching (remembering that a key does
+    not exist) and an optional capacity in approximate bytes alongside the
+    entry count.
+
+    Note:
+        All operations are synchronous and do not acquire any locks. The cache
+        is safe to use from a single event loop but is not thread-safe.
+    """
+
+    __slots__ = (
+        "_capacity",
+        "_max_bytes",
+        "_ttl",
+        "_sizeof",
+        "_cache",
+        "_bytes",
+        "hits",
+        "negative_hits",
+        "misses",
+        "evictions",
+        "expirations",
+        "name",
+        "__weakref__",
+    )
+
+    def __init__(self, capacity: int, *, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 sizeof: Callable[[Any], int] = sys.getsizeof,
+                 name: Optional[str] = None) -> None:
+        """Creates an empty cache holding at most `capacity` entries.
+
+        Args:
+            capacity (int): The maximum number of entries stored.
+            max_bytes (int, optional): The maximum approximate size of all
+                stored values, measured using `sizeof`.
+            ttl (float, optional): The default time in seconds after which
+                an entry expires. `None` means entries never expire.
+            sizeof (Callable): Function used to approximate the size of a value.
+            name (str, optional): A name to identify the cache by in memory
+                reports.
+        """
 
-    def __init__(self, capacity: int) -> None:
         # Check we arent stupid and end up in a loop.
         assert capacity > 2, "A cache may have a minimum value of 3."
 
         self._capacity = capacity
-        self._cache: dict[ALLOWED_IDX, T] = {}
-        self._lock = asyncio.Lock()
-    
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        # key: (value, expiry timestamp or None, approximate size)
+        self._cache: OrderedDict[ALLOWED_IDX, tuple[T, Optional[float], int]] = OrderedDict()
+        self._bytes = 0
+
+        # Statistics.
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self.name = name
+        _live_caches.add(self)
+
     # Python "special" functions.
     def __len__(self) -> int:
         """Returns how many items are currently stored within the cache."""
 
-        # I don't think this requires a lock as it doesn't deal with the data.
         return len(self._cache)
-    
+
+    def __contains__(self, key: ALLOWED_IDX) -> bool:
+        """Checks if a non-expired entry exists for `key` without affecting
+        the entry ordering or statistics."""
+
+        entry = self._cache.get(key)
+        return entry is not None and not _is_expired(entry[1])
+
     def __repr__(self) -> str:
         return f"<LRUCache({len(self)}/{self._capacity})>"
-    
-    # Cache related private function (mainly ones that dont acquire the lock)
+
+    # Properties.
+    @property
+    def bytes(self) -> int:
+        """The approximate size of all values stored in the cache."""
+
+        return self._bytes
+
+    @property
+    def stats(self) -> CacheStats:
+        """Returns a snapshot of the current cache statistics."""
+
+        return CacheStats(
+            size= len(self),
+            bytes= self._bytes,
+            hits= self.hits,
+            negative_hits= self.negative_hits,
+            misses= self.misses,
+            evictions= self.evictions,
+            expirations= self.expirations,
+        )
+
+    # Cache related private function.
     def __clear_till_capacity_met(self) -> None:
         """Removes items from the front of the cache until the capacity is left."""
 
-        c_iter = self._cache.__iter__()
-        while len(self) > self._capacity:
-            # Iterator hack to allow us to remove the first index efficiently.
-            self.__drop(next(c_iter))
-        
-    def __insert(self, key: ALLOWED_IDX, val: T, ignore_cap_check: bool = False) -> None:
-        """Inserts an object `T` with the index `key`. Handling removing excess items."""
+        while len(self._cache) > self._capacity or (
+            self._max_bytes is not None and self._bytes > self._max_bytes
+            and self._cache
+        ):
+            _, (_, _, size) = self._cache.popitem(last= False)
+            self._bytes -= size
+            self.evictions += 1
 
-        self._cache[key] = val
-        if not ignore_cap_check: self.__clear_till_capacity_met()
-    
-    def __fetch(self, key: ALLOWED_IDX) -> Optional[T]:
-        """Retrieves a cache entry with the given result. If found, moves
-        the entry to the front of the cache, else returns `None`."""
+    def __insert(self, key: ALLOWED_IDX, val: T, ttl: Optional[float]) -> None:
+        """Inserts an object `T` with the index `key`, without performing
+        capacity maintenence."""
 
-        val = self._cache.pop(key, None)
+        if (old := self._cache.pop(key, None)) is not None:
+            self._bytes -= old[2]
 
-        if val is None: return
+        ttl = self._ttl if ttl is None else ttl
+        expiry = time.monotonic() + ttl if ttl is not None else None
+        size = self._sizeof(val) \
+            if self._max_bytes is not None and val is not NEGATIVE else 0
 
-        # Move to front by reinserting to make this a LRU cache.
-        self.__insert(key, val, True)
+        self._cache[key] = (val, expiry, size)
+        self._bytes += size
 
-        return val
-    
     def __drop(self, key: ALLOWED_IDX) -> None:
         """Drops an item with index from the cache. Assumes the key 100%
         exists in the cache."""
 
-        del self._cache[key]
-    
-    # Public functions (acquire lock)
-    async def insert(self, key: ALLOWED_IDX, val: T) -> None:
+        _, _, size = self._cache.pop(key)
+        self._bytes -= size
+
+    # Public functions.
+    def lookup(self, key: ALLOWED_IDX) -> Union[T, _Sentinel]:
+        """Retrieves the cache entry located at the index `key`, moving it to
+        the front of the cache.
+
+        Returns:
+            The cached value if found.
+            `NEGATIVE` if the key has been cached as non-existent.
+            `MISS` if there is no (non-expired) entry.
+        """
+
+        entry = self._cache.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return MISS
+
+        val, expiry, _ = entry
+        if _is_expired(expiry):
+            self.__drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return MISS
+
+        self._cache.move_to_end(key)
+        if val is NEGATIVE:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return val
+
+    def fetch(self, key: ALLOWED_IDX, default: Optional[T] = None) -> Optional[T]:
+        """Retrieves a cache entry located at the index `key`. If not found (or
+        cached as non-existent), returns `default`."""
+
+        val = self.lookup(key)
+        return default if isinstance(val, _Sentinel) else val
+
+    def insert(self, key: ALLOWED_IDX, val: T, ttl: Optional[float] = None) -> None:
         """Inserts the object `val` at the index `key` of the cache, performing
         cache maintenence in the process.
-        
-        Note:
-            Acquires the cache lock.
-        """
 
-        async with self._lock:
-            self.__insert(key, val)
-    
-    async def fetch(self, key: ALLOWED_IDX) -> Optional[T]:
-        """Retrieves a cache entry located at the index `key`. If not found,
-        returns `None`.
-        
-        Note:
-            Acquires the cache lock.
+        Args:
+            ttl (float, optional): Overrides the cache's default time in
+                seconds until the entry expires.
         """
 
-        async with self._lock:
-            return self.__fetch(key)
-    
-    async def drop(self, key: ALLOWED_IDX) -> None:
+        self.__insert(key, val, ttl)
+        self.__clear_till_capacity_met()
+
+    def insert_negative(self, key: ALLOWED_IDX, ttl: Optional[float] = None) -> None:
+        """Caches the fact that `key` does not exist, making `lookup` return
+        `NEGATIVE` for it."""
+
+        self.insert(key, NEGATIVE, ttl)
+
+    def drop(self, key: ALLOWED_IDX) -> None:
         """Drops an entry with the index `key` if present.
-        
+
         Note:
-            Acquires the cache lock.
             Raises `KeyError` if the entry does not exist.
         """
 
-        async with self._lock:
-            return self.__drop(key)
+        self.__drop(key)
+
+    def discard(self, key: ALLOWED_IDX) -> bool:
+        """Drops an entry with the index `key` if present, returning whether
+        an entry was removed."""
+
+        if key not in self._cache:
+            return False
+
+        self.__drop(key)
+        return True
+
+    def fetch_many(self, keys: Iterable[ALLOWED_IDX]) -> dict[ALLOWED_IDX, T]:
+        """Retrieves all cache entries present for the given `keys`, returning
+        a dictionary of the hits. Missing and negative keys are not included."""
+
+        return {
+            key: val for key in keys
+            if not isinstance(val := self.lookup(key), _Sentinel)
+        }
+
+    def insert_many(self, items: dict[ALLOWED_IDX, T],
+                    ttl: Optional[float] = None) -> None:
+        """Inserts all of the key-value pairs in `items` into the cache,
+        performing cache maintenence once after the batch."""
+
+        for key, val in items.items():
+            self.__insert(key, val, ttl)
+        self.__clear_till_capacity_met()
+
+    def expire(self) -> int:
+        """Removes all expired entries from the cache, returning the number
+        of entries removed.
+
+        Note:
+            Expired entries are otherwise removed lazily upon lookup. This
+            iterates the entire cache.
+        """
+
+        now = time.monotonic()
+        expired = [
+            key for key, (_, expiry, _) in self._cache.items()
+            if expiry is not None and expiry <= now
+        ]
+
+        for key in expired:
+            self.__drop(key)
+
+        self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self) -> None:
+        """Removes all of the entries from the cache."""
+
+        self._cache.clear()
+        self._bytes = 0
+
+    def reset_stats(self) -> None:
+        """Resets all of the hit, miss and eviction counters."""
+
+        self.hits = self.negative_hits = self.misses = 0
+        self.evictions = self.expirations = 0
+
+def _is_expired(expiry: Optional[float]) -> bool:
+    """Checks if an entry with the given `expiry` timestamp has expired."""
+
+    return expiry is not None and expiry <= time.monotonic()
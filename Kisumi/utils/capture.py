@@ -0,0 +1,311 @@
+# Recording of bancho traffic into an append-only binary log, to be replayed
+# by `tools.replay`.
+#
+# Format (all little endian):
+#   b"KCAP", u8 version
+#   Repeated records, each prefixed by its u32 length:
+#       i64 time (unix microseconds), u32 handling time (microseconds),
+#       u8 header count, (str name, str value) headers,
+#       u32 body length, body,
+#       str response token ("" for none),
+#       u32 response length, response
+#   Strings are osu! strings (`BinaryWriter.write_str`).
+#
+# Secrets are never recorded: session tokens are replaced by a digest (still
+# grouping the requests of a session), and login passwords are blanked.
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Iterator,
+    Optional,
+)
+from packets.writer import BinaryWriter
+from packets.reader import BinaryReader
+from logger import info, warning, error
+from . import metrics
+import traceback
+import threading
+import hashlib
+import struct
+import queue
+import zlib
+
+_CAPTURE_MAGIC = b"KCAP"
+_CAPTURE_VERSION = 1
+_RECORD_LENGTH = struct.Struct("<I")
+
+# The headers holding session tokens, redacted before recording.
+_TOKEN_HEADERS = frozenset((
+    "osu-token",
+    "cho-token",
+))
+
+# The maximum number of records written by the capture thread at once.
+_BATCH_SIZE = 256
+
+_RECORDS = metrics.counter(
+    "kisumi_capture_records_total",
+    "Bancho requests recorded by the traffic capture.",
+)
+_RECORDS_DROPPED = metrics.counter(
+    "kisumi_capture_dropped_total",
+    "Bancho requests not recorded as the capture fell behind.",
+)
+
+@dataclass
+class CapturedRequest:
+    """A single recorded bancho request alongside its response."""
+
+    time: float
+    elapsed: float
+    headers: dict[str, str]
+    body: bytes
+    token: Optional[str]
+    response: bytes
+
+    @property
+    def request_token(self) -> Optional[str]:
+        """The session token sent with the request (`None` for logins)."""
+
+        return self.headers.get("osu-token")
+
+# A queued record of (time, elapsed, headers, body, token, response).
+_Record = tuple[float, float, list[tuple[str, str]], bytes, Optional[str], bytes]
+
+def _redact_token(token: str) -> str:
+    """Replaces a session token with a digest of it, which identifies the
+    session without being usable to impersonate it."""
+
+    return "redacted:" + hashlib.blake2b(token.encode(), digest_size= 8).hexdigest()
+
+def _redact_login(body: bytes) -> bytes:
+    """Blanks the password (the second line) of a login body."""
+
+    username, sep, rest = body.partition(b"\n")
+    if not sep:
+        return body
+
+    _, sep, rest = rest.partition(b"\n")
+    return username + b"\n" + sep + rest
+
+def _encode_record(record: _Record) -> bytes:
+    t, elapsed, headers, body, token, response = record
+    # The count is stored as a u8, no legitimate client sends this many.
+    headers = [
+        (name, _redact_token(value) if name.lower() in _TOKEN_HEADERS else value)
+        for name, value in headers[:0xFF]
+    ]
+    # Logins are the only requests without a session token.
+    if not any(name.lower() == "osu-token" for name, _ in headers):
+        body = _redact_login(body)
+    if token:
+        token = _redact_token(token)
+
+    writer = BinaryWriter(pralloc_header= False)
+    writer.write_i64(int(t * 1e+6)) \
+        .write_u32(min(int(elapsed * 1e+6), 0xFFFFFFFF)) \
+        .write_u8(len(headers))
+    for name, value in headers:
+        writer.write_str(name).write_str(value)
+    (
+        writer.write_u32(len(body))
+            .write_raw(body)
+            .write_str(token or "")
+            .write_u32(len(response))
+            .write_raw(response)
+    )
+
+    buffer = writer.buffer
+    return _RECORD_LENGTH.pack(len(buffer)) + buffer
+
+def _decode_record(data: bytes) -> CapturedRequest:
+    reader = BinaryReader(data)
+    t = reader.read_i64() / 1e+6
+    elapsed = reader.read_u32() / 1e+6
+    headers = {
+        reader.read_str(): reader.read_str()
+        for _ in range(reader.read_u8())
+    }
+    body = bytes(reader.read_bytes(reader.read_u32()))
+    token = reader.read_str() or None
+    response = bytes(reader.read_bytes(reader.read_u32()))
+
+    return CapturedRequest(t, elapsed, headers, body, token, response)
+
+class TrafficCapture:
+    """Appends bancho requests and responses to a capture file from a
+    background thread, so that disk writes never stall the event loop.
+
+    Note:
+        Sampling is decided per session (by its token), so a sampled session
+            is recorded in full from its login onwards.
+        Records are dropped (and counted) rather than blocking the caller
+            once the queue is full.
+        Records are redacted by the capture thread, see `_encode_record`.
+    """
+
+    __slots__ = (
+        "path",
+        "sample_rate",
+        "_threshold",
+        "_queue",
+        "_stream",
+        "_thread",
+        "records",
+        "dropped",
+    )
+
+    def __init__(self, path: Path, sample_rate: float = 1.0,
+                 max_queue: int = 8192) -> None:
+        """Opens the capture file, raising `OSError` if it can not be."""
+
+        self.path = path
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        # Sessions whose key hashes below this are sampled.
+        self._threshold = int(self.sample_rate * 0xFFFFFFFF)
+        self._queue: queue.Queue[Optional[_Record]] = queue.Queue(max_queue)
+        self.records = 0
+        self.dropped = 0
+
+        # Opened here so that failures reach the caller.
+        self._stream = open(path, "ab")
+        try:
+            if not self._stream.tell():
+                self._stream.write(_CAPTURE_MAGIC + bytes((_CAPTURE_VERSION,)))
+        except OSError:
+            self._stream.close()
+            raise
+
+        self._thread = threading.Thread(
+            target= self.__run,
+            name= "kisumi-capture",
+            daemon= True,
+        )
+        self._thread.start()
+
+    # Public methods.
+    def sampled(self, key: bytes) -> bool:
+        """Checks whether the session identified by `key` (its token, or the
+        body of a failed login) is recorded."""
+
+        return zlib.crc32(key) <= self._threshold
+
+    def record(self, t: float, elapsed: float, headers: list[tuple[str, str]],
+               body: bytes, token: Optional[str], response: bytes) -> None:
+        """Queues a request to be recorded."""
+
+        # Stopped by a write error.
+        if not self._thread.is_alive():
+            self.dropped += 1
+            _RECORDS_DROPPED.inc()
+            return
+
+        try:
+            self._queue.put_nowait((t, elapsed, headers, body, token, response))
+        except queue.Full:
+            self.dropped += 1
+            _RECORDS_DROPPED.inc()
+
+    def close(self) -> None:
+        """Writes all of the queued records and stops the capture thread."""
+
+        # The thread may have stopped on a write error, leaving the queue
+        # full with nothing to empty it.
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout= 0.1)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+
+    # Private methods.
+    def __run(self) -> None:
+        try:
+            self.__write_records()
+        except Exception:
+            error("The traffic capture failed writing to %s!\n%s",
+                  self.path, traceback.format_exc())
+        finally:
+            self._stream.close()
+
+    def __write_records(self) -> None:
+        stream = self._stream
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+
+            stream.write(b"".join(map(_encode_record, batch)))
+            stream.flush()
+            self.records += len(batch)
+            _RECORDS.inc(len(batch))
+
+_capture: Optional[TrafficCapture] = None
+
+def start(path: Path, sample_rate: float = 1.0) -> TrafficCapture:
+    """Starts capturing bancho traffic into `path`, appending if it exists.
+
+    Note:
+        Raises `RuntimeError` if a capture is already running, or `OSError`
+            if `path` can not be opened.
+    """
+
+    global _capture
+
+    if _capture is not None:
+        raise RuntimeError("A traffic capture is already running!")
+
+    _capture = TrafficCapture(path, sample_rate)
+    info("Capturing %.0f%% of bancho sessions into %s.", sample_rate * 100, path)
+    return _capture
+
+def stop() -> Optional[TrafficCapture]:
+    """Stops the running capture (if any), returning it once all of its
+    records are written."""
+
+    global _capture
+
+    capture, _capture = _capture, None
+    if capture is not None:
+        capture.close()
+        info("Stopped the traffic capture after %d requests.", capture.records)
+        if capture.dropped:
+            warning("The traffic capture dropped %d requests.", capture.dropped)
+    return capture
+
+def current() -> Optional[TrafficCapture]:
+    """Returns the running capture, or `None` if traffic is not captured."""
+
+    return _capture
+
+def read_capture(path: Path) -> Iterator[CapturedRequest]:
+    """Reads the requests recorded in the capture file at `path`, in order.
+
+    Note:
+        Raises `ValueError` if the file is not a capture.
+        A truncated final record (eg from a crash) is ignored.
+    """
+
+    with open(path, "rb") as stream:
+        head = stream.read(len(_CAPTURE_MAGIC) + 1)
+        if head[:-1] != _CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a Kisumi traffic capture.")
+        if head[-1] != _CAPTURE_VERSION:
+            raise ValueError(f"Unsupported capture version {head[-1]}.")
+
+        while len(length := stream.read(_RECORD_LENGTH.size)) == _RECORD_LENGTH.size:
+            size, = _RECORD_LENGTH.unpack(length)
+            if len(data := stream.read(size)) < size:
+                warning("Ignoring the truncated final record of %s.", path)
+                return
+
+            yield _decode_record(data)
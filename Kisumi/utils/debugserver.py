@@ -0,0 +1,64 @@
+# A secondary HTTP server for debugging tools, ran alongside the main server.
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from logger import info
+import asyncio
+import uvicorn
+
+class _EmbeddedServer(uvicorn.Server):
+    """A uvicorn server that leaves signal handling to the main server."""
+
+    def install_signal_handlers(self) -> None:
+        pass
+
+    @contextmanager
+    def capture_signals(self) -> Iterator[None]:
+        yield
+
+class DebugServer:
+    """Serves an ASGI app within the already running event loop.
+
+    Note:
+        Only ever bind this to a loopback address. It exposes functionality
+            which should never be public.
+    """
+
+    __slots__ = (
+        "_app",
+        "_host",
+        "_port",
+        "_server",
+        "_task",
+    )
+
+    def __init__(self, app, port: int, host: str = "127.0.0.1") -> None:
+        self._app = app
+        self._host = host
+        self._port = port
+        self._server: Optional[_EmbeddedServer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Starts serving in a background task."""
+
+        self._server = _EmbeddedServer(uvicorn.Config(
+            self._app,
+            host= self._host,
+            port= self._port,
+            log_level= "warning",
+        ))
+        self._task = asyncio.create_task(
+            self._server.serve(),
+            name= "debug-server",
+        )
+        info("Debug server listening on %s:%d.", self._host, self._port)
+
+    async def stop(self) -> None:
+        """Shuts the server down, waiting for it to exit."""
+
+        if self._task is None:
+            return
+
+        self._server.should_exit = True
+        await self._task
+        self._task = None
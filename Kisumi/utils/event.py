@@ -1,63 +1,294 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
 from typing import (
     Any,
-    Union,
     Awaitable,
     Callable,
+    Hashable,
+    Optional,
 )
+from logger import error, warning
+from . import metrics
+import traceback
+import weakref
 import asyncio
 
-Subcribable = Union[
-    Awaitable,
-    Callable[[Any], Awaitable]
-]
+SubscriberFunc = Callable[..., Awaitable[Any]]
+CoalesceKeyFunc = Callable[..., Hashable]
+
+_SUBSCRIBER_ERRORS = metrics.counter(
+    "kisumi_event_subscriber_errors_total",
+    "Event subscribers which failed or timed out, by event.",
+    labels= ("event", "reason"),
+)
+_EVENTS_DROPPED = metrics.counter(
+    "kisumi_events_dropped_total",
+    "Events dropped as their queue was full, by event.",
+    labels= ("event",),
+)
+
+# The event dispatched by the current worker, inherited by its subscribers.
+_dispatching: ContextVar[Optional["Event"]] = ContextVar(
+    "dispatching",
+    default= None,
+)
+
+@dataclass
+class _Subscriber:
+    func: SubscriberFunc
+    timeout: Optional[float]
 
 class Event:
-    """A subscribable internal event hook allowing for subscribe and 
-    publish events."""
+    """A subscribable internal event hook. Published events are queued and
+    dispatched by worker tasks, running all subscribers concurrently.
+
+    Note:
+        A failing or timed out subscriber is logged and does not affect the
+            other subscribers.
+        Once `max_queue` events are waiting, `call` waits for space
+            (backpressure) while `call_nowait` drops the event.
+        With `coalesce`, events with the same key that are still queued
+            are merged, only dispatching the most recent arguments.
+        Subscribers publishing to their own event never wait for space, as
+            they would be waiting on themselves. `call` drops the event
+            instead, as `call_nowait` does.
+        Events published after the event is closed are dropped.
+    """
 
     __slots__ = (
-        "_sub_awaitables",
-        "_sub_corofunc",
+        "name",
+        "_subscribers",
+        "_timeout",
+        "_coalesce",
+        "_pending",
+        "_queue",
+        "_max_queue",
+        "_worker_count",
+        "_workers",
+        "_closed",
+        "__weakref__",
     )
 
-    def __init__(self) -> None:
-        """Initialises a default event."""
+    def __init__(self, name: str = "event", *, max_queue: int = 1024,
+                 workers: int = 1, timeout: Optional[float] = 5.0,
+                 coalesce: Optional[CoalesceKeyFunc] = None) -> None:
+        """Initialises an event without any subscribers.
+
+        Args:
+            name (str): The name of the event used in logs and metrics.
+            max_queue (int): The maximum number of events waiting to be
+                dispatched.
+            workers (int): The number of events dispatched at once. With a
+                single worker, events are dispatched in order.
+            timeout (float, optional): The default time in seconds each
+                subscriber is given. `None` means no timeout.
+            coalesce (Callable, optional): Function creating a key from the
+                event arguments, by which queued events are merged.
+        """
+
+        assert workers > 0, "An event requires at least one worker."
+
+        self.name = name
+        self._subscribers: list[_Subscriber] = []
+        self._timeout = timeout
+        self._coalesce = coalesce
+        # Coalescing queues keys, with their latest arguments stored here.
+        self._pending: dict[Hashable, tuple[Any, ...]] = {}
+        # Created lazily as it has to be created inside of the event loop.
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_queue = max_queue
+        self._worker_count = workers
+        self._workers: list[asyncio.Task] = []
+        self._closed = False
+
+        _events.add(self)
+
+    def __len__(self) -> int:
+        """Returns the number of subscribers."""
 
-        self._sub_awaitables = []
-        self._sub_corofunc = []
-    
-    def subscribe(self, hook: Subcribable) -> None:
-        """Subscribes a coroutine function or an awaitable to the event."""
+        return len(self._subscribers)
 
-        if asyncio.iscoroutinefunction(hook):
-            self._sub_corofunc.append(hook)
-        elif asyncio.iscoroutine(hook):
-            self._sub_awaitables.append(hook)
-        else:
+    @property
+    def pending(self) -> int:
+        """The number of events waiting to be dispatched."""
+
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # Public methods.
+    def subscribe(self, hook: SubscriberFunc,
+                  timeout: Optional[float] = ...) -> None:
+        """Subscribes a coroutine function to the event, optionally overriding
+        the default subscriber `timeout`.
+
+        Note:
+            Raises `TypeError` for anything but coroutine functions. A bare
+                coroutine may only be awaited once, so could only ever
+                handle a single event.
+        """
+
+        if asyncio.iscoroutine(hook):
             raise TypeError(
-                "Hook must be coroutine or coroutine function!"
+                "Coroutines may only be awaited once! Subscribe the coroutine "
+                "function instead."
             )
-    
-    async def sync_call(self, *args) -> None:
-        """Sequentially calls all of the subscribed events, waiting for
-        all to finish. Calls all coro funcs with `*args` as arguments.
-        
-        Note:
-            Coroutine functions are executed first.
+        if not asyncio.iscoroutinefunction(hook):
+            raise TypeError("Hook must be a coroutine function!")
+
+        self._subscribers.append(_Subscriber(
+            func= hook,
+            timeout= self._timeout if timeout is ... else timeout,
+        ))
+
+    def unsubscribe(self, hook: SubscriberFunc) -> bool:
+        """Unsubscribes `hook` from the event, returning whether it was
+        subscribed."""
+
+        for sub in self._subscribers:
+            if sub.func == hook:
+                self._subscribers.remove(sub)
+                return True
+        return False
+
+    async def call(self, *args) -> None:
+        """Queues the event to be dispatched with `*args` as arguments,
+        waiting for space in the queue if full."""
+
+        if _dispatching.get() is self:
+            if not self.call_nowait(*args):
+                warning("Dropped a %s event published by its own subscriber "
+                        "as the queue is full.", self.name)
+            return
+
+        if self.__closed():
+            return
+
+        if (item := self.__prepare(args)) is not None:
+            await self._queue.put(item)
+
+    def call_nowait(self, *args) -> bool:
+        """Queues the event to be dispatched with `*args` as arguments,
+        dropping it if the queue is full.
+
+        Returns:
+            Whether the event was queued (or coalesced).
         """
 
-        for coro_func in self._sub_corofunc:
-            await coro_func(*args)
-        
-        for coro in self._sub_awaitables:
-            await coro
-    
-    async def call(self, *args) -> Awaitable[None]:
-        """Creates a new task on the current running loop and runs
-        `Event.sync_call`."""
+        if self.__closed():
+            return False
+
+        if (item := self.__prepare(args)) is None:
+            return True
+
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.__unprepare(item)
+            _EVENTS_DROPPED.labels(self.name).inc()
+            return False
+
+    async def sync_call(self, *args) -> None:
+        """Dispatches the event immediately, bypassing the queue and waiting
+        for all subscribers to finish."""
+
+        await self.__dispatch(args)
+
+    async def join(self) -> None:
+        """Waits for all queued events to be dispatched."""
+
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Stops accepting new events, waiting up to `timeout` seconds for
+        the queued events to be dispatched before cancelling the workers."""
+
+        self._closed = True
+        if self._queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            warning("Dropping %d queued %s events on close.", self.pending, self.name)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions= True)
+        self._workers.clear()
 
-        loop = asyncio.get_running_loop()
+    # Private methods.
+    def __closed(self) -> bool:
+        """Checks whether the event was closed, logging the dropped event."""
 
-        loop.create_task(
-            self.sync_call(*args),
+        if self._closed:
+            _EVENTS_DROPPED.labels(self.name).inc()
+            warning("Dropped a %s event published after it was closed.", self.name)
+        return self._closed
+
+    def __prepare(self, args: tuple[Any, ...]) -> Optional[Any]:
+        """Starts the workers if required, returning the item to be queued
+        or `None` if the event was coalesced with a queued one."""
+
+        if self._queue is None:
+            self.__start()
+
+        if self._coalesce is None:
+            return args
+
+        key = self._coalesce(*args)
+        coalesced = key in self._pending
+        self._pending[key] = args
+        return None if coalesced else key
+
+    def __unprepare(self, item: Any) -> None:
+        """Reverts `__prepare` for an item that could not be queued."""
+
+        if self._coalesce is not None:
+            del self._pending[item]
+
+    def __start(self) -> None:
+        self._queue = asyncio.Queue(self._max_queue)
+        self._workers = [
+            asyncio.create_task(
+                self.__worker(),
+                name= f"event:{self.name}:{idx}",
+            )
+            for idx in range(self._worker_count)
+        ]
+
+    async def __worker(self) -> None:
+        _dispatching.set(self)
+        while True:
+            item = await self._queue.get()
+            try:
+                args = self._pending.pop(item) if self._coalesce is not None \
+                    else item
+                await self.__dispatch(args)
+            finally:
+                self._queue.task_done()
+
+    async def __dispatch(self, args: tuple[Any, ...]) -> None:
+        await asyncio.gather(
+            *(self.__run_subscriber(sub, args) for sub in self._subscribers),
         )
+
+    async def __run_subscriber(self, sub: _Subscriber, args: tuple[Any, ...]) -> None:
+        try:
+            await asyncio.wait_for(sub.func(*args), sub.timeout)
+        except asyncio.TimeoutError:
+            _SUBSCRIBER_ERRORS.labels(self.name, "timeout").inc()
+            error("Subscriber %s of %s timed out after %ss.",
+                  sub.func.__qualname__, self.name, sub.timeout)
+        except Exception:
+            _SUBSCRIBER_ERRORS.labels(self.name, "exception").inc()
+            error("Subscriber %s of %s raised an exception!\n%s",
+                  sub.func.__qualname__, self.name, traceback.format_exc())
+
+# All events, so they may all be closed at shutdown.
+_events: "weakref.WeakSet[Event]" = weakref.WeakSet()
+
+async def close_all(timeout: float = 5.0) -> None:
+    """Closes every event, dispatching the queued events first."""
+
+    await asyncio.gather(*(event.close(timeout) for event in list(_events)))
@@ -0,0 +1,22 @@
+# Inspection of the stacks of other threads, as captured by
+# `sys._current_frames`.
+from types import FrameType
+from typing import Optional
+import inspect
+
+def task_frame(frame: Optional[FrameType]) -> Optional[FrameType]:
+    """Returns the frame of the coroutine of the asyncio task running in the
+    stack ending at `frame`, being its outermost coroutine frame. `None` if
+    no task is running (eg a callback).
+
+    Note:
+        Used to find the running task from other threads, as the asyncio
+            task APIs may only be used from the loop thread.
+    """
+
+    outermost = None
+    while frame is not None:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE:
+            outermost = frame
+        frame = frame.f_back
+    return outermost
@@ -1,7 +1,21 @@
-import bcrypt
+from .lazy import lazy_import
+from . import metrics
 import hashlib
 import asyncio
 
+bcrypt = lazy_import("bcrypt")
+
+# BCrypt computations are slow by design and share the default executor.
+_BCRYPT_IN_FLIGHT = metrics.gauge(
+    "kisumi_bcrypt_in_flight",
+    "BCrypt computations queued or running in the loop executor.",
+)
+_BCRYPT_SECONDS = metrics.histogram(
+    "kisumi_bcrypt_seconds",
+    "Time taken by BCrypt computations, including executor queueing.",
+    labels= ("operation",),
+)
+
 PW_PREFIX = "$2b$10$"
 
 class BCryptPassword:
@@ -105,11 +119,13 @@ class BCryptPassword:
         # Make run in executor code snipped into a utils function.
         loop = asyncio.get_running_loop()
 
-        return await loop.run_in_executor(
-            None,
-            self.__compare,
-            bc,
-        )
+        with _BCRYPT_IN_FLIGHT.track_in_progress(), \
+            _BCRYPT_SECONDS.labels("compare").time():
+            return await loop.run_in_executor(
+                None,
+                self.__compare,
+                bc,
+            )
 
 def hash_bcrypt(password: str) -> bytes:
     """Hashes a password using the bcrypt hash, removing the first 7 bytes
@@ -125,11 +141,13 @@ async def hash_bcrypt_async(password: str) -> bytes:
 
     loop = asyncio.get_running_loop()
 
-    return await loop.run_in_executor(
-        None,
-        hash_bcrypt,
-        password,
-    )
+    with _BCRYPT_IN_FLIGHT.track_in_progress(), \
+        _BCRYPT_SECONDS.labels("hash").time():
+        return await loop.run_in_executor(
+            None,
+            hash_bcrypt,
+            password,
+        )
 
 def hash_md5(text: str) -> str:
     """Hashes `text` into 16bit hexdigested MD5."""
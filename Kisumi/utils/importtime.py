@@ -0,0 +1,134 @@
+# A report of per-module import costs, parsed from `python -X importtime`.
+#
+# Usage (from the Kisumi directory):
+#   python -m utils.importtime [module] [--top N] [--json PATH]
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+import argparse
+import json
+import subprocess
+import sys
+
+_LINE_PREFIX = "import time:"
+
+@dataclass
+class ImportCost:
+    """The cost of importing a single module."""
+
+    name: str
+    # Time spent importing the module itself, excluding its imports.
+    self_us: int
+    # Time spent importing the module alongside all of its imports.
+    cumulative_us: int
+    # How deeply nested the import was.
+    depth: int
+
+    @property
+    def package(self) -> str:
+        """The top level package the module belongs to."""
+
+        return self.name.split(".", 1)[0]
+
+def parse_importtime(output: str) -> list[ImportCost]:
+    """Parses the stderr output of `python -X importtime` into a list of
+    import costs, in the order they were imported."""
+
+    res = []
+
+    for line in output.splitlines():
+        if not line.startswith(_LINE_PREFIX):
+            continue
+
+        try:
+            self_us, cumulative_us, raw_name = line[len(_LINE_PREFIX):].split("|")
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            # The table header.
+            continue
+
+        # Each level of nesting is indented by 2 spaces after the separator.
+        name = raw_name.strip()
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+
+        res.append(ImportCost(
+            name= name,
+            self_us= self_us,
+            cumulative_us= cumulative_us,
+            depth= depth,
+        ))
+
+    return res
+
+def measure(module: str = "main", cwd: Optional[Path] = None) -> tuple[
+    list[ImportCost], int
+]:
+    """Imports `module` in a fresh interpreter with `-X importtime` enabled.
+
+    Returns:
+        Tuple of the import costs and the exit code of the interpreter.
+    """
+
+    proc = subprocess.run(
+        (sys.executable, "-X", "importtime", "-c", f"import {module}"),
+        cwd= cwd or Path(__file__).parent.parent,
+        capture_output= True,
+        text= True,
+    )
+
+    return parse_importtime(proc.stderr), proc.returncode
+
+def package_totals(costs: list[ImportCost]) -> dict[str, int]:
+    """Sums the self import time (in microseconds) by top level package,
+    sorted from most to least expensive."""
+
+    totals: dict[str, int] = {}
+    for cost in costs:
+        totals[cost.package] = totals.get(cost.package, 0) + cost.self_us
+
+    return dict(sorted(totals.items(), key= lambda t: t[1], reverse= True))
+
+def main(argv: list[str]) -> int:
+    """Prints the import cost report for a module."""
+
+    parser = argparse.ArgumentParser(
+        description= "Reports the per-module import cost of a Kisumi module.",
+    )
+    parser.add_argument("module", nargs= "?", default= "main")
+    parser.add_argument("--top", type= int, default= 25)
+    parser.add_argument("--json", type= Path, default= None,
+                        help= "Additionally write the full report to this path.")
+    args = parser.parse_args(argv)
+
+    costs, code = measure(args.module)
+    if not costs:
+        print(f"No import data was collected (exit code {code}).")
+        return 1
+
+    total_us = sum(cost.self_us for cost in costs)
+    print(f"Importing {args.module} took {total_us / 1e+3:.2f}ms across "
+          f"{len(costs)} modules (exit code {code}).\n")
+
+    print(f"{'self (ms)':>10} {'cumulative (ms)':>16}  module")
+    for cost in sorted(costs, key= lambda c: c.self_us, reverse= True)[:args.top]:
+        print(f"{cost.self_us / 1e+3:>10.2f} {cost.cumulative_us / 1e+3:>16.2f}  {cost.name}")
+
+    print(f"\n{'self (ms)':>10}  package")
+    for package, self_us in list(package_totals(costs).items())[:args.top]:
+        print(f"{self_us / 1e+3:>10.2f}  {package}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps({
+            "module": args.module,
+            "exit_code": code,
+            "total_us": total_us,
+            "packages": package_totals(costs),
+            "modules": [asdict(cost) for cost in costs],
+        }, indent= 4))
+
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(
+        main(sys.argv[1:])
+    )
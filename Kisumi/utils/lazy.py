@@ -0,0 +1,69 @@
+# Deferred importing of heavy, optional modules.
+from types import ModuleType
+import importlib
+import os
+import sys
+
+# When enabled, lazily imported modules are only imported upon first use.
+# Otherwise, the server imports them all while starting up.
+LAZY_IMPORTS = "lazy-imports" in sys.argv \
+    or os.environ.get("KISUMI_LAZY_IMPORTS", "").lower() in ("1", "true")
+
+class LazyModule(ModuleType):
+    """A placeholder for a module which is imported on the first attribute
+    access, after which it behaves exactly as the module does."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_module"] else "deferred"
+        return f"<LazyModule({self.__name__}, {state})>"
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not already copied over.
+        return getattr(self._load(), attr)
+
+    def _load(self) -> ModuleType:
+        """Imports the underlying module if not yet imported, returning it."""
+
+        if (module := self.__dict__["_lazy_module"]) is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_module"] = module
+            # Copy over the contents to skip `__getattr__` in the future.
+            self.__dict__.update(
+                (k, v) for k, v in module.__dict__.items()
+                if k not in ("__name__", "__spec__", "__loader__")
+            )
+
+        return module
+
+# All modules registered using `lazy_import`.
+_lazy_modules: dict[str, LazyModule] = {}
+
+def lazy_import(name: str) -> LazyModule:
+    """Returns a placeholder for the module `name`, deferring its import until
+    it is first used."""
+
+    if (module := _lazy_modules.get(name)) is None:
+        module = _lazy_modules[name] = LazyModule(name)
+    return module
+
+def load_deferred() -> list[str]:
+    """Imports all lazily imported modules that have not yet been used,
+    returning their names.
+
+    Note:
+        Safe to run in an executor, as imports are serialised by the import
+            system's own locks.
+    """
+
+    loaded = []
+    # Copied as modules may be registered while this runs.
+    for name, module in list(_lazy_modules.items()):
+        if module.__dict__["_lazy_module"] is None:
+            module._load()
+            loaded.append(name)
+
+    return loaded
@@ -0,0 +1,168 @@
+# A monitor of the event loop's scheduling delay, attributing stalls to the
+# code blocking the loop.
+from types import FrameType
+from typing import Optional
+from logger import warning
+from .frames import task_frame
+from . import metrics
+import traceback
+import threading
+import asyncio
+import time
+import sys
+
+_LOOP_LAG_SECONDS = metrics.histogram(
+    "kisumi_loop_lag_seconds",
+    "Delay between when the loop heartbeat was due and when it ran.",
+)
+_LOOP_STALLS = metrics.counter(
+    "kisumi_loop_stalls_total",
+    "Times the event loop was blocked for longer than the threshold.",
+)
+
+class LoopLagMonitor:
+    """Measures the event loop lag using a periodic heartbeat task. A
+    watchdog thread captures the stack of the loop thread whenever the
+    heartbeat is late by more than `threshold` seconds, reporting what was
+    blocking the loop while it still is.
+
+    Note:
+        Reports are rate limited to one per `report_interval` seconds, with
+            the number of suppressed stalls included in the next report.
+    """
+
+    __slots__ = (
+        "interval",
+        "threshold",
+        "report_interval",
+        "_loop",
+        "_loop_thread_id",
+        "_task",
+        "_thread",
+        "_stopped",
+        "_last_beat",
+        "_last_report",
+        "_suppressed",
+    )
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1,
+                 report_interval: float = 60.0) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+        # Monotonic time of the last heartbeat, read by the watchdog thread.
+        self._last_beat = 0.0
+        self._last_report = -report_interval
+        self._suppressed = 0
+
+    @property
+    def running(self) -> bool:
+        """Whether the monitor is currently running."""
+
+        return self._task is not None
+
+    # Public methods.
+    def start(self) -> None:
+        """Starts monitoring the running event loop.
+
+        Note:
+            Must be called from within the event loop.
+        """
+
+        assert not self.running, "The loop lag monitor is already running!"
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+
+        self._task = self._loop.create_task(
+            self.__heartbeat(),
+            name= "loop-lag-heartbeat",
+        )
+        self._thread = threading.Thread(
+            target= self.__watchdog,
+            name= "loop-lag-watchdog",
+            daemon= True,
+        )
+        self._thread.start()
+
+    async def stop(self) -> None:
+        """Stops monitoring the event loop."""
+
+        if not self.running:
+            return
+
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+        self._task = None
+        self._thread = None
+
+    # Private methods.
+    async def __heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+
+            self._last_beat = time.monotonic()
+            _LOOP_LAG_SECONDS.observe(lag)
+            if lag > self.threshold:
+                _LOOP_STALLS.inc()
+
+    def __watchdog(self) -> None:
+        # The stall currently being reported, by its last heartbeat.
+        reported_beat = None
+
+        while not self._stopped.wait(self.threshold / 2):
+            last_beat = self._last_beat
+            late_by = time.monotonic() - last_beat - self.interval
+
+            if late_by <= self.threshold or last_beat == reported_beat:
+                continue
+
+            # Only capture the stack once per stall.
+            reported_beat = last_beat
+            now = time.monotonic()
+            if now - self._last_report < self.report_interval:
+                self._suppressed += 1
+                continue
+
+            self._last_report = now
+            self.__report(late_by)
+
+    def __report(self, late_by: float) -> None:
+        """Logs the stack of the loop thread alongside the running task."""
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else "Unavailable.\n"
+
+        suppressed, self._suppressed = self._suppressed, 0
+        warning(
+            "The event loop has been blocked for %.0fms (%d similar reports "
+            "suppressed).\nRunning task: %s\nLoop thread stack:\n%s",
+            late_by * 1e+3, suppressed, _task_coroutine(frame), stack,
+        )
+
+def _task_coroutine(frame: Optional[FrameType]) -> str:
+    """Describes the coroutine of the task running in the stack of `frame`."""
+
+    if (outermost := task_frame(frame)) is None:
+        return "None (a callback)"
+
+    code = outermost.f_code
+    return f"{code.co_name} ({code.co_filename}:{outermost.f_lineno})"
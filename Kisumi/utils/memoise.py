@@ -0,0 +1,224 @@
+# Single-flight asynchronous memoisation built on top of `LRUCache`.
+from dataclasses import dataclass
+from functools import update_wrapper
+from types import MethodType
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    Optional,
+    TypeVar,
+)
+from .cache import (
+    ALLOWED_IDX,
+    LRUCache,
+    _Sentinel,
+)
+import asyncio
+import time
+
+T = TypeVar("T")
+KeyFunc = Callable[..., ALLOWED_IDX]
+
+@dataclass
+class MemoStats:
+    """Statistics collected for a single memoised coroutine function."""
+
+    calls: int = 0
+    hits: int = 0
+    # Calls that awaited an already in-flight computation.
+    coalesced: int = 0
+    misses: int = 0
+    errors: int = 0
+    # Total time spent inside of the wrapped function.
+    compute_time_ns: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """The ratio of calls that did not result in a computation."""
+
+        return (self.hits + self.coalesced) / self.calls if self.calls else 0.0
+
+    @property
+    def mean_compute_ms(self) -> float:
+        """The mean time taken by a single computation in milliseconds."""
+
+        return self.compute_time_ns / self.misses / 1e+6 if self.misses else 0.0
+
+# A registry of all memoised functions, allowing their stats to be inspected.
+_memoised: dict[str, "MemoisedFunction"] = {}
+
+class MemoisedFunction(Generic[T]):
+    """A wrapper around a coroutine function caching its results inside of an
+    `LRUCache`. Concurrent calls with the same key await a single in-flight
+    computation.
+
+    Note:
+        Exceptions are never cached. All callers awaiting a computation that
+        raised receive the exception.
+        If the caller running a computation is cancelled, the callers
+        awaiting it retry (one of them running it again) rather than being
+        cancelled too.
+    """
+
+    __slots__ = (
+        "_func",
+        "_key",
+        "_cache",
+        "_in_flight",
+        "stats",
+        "__dict__",
+    )
+
+    def __init__(self, func: Callable[..., Awaitable[T]], capacity: int,
+                 ttl: Optional[float], key: Optional[KeyFunc]) -> None:
+        self._func = func
+        self._key = key or _default_key
+        self._cache: LRUCache[T] = LRUCache(
+            capacity,
+            ttl= ttl,
+            name= f"memoise:{func.__module__}.{func.__qualname__}",
+        )
+        self._in_flight: dict[ALLOWED_IDX, asyncio.Future] = {}
+        self.stats = MemoStats()
+
+        update_wrapper(self, func)
+
+    def __repr__(self) -> str:
+        return f"<MemoisedFunction({self.__qualname__}, {self._cache!r})>"
+
+    def __get__(self, instance: Any, owner: Any = None) -> Any:
+        """Binds the memoised function to `instance` when used as a method.
+        The instance then forms a part of the cache key."""
+
+        if instance is None:
+            return self
+        return MethodType(self, instance)
+
+    async def __call__(self, *args, **kwargs) -> T:
+        """Returns the cached result for the arguments if present, else awaits
+        the in-flight or a new computation of the wrapped function."""
+
+        self.stats.calls += 1
+        key = self._key(*args, **kwargs)
+
+        val = self._cache.lookup(key)
+        if not isinstance(val, _Sentinel):
+            self.stats.hits += 1
+            return val
+
+        while (fut := self._in_flight.get(key)) is not None:
+            try:
+                # Shield so a cancelled waiter does not cancel the computation.
+                res = await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # This waiter was cancelled, rather than the computation.
+                if not fut.cancelled():
+                    raise
+                continue
+
+            self.stats.coalesced += 1
+            return res
+
+        fut = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = fut
+        self.stats.misses += 1
+        start = time.perf_counter_ns()
+
+        try:
+            res = await self._func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self.__finish(key, fut)
+            fut.cancel()
+            raise
+        except Exception as e:
+            self.stats.errors += 1
+            self.__finish(key, fut)
+            fut.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting.
+            fut.exception()
+            raise
+        finally:
+            self.stats.compute_time_ns += time.perf_counter_ns() - start
+
+        # The key could have been invalidated during the computation.
+        if self.__finish(key, fut):
+            self._cache.insert(key, res)
+        fut.set_result(res)
+        return res
+
+    # Private methods.
+    def __finish(self, key: ALLOWED_IDX, fut: asyncio.Future) -> bool:
+        """Removes the in-flight future for `key` if it is still `fut`,
+        returning whether it was."""
+
+        if self._in_flight.get(key) is fut:
+            del self._in_flight[key]
+            return True
+        return False
+
+    # Public methods.
+    def invalidate(self, *args, **kwargs) -> bool:
+        """Drops the cached result for the given arguments, returning whether
+        a cached result was present. A computation in-flight for the arguments
+        will not have its result cached."""
+
+        key = self._key(*args, **kwargs)
+        self._in_flight.pop(key, None)
+        return self._cache.discard(key)
+
+    def clear(self) -> None:
+        """Drops all of the cached results."""
+
+        self._in_flight.clear()
+        self._cache.clear()
+
+    @property
+    def cache(self) -> LRUCache[T]:
+        """The underlying cache storing the results."""
+
+        return self._cache
+
+def memoise(capacity: int = 128, ttl: Optional[float] = None,
+            key: Optional[KeyFunc] = None) -> Callable[
+                [Callable[..., Awaitable[T]]], MemoisedFunction[T]
+            ]:
+    """A decorator caching the results of a coroutine function inside of an
+    `LRUCache`, preventing concurrent calls with the same arguments from
+    running it more than once.
+
+    Args:
+        capacity (int): The maximum number of results cached.
+        ttl (float, optional): Time in seconds after which a result expires.
+        key (Callable, optional): A function taking the same arguments as the
+            decorated function and returning the cache key. Defaults to a
+            tuple of the arguments.
+
+    Example:
+    ```py
+    @memoise(capacity= 1000, ttl= 60)
+    async def fetch_user(user_id: int) -> Optional[User]:
+        ...
+
+    fetch_user.invalidate(1000)
+    ```
+    """
+
+    def wrapper(func: Callable[..., Awaitable[T]]) -> MemoisedFunction[T]:
+        memoised = MemoisedFunction(func, capacity, ttl, key)
+        _memoised[f"{func.__module__}.{func.__qualname__}"] = memoised
+        return memoised
+
+    return wrapper
+
+def memoised_stats() -> dict[str, MemoStats]:
+    """Returns the statistics of all memoised functions by their full name."""
+
+    return {name: func.stats for name, func in _memoised.items()}
+
+def _default_key(*args, **kwargs) -> ALLOWED_IDX:
+    """Creates a cache key from the arguments of a call. Always keyed on the
+    tuple of arguments, so that `f((1, 2))` and `f(1, 2)` do not collide."""
+
+    return (args, tuple(sorted(kwargs.items()))) if kwargs else args
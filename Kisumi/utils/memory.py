@@ -0,0 +1,147 @@
+# Introspection of the memory used by the server, by object type and through
+# allocation snapshots.
+from dataclasses import dataclass, asdict
+from typing import (
+    Any,
+    Callable,
+    Optional,
+)
+from .cache import live_caches
+import tracemalloc
+import sys
+import gc
+
+SizeFunc = Callable[[Any], int]
+
+@dataclass
+class TypeUsage:
+    """The number of live objects of a type alongside their approximate
+    size."""
+
+    name: str
+    count: int = 0
+    bytes: int = 0
+
+def shallow_size(obj: Any) -> int:
+    """Approximates the size of `obj` alongside its attribute dictionary,
+    without following any references."""
+
+    size = sys.getsizeof(obj)
+    if (attrs := getattr(obj, "__dict__", None)) is not None:
+        size += sys.getsizeof(attrs)
+    return size
+
+def type_usage(types: dict[type, Optional[SizeFunc]]) -> list[TypeUsage]:
+    """Counts all live objects of the given `types` (including subclasses),
+    sizing each using the function they map to (`shallow_size` if `None`).
+
+    Note:
+        This walks every object tracked by the garbage collector, so should
+            only be used on demand.
+    """
+
+    usage = {typ: TypeUsage(typ.__qualname__) for typ in types}
+    sizers = {typ: sizeof or shallow_size for typ, sizeof in types.items()}
+    bases = tuple(types)
+
+    for obj in gc.get_objects():
+        if not isinstance(obj, bases):
+            continue
+
+        for typ in type(obj).__mro__:
+            if typ in usage:
+                usage[typ].count += 1
+                usage[typ].bytes += sizers[typ](obj)
+                break
+
+    return list(usage.values())
+
+def cache_usage() -> list[dict[str, Any]]:
+    """Reports the size and statistics of every live `LRUCache`."""
+
+    return [
+        {
+            "name": cache.name or repr(cache),
+            **asdict(cache.stats),
+        }
+        for cache in live_caches()
+    ]
+
+def gc_usage() -> dict[str, Any]:
+    """Reports the state of the garbage collector, which is responsible for
+    freeing objects kept alive by reference cycles."""
+
+    return {
+        "counts": gc.get_count(),
+        "thresholds": gc.get_threshold(),
+        "generations": gc.get_stats(),
+        "uncollectable": len(gc.garbage),
+    }
+
+class AllocationTracker:
+    """Takes `tracemalloc` snapshots on demand, comparing the current
+    allocations against a baseline snapshot.
+
+    Note:
+        Taking and comparing snapshots walks every traced allocation, so
+            `snapshot` and `diff` should be ran in an executor.
+    """
+
+    __slots__ = (
+        "_baseline",
+    )
+
+    def __init__(self) -> None:
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        """Whether allocations are currently being traced."""
+
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, frames: int = 1) -> int:
+        """Takes a new baseline snapshot, starting tracing (storing `frames`
+        frames per allocation) if not yet started.
+
+        Note:
+            Only allocations made after tracing starts are visible, so the
+                first baseline is mostly empty.
+
+        Returns:
+            The number of traced allocations in the snapshot.
+        """
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+        self._baseline = self.__take()
+        return len(self._baseline.traces)
+
+    def diff(self, limit: int = 25, group_by: str = "lineno") -> list[str]:
+        """Compares the current allocations against the baseline, returning
+        the `limit` largest differences grouped by `group_by` (`lineno`,
+        `filename` or `traceback`).
+
+        Note:
+            Raises `RuntimeError` if no baseline has been taken.
+        """
+
+        if self._baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError("No baseline snapshot has been taken!")
+
+        stats = self.__take().compare_to(self._baseline, group_by)
+        return [str(stat) for stat in stats[:limit]]
+
+    def stop(self) -> None:
+        """Stops tracing, discarding the baseline."""
+
+        self._baseline = None
+        tracemalloc.stop()
+
+    def __take(self) -> tracemalloc.Snapshot:
+        # Ignore the allocations of the snapshots themselves.
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
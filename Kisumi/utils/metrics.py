@@ -0,0 +1,306 @@
+# A lightweight in-process metrics registry, rendered in the Prometheus text
+# exposition format.
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+from contextlib import contextmanager
+from bisect import bisect_left
+import inspect
+import math
+import time
+
+# Suited to timings of anything from a single packet to a bcrypt comparison.
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# Suited to counts (such as broadcast recipients) and sizes in bytes.
+SIZE_BUCKETS = (
+    1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000,
+    50000, 100000,
+)
+
+Collector = Callable[[], Any]
+
+class Counter:
+    """A monotonically increasing value."""
+
+    __slots__ = (
+        "value",
+    )
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increments the counter by `amount`."""
+
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        """Sets the value of the counter.
+
+        Note:
+            Meant for collectors mirroring counts kept elsewhere.
+        """
+
+        self.value = value
+
+    def _samples(self, name: str, labels: str) -> Iterator[str]:
+        yield f"{name}{labels} {_format_value(self.value)}"
+
+class Gauge:
+    """A value that may both increase and decrease."""
+
+    __slots__ = (
+        "value",
+    )
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increments the gauge by `amount`."""
+
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        """Decrements the gauge by `amount`."""
+
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        """Sets the gauge to `value`."""
+
+        self.value = value
+
+    @contextmanager
+    def track_in_progress(self) -> Iterator[None]:
+        """Increments the gauge for the duration of the block."""
+
+        self.value += 1
+        try:
+            yield
+        finally:
+            self.value -= 1
+
+    def _samples(self, name: str, labels: str) -> Iterator[str]:
+        yield f"{name}{labels} {_format_value(self.value)}"
+
+class Histogram:
+    """Counts observations into a fixed set of buckets, alongside their sum."""
+
+    __slots__ = (
+        "_bounds",
+        "_counts",
+        "sum",
+        "count",
+    )
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self._bounds = buckets
+        # The final bucket holds observations above all bounds (+Inf).
+        self._counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Records a single observation of `value`."""
+
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the duration of the block in seconds."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _samples(self, name: str, labels: str) -> Iterator[str]:
+        # Bucket labels have to be merged with the existing labels.
+        prefix = labels[:-1] + "," if labels else "{"
+
+        cumulative = 0
+        for bound, count in zip(self._bounds, self._counts):
+            cumulative += count
+            yield f'{name}_bucket{prefix}le="{_format_value(bound)}"}} {cumulative}'
+        yield f'{name}_bucket{prefix}le="+Inf"}} {self.count}'
+        yield f"{name}_sum{labels} {_format_value(self.sum)}"
+        yield f"{name}_count{labels} {self.count}"
+
+M = TypeVar("M", Counter, Gauge, Histogram)
+
+class MetricFamily(Generic[M]):
+    """A named metric, holding a separate child metric for every combination
+    of its label values."""
+
+    __slots__ = (
+        "name",
+        "description",
+        "type",
+        "label_names",
+        "_factory",
+        "_children",
+    )
+
+    def __init__(self, name: str, description: str, type: str,
+                 label_names: tuple[str, ...], factory: Callable[[], M]) -> None:
+        self.name = name
+        self.description = description
+        self.type = type
+        self.label_names = label_names
+        self._factory = factory
+        self._children: dict[tuple[str, ...], M] = {}
+
+        # Unlabelled metrics have a single child.
+        if not label_names:
+            self._children[()] = factory()
+
+    def labels(self, *values: str) -> M:
+        """Returns the child metric for the given label `values`, creating it
+        if it does not yet exist.
+
+        Note:
+            Keep a reference to the child on hot paths to skip the lookup.
+        """
+
+        try:
+            return self._children[values]
+        except KeyError:
+            assert len(values) == len(self.label_names), \
+                f"Metric {self.name} takes labels {self.label_names}!"
+            child = self._children[values] = self._factory()
+            return child
+
+    # Unlabelled metrics are used directly.
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._children[()], attr)
+
+    def render(self) -> Iterator[str]:
+        """Yields the lines of the metric in the text exposition format."""
+
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.type}"
+
+        for values, child in self._children.items():
+            yield from child._samples(self.name, self.__format_labels(values))
+
+    def __format_labels(self, values: tuple[str, ...]) -> str:
+        if not values:
+            return ""
+
+        return "{" + ",".join(
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.label_names, values)
+        ) + "}"
+
+class MetricsRegistry:
+    """A collection of metrics and collectors. Not thread-safe, as all
+    metrics are meant to be updated from the event loop."""
+
+    __slots__ = (
+        "_families",
+        "_collectors",
+    )
+
+    def __init__(self) -> None:
+        self._families: dict[str, MetricFamily] = {}
+        self._collectors: list[Collector] = []
+
+    def __len__(self) -> int:
+        """Returns the number of registered metrics."""
+
+        return len(self._families)
+
+    # Public methods.
+    def counter(self, name: str, description: str,
+                labels: tuple[str, ...] = ()) -> MetricFamily[Counter]:
+        """Registers a new counter metric."""
+
+        return self.__register(name, description, "counter", labels, Counter)
+
+    def gauge(self, name: str, description: str,
+              labels: tuple[str, ...] = ()) -> MetricFamily[Gauge]:
+        """Registers a new gauge metric."""
+
+        return self.__register(name, description, "gauge", labels, Gauge)
+
+    def histogram(self, name: str, description: str,
+                  labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                  ) -> MetricFamily[Histogram]:
+        """Registers a new histogram metric with the upper bounds `buckets`."""
+
+        assert list(buckets) == sorted(buckets), "Histogram buckets must be sorted!"
+        return self.__register(
+            name, description, "histogram", labels,
+            lambda: Histogram(buckets),
+        )
+
+    def add_collector(self, collector: Collector) -> None:
+        """Registers a (coroutine) function that is called before every render,
+        allowing for metrics mirroring state kept elsewhere to be updated."""
+
+        self._collectors.append(collector)
+
+    def get(self, name: str) -> Optional[MetricFamily]:
+        """Returns the metric registered as `name`, if any."""
+
+        return self._families.get(name)
+
+    async def render(self) -> str:
+        """Runs all collectors, then renders every metric in the Prometheus
+        text exposition format."""
+
+        for collector in self._collectors:
+            res = collector()
+            if inspect.isawaitable(res):
+                await res
+
+        lines = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        lines.append("")
+
+        return "\n".join(lines)
+
+    # Private methods.
+    def __register(self, name: str, description: str, type: str,
+                   labels: tuple[str, ...], factory: Callable[[], M]) -> MetricFamily[M]:
+        assert name not in self._families, f"Metric {name} already registered!"
+
+        family = self._families[name] = MetricFamily(
+            name, description, type, labels, factory,
+        )
+        return family
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# The registry exposed by the metrics endpoint.
+REGISTRY = MetricsRegistry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
@@ -0,0 +1,149 @@
+# A sampling CPU profiler of all threads, producing folded stacks which may be
+# directly rendered as a flamegraph.
+from collections import Counter
+from types import FrameType
+from typing import Optional
+from .frames import task_frame
+from .time import Timer
+import threading
+import asyncio
+import sys
+
+# Profiles are bounded so they are safe to run against a live server.
+MIN_DURATION = 1.0
+MAX_DURATION = 30.0
+MIN_INTERVAL = 0.001
+
+class ProfileInProgress(Exception):
+    """Raised when a profile is requested while another is running."""
+
+class SamplingProfiler:
+    """Periodically samples the stacks of every thread from a background
+    thread. Samples of the event loop thread are rooted at the coroutine of
+    the asyncio task running at the time."""
+
+    __slots__ = (
+        "interval",
+        "samples",
+        "sample_count",
+        "_loop_thread_id",
+        "_thread",
+        "_stopped",
+    )
+
+    def __init__(self, interval: float = 0.005,
+                 loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.interval = max(interval, MIN_INTERVAL)
+        self.samples: Counter[str] = Counter()
+        self.sample_count = 0
+
+        # Expected to be created from within the loop's thread.
+        self._loop_thread_id = threading.get_ident() if loop is not None else None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    # Public methods.
+    def start(self) -> None:
+        """Starts sampling in a background thread."""
+
+        assert self._thread is None, "The profiler has already been started!"
+
+        self._thread = threading.Thread(
+            target= self.__run,
+            name= "kisumi-profiler",
+            daemon= True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling, waiting for the sampling thread to exit."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        """Renders the samples in the folded stack format, one stack per
+        line followed by its sample count."""
+
+        return "".join(
+            f"{stack} {count}\n"
+            for stack, count in self.samples.most_common()
+        )
+
+    # Private methods.
+    def __run(self) -> None:
+        own_id = threading.get_ident()
+
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                root = names.get(thread_id, f"thread-{thread_id}")
+                if thread_id == self._loop_thread_id:
+                    root = f"{root};{_task_label(frame)}"
+
+                self.samples[f"{root};{_fold_frame(frame)}"] += 1
+
+            self.sample_count += 1
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    # `;` separates the frames and spaces the count in the folded format.
+    return (
+        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+            .replace(";", ":")
+            .replace(" ", "_")
+    )
+
+def _task_label(frame: FrameType) -> str:
+    """Labels the task running in the stack ending at `frame`, found from the
+    stack itself (see `task_frame`)."""
+
+    if (coro := task_frame(frame)) is None:
+        return "callbacks"
+    return f"task:{_frame_label(coro)}"
+
+def _fold_frame(frame: FrameType) -> str:
+    """Folds the stack ending at `frame` from the outermost frame inwards."""
+
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+
+    return ";".join(reversed(labels))
+
+# Only a single profile may run at once, bounding the overhead.
+_profile_lock = asyncio.Lock()
+
+async def profile(duration: float, interval: float = 0.005) -> tuple[str, int, Timer]:
+    """Profiles the entire process for `duration` seconds (clamped between
+    `MIN_DURATION` and `MAX_DURATION`), sampling every `interval` seconds.
+
+    Note:
+        Raises `ProfileInProgress` if a profile is already running.
+
+    Returns:
+        Tuple of the folded stacks, the number of samples taken and the
+            timer of the profile.
+    """
+
+    if _profile_lock.locked():
+        raise ProfileInProgress
+
+    duration = min(max(duration, MIN_DURATION), MAX_DURATION)
+
+    async with _profile_lock:
+        profiler = SamplingProfiler(interval, asyncio.get_running_loop())
+        with Timer() as timer:
+            profiler.start()
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                profiler.stop()
+
+    return profiler.folded(), profiler.sample_count, timer
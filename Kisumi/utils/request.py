@@ -10,7 +10,7 @@ def get_ip(req: Request) -> str:
 
 async def geolocate_request(req: Request) -> IPLocation:
     """Geolocates the request IP, returning the `IPLocation` object
-    for the request."""
+    for the request (`IPLocation.default()` if the IP is unknown)."""
 
     return await repos.geoloc.from_ip(
         get_ip(req),
@@ -0,0 +1,183 @@
+# A dependency aware, concurrent startup task runner.
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+)
+from logger import info
+from .time import Timer
+import asyncio
+import time
+
+StartupFunc = Callable[[], Awaitable[Any]]
+
+@dataclass
+class StartupTask:
+    """A single startup task alongside the names of the tasks it depends on."""
+
+    name: str
+    func: StartupFunc
+    depends_on: tuple[str, ...] = ()
+
+@dataclass
+class TaskTiming:
+    """The timing results of a single completed startup task."""
+
+    name: str
+    # Offsets from the start of the startup process.
+    start_ns: int
+    end_ns: int
+    timer: Timer
+    # The dependency which finished last, delaying the start of this task.
+    blocked_by: Optional[str] = None
+
+@dataclass
+class StartupReport:
+    """The timing results of an entire startup process."""
+
+    timings: dict[str, TaskTiming] = field(default_factory= dict)
+    total_ns: int = 0
+
+    def critical_path(self) -> list[TaskTiming]:
+        """Returns the chain of tasks which determined the total startup
+        time, in the order they were ran."""
+
+        if not self.timings:
+            return []
+
+        path = []
+        current = max(self.timings.values(), key= lambda t: t.end_ns)
+        while current is not None:
+            path.append(current)
+            current = self.timings.get(current.blocked_by)
+
+        return path[::-1]
+
+    def log(self) -> None:
+        """Logs the timing of every task alongside the critical path."""
+
+        for timing in sorted(self.timings.values(), key= lambda t: t.start_ns):
+            info("Startup task %s took %s (started at +%.2fms)",
+                 timing.name, timing.timer.time_dif_str, timing.start_ns / 1e+6)
+
+        path = self.critical_path()
+        info(
+            "Startup took %.2fms. Critical path: %s",
+            self.total_ns / 1e+6,
+            " -> ".join(f"{t.name} ({t.timer.time_dif_str})" for t in path),
+        )
+
+class StartupGraph:
+    """A collection of startup tasks which declare their dependencies. Tasks
+    that do not depend on each other are ran concurrently."""
+
+    __slots__ = (
+        "_tasks",
+    )
+
+    def __init__(self) -> None:
+        self._tasks: dict[str, StartupTask] = {}
+
+    def __len__(self) -> int:
+        """Returns the number of registered tasks."""
+
+        return len(self._tasks)
+
+    # Public methods.
+    def add(self, name: str, func: StartupFunc,
+            depends_on: tuple[str, ...] = ()) -> None:
+        """Registers the coroutine function `func` as the startup task `name`,
+        which will only be ran once all tasks in `depends_on` complete."""
+
+        assert name not in self._tasks, f"Startup task {name} already registered!"
+
+        self._tasks[name] = StartupTask(
+            name= name,
+            func= func,
+            depends_on= depends_on,
+        )
+
+    async def run(self) -> StartupReport:
+        """Runs all of the registered tasks, respecting their dependencies.
+
+        Note:
+            If any task fails, all others are cancelled and the exception is
+            raised.
+        """
+
+        self.__validate()
+
+        report = StartupReport()
+        start = time.perf_counter_ns()
+        running: dict[str, asyncio.Task] = {}
+
+        async def run_task(task: StartupTask) -> None:
+            blocked_by = None
+            if task.depends_on:
+                await asyncio.gather(*(running[dep] for dep in task.depends_on))
+                blocked_by = max(
+                    task.depends_on,
+                    key= lambda dep: report.timings[dep].end_ns,
+                )
+
+            task_start = time.perf_counter_ns() - start
+            with Timer() as timer:
+                await task.func()
+
+            report.timings[task.name] = TaskTiming(
+                name= task.name,
+                start_ns= task_start,
+                end_ns= time.perf_counter_ns() - start,
+                timer= timer,
+                blocked_by= blocked_by,
+            )
+
+        for task in self._tasks.values():
+            running[task.name] = asyncio.create_task(
+                run_task(task),
+                name= f"startup:{task.name}",
+            )
+
+        try:
+            await asyncio.gather(*running.values())
+        except BaseException:
+            for task in running.values():
+                task.cancel()
+            raise
+
+        report.total_ns = time.perf_counter_ns() - start
+        return report
+
+    # Private methods.
+    def __validate(self) -> None:
+        """Ensures that all dependencies exist and that there are no cycles.
+
+        Note:
+            Raises `ValueError` on an invalid graph.
+        """
+
+        for task in self._tasks.values():
+            for dep in task.depends_on:
+                if dep not in self._tasks:
+                    raise ValueError(
+                        f"Startup task {task.name} depends on unknown task {dep}!"
+                    )
+
+        # Kahn's algorithm, checking every task can be ordered.
+        remaining = {name: len(task.depends_on) for name, task in self._tasks.items()}
+        ready = [name for name, count in remaining.items() if not count]
+        ordered = 0
+
+        while ready:
+            name = ready.pop()
+            ordered += 1
+            for task in self._tasks.values():
+                if name in task.depends_on:
+                    remaining[task.name] -= 1
+                    if not remaining[task.name]:
+                        ready.append(task.name)
+
+        if ordered != len(self._tasks):
+            raise ValueError("Startup tasks contain a dependency cycle!")
@@ -41,10 +41,11 @@ class Timer:
         assert self._start > 0
 
     # Context manager stuff.
-    def __enter__(self) -> None:
+    def __enter__(self) -> "Timer":
         self.start()
+        return self
     
-    def __exit__(self) -> None:
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         self.end()
     
     # Properties related to time differences.
@@ -78,11 +79,11 @@ class Timer:
         appropriate unit and stating its short form."""
 
         for unit, min in _TIME_SCALE:
-            if self.time_dif_ns > min:
+            if self.time_dif_ns >= min:
                 # FIXME: This is code repetition of the properties above. Currently
                 # unable to thing of a way that allows us to use them without
                 # triggering their execution.
-                return f"{self.time_dif_ns / min:.2f}{unit}"
+                return f"{self.time_dif_ns / (min or 1):.2f}{unit}"
         # Sanity check.
         assert False, "Timer string generation exited the range of possible time?"
 
@@ -103,8 +104,8 @@ class PrintingPerfTimer(Timer):
     
     # This is rather inefficient but shall rarely be used. We have to do
     # string based checks as we dont want data passed around in a weird manner.
-    def __exit__(self, exc_type, *_) -> None:
-        super().__exit__()
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        super().__exit__(exc_type, exc_val, exc_tb)
 
         mid_word = f"{Ansi.RED!r}failed in" if exc_type else "took"
         col = Ansi.WHITE
@@ -115,6 +116,6 @@ class PrintingPerfTimer(Timer):
                 break
 
         if self._name is not None:
-            info(f"The execution of {self._name} {mid_word} {col!r}{self.time_dif_str}")
+            info("The execution of %s %s %r%s", self._name, mid_word, col, self.time_dif_str)
         else:
-            info(f"Execution {mid_word} {col!r}{self.time_dif_str}")
+            info("Execution %s %r%s", mid_word, col, self.time_dif_str)
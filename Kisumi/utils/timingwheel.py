@@ -0,0 +1,113 @@
+# A hashed timing wheel, scheduling large numbers of timeouts without a
+# timer (or task) for each.
+from typing import (
+    Generic,
+    Hashable,
+    Optional,
+    TypeVar,
+)
+import math
+import time
+
+K = TypeVar("K", bound= Hashable)
+
+class TimingWheel(Generic[K]):
+    """Schedules keys to expire after a delay, with a precision of
+    `resolution` seconds. Scheduling, rescheduling and cancelling are O(1),
+    with expired keys collected by calling `advance` periodically.
+
+    Note:
+        Keys are hashed into `slots` buckets by their deadline tick. A
+            bucket may hold keys due on later rotations of the wheel, which
+            are left in place until their tick is reached.
+        Times are from `time.monotonic` unless given explicitly.
+    """
+
+    __slots__ = (
+        "resolution",
+        "_buckets",
+        "_slot_of",
+        "_origin",
+        "_tick",
+    )
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512,
+                 now: Optional[float] = None) -> None:
+        assert resolution > 0, "The wheel resolution must be positive."
+        assert slots > 0, "The wheel requires at least one slot."
+
+        self.resolution = resolution
+        # Each bucket maps its keys to the tick they are due on.
+        self._buckets: list[dict[K, int]] = [{} for _ in range(slots)]
+        self._slot_of: dict[K, int] = {}
+        self._origin = time.monotonic() if now is None else now
+        # The last tick expired by `advance`.
+        self._tick = 0
+
+    def __len__(self) -> int:
+        """Returns the number of scheduled keys."""
+
+        return len(self._slot_of)
+
+    def __contains__(self, key: K) -> bool:
+        """Checks if `key` is scheduled."""
+
+        return key in self._slot_of
+
+    # Private methods.
+    def __tick_at(self, t: float) -> int:
+        return math.floor((t - self._origin) / self.resolution)
+
+    # Public methods.
+    def schedule(self, key: K, delay: float, now: Optional[float] = None) -> None:
+        """Schedules `key` to expire `delay` seconds from `now`, replacing
+        its previous deadline if already scheduled."""
+
+        if now is None:
+            now = time.monotonic()
+
+        # Rounded up so keys never expire early, and never due before the
+        # next tick as past ticks were already expired.
+        deadline = max(
+            math.ceil((now + delay - self._origin) / self.resolution),
+            self._tick + 1,
+        )
+        slot = deadline % len(self._buckets)
+
+        if (old_slot := self._slot_of.get(key)) is not None:
+            del self._buckets[old_slot][key]
+
+        self._buckets[slot][key] = deadline
+        self._slot_of[key] = slot
+
+    def cancel(self, key: K) -> bool:
+        """Unschedules `key`, returning whether it was scheduled."""
+
+        if (slot := self._slot_of.pop(key, None)) is None:
+            return False
+
+        del self._buckets[slot][key]
+        return True
+
+    def advance(self, now: Optional[float] = None) -> list[K]:
+        """Advances the wheel to `now`, unscheduling and returning all keys
+        which have expired since the last call."""
+
+        target = self.__tick_at(time.monotonic() if now is None else now)
+        steps = target - self._tick
+        if steps <= 0:
+            return []
+
+        expired = []
+        slots = len(self._buckets)
+        # Past a full rotation, every bucket has been visited.
+        for tick in range(self._tick + 1, self._tick + 1 + min(steps, slots)):
+            bucket = self._buckets[tick % slots]
+            due = [key for key, deadline in bucket.items() if deadline <= target]
+            for key in due:
+                del bucket[key]
+                del self._slot_of[key]
+            expired.extend(due)
+
+        self._tick = target
+        return expired